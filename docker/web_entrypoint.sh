@@ -1,2 +1,6 @@
 #!/bin/sh
-dockerize -timeout 60s -wait tcp://database:3306 flask run -h 0.0.0.0 -p5000 --reload
+if [ "$ENVIRONMENT" = "production" ]; then
+    dockerize -timeout 60s -wait tcp://database:3306 starfinder_gunicorn_server
+else
+    dockerize -timeout 60s -wait tcp://database:3306 flask run -h 0.0.0.0 -p5000 --reload
+fi
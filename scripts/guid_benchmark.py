@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the GUID generators in starfinder.db.utils.
+
+Compares the original string slicing implementation against the integer
+generator, block allocation and the binary fast path, and checks that every
+path hands out strictly increasing ids within the process.
+
+    python scripts/guid_benchmark.py [count]
+"""
+import sys
+import timeit
+import uuid
+
+from starfinder.db import utils
+
+
+def legacy_generate_guid(shard=0, base_uuid=None):
+    base_uuid = base_uuid or str(uuid.uuid1())
+    shard_id = "{:03X}".format(shard)
+    return uuid.UUID(''.join([base_uuid[15:18],
+                              base_uuid[9],
+                              base_uuid[10:13],
+                              base_uuid[:8],
+                              base_uuid[14],
+                              base_uuid[19:23],
+                              base_uuid[24:33],
+                              shard_id]))
+
+
+def check_monotonic(name, ids):
+    if any(a >= b for a, b in zip(ids, ids[1:])):
+        print("{}: ids are NOT monotonic".format(name))
+        sys.exit(1)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    block = 1000
+    runs = {
+        "legacy": lambda: [legacy_generate_guid() for _ in range(count)],
+        "generate_guid": lambda: [utils.generate_guid()
+                                  for _ in range(count)],
+        "generate_guids": lambda: [guid for _ in range(count // block)
+                                   for guid in utils.generate_guids(block)],
+        "generate_guid_bytes": lambda: [
+            guid for _ in range(count // block)
+            for guid in utils.generate_guid_bytes(block)],
+    }
+    baseline = None
+    for name, run in runs.items():
+        if name != "legacy":
+            check_monotonic(name, run())
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        baseline = baseline or seconds
+        print("{:<20} {:>12,.0f} ids/s {:>6.1f}x".format(
+            name, count / seconds, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
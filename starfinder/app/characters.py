@@ -1,10 +1,12 @@
+import uuid
+
 import requests
 
 import flask
 from flask import url_for, render_template, request, redirect
 
-from starfinder import forms, config, logging
-from starfinder.db import models
+from starfinder import exception, export, forms, config, logging, prerequisites, progression, sheets, spell_lists
+from starfinder.db import models, saves
 from starfinder.helpers import helper
 
 CONF = config.CONF
@@ -16,11 +18,34 @@ URL_PREFIX = '/characters'
 BLUEPRINT = characters
 
 
+def _page_size():
+	return CONF.get_int("characters.page_size", 50)
+
+
+def _cursor_arg():
+	cursor = request.args.get('after')
+	if not cursor:
+		return None
+	try:
+		return uuid.UUID(hex=cursor)
+	except ValueError:
+		flask.abort(400)
+
+
+def _character(char_id, profile=None):
+	character = saves.SAVES.overlay(models.Character.get(char_id, profile=profile))
+	if character is None:
+		flask.abort(404)
+	return character
+
+
 @characters.route('/')
 def view_all():
-	characters = models.Character.query.all()
+	characters, next_cursor = models.CharacterSheet.cards(
+		after=_cursor_arg(), limit=_page_size())
 	context = {
 		'characters': characters,
+		'next_cursor': next_cursor.hex if next_cursor else None,
 		'creation_form': forms.CharacterCreateForm(),
 		'deletion_form': forms.CharacterDeleteForm(),
 		'current_route': 'characters.view_all'
@@ -28,11 +53,25 @@ def view_all():
 	return render_template('characters/show.html', **context)
 
 
+@characters.route('/cards', methods=['GET'])
+def cards():
+	characters, next_cursor = models.CharacterSheet.cards(
+		after=_cursor_arg(), limit=_page_size())
+	return flask.jsonify({
+		'characters': [{'id': str(char.id),
+						'name': char.name,
+						'race': char.race} for char in characters],
+		'next': next_cursor.hex if next_cursor else None
+	})
+
+
 @characters.route('/new_character', methods=['POST'])
 def create():
 	form = forms.CharacterCreateForm(request.form)
 	char = models.Character(name=form.name.data)
 	models.Session.add(char)
+	models.Session.flush()
+	sheets.rebuild([char.id])
 	models.Session.commit()
 	return redirect(url_for('characters.view_all', char_id=char.id))
 
@@ -40,15 +79,98 @@ def create():
 @characters.route('/update_character', methods=['POST'])
 def update():
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(form.id.data)
-	helper.update_character(form, character)
+	character = _character(form.id.data)
+	try:
+		helper.update_character(form, character)
+	except exception.CharacterVersionConflict as e:
+		LOG.info(e)
+		flask.abort(409)
+	except exception.InvalidColumnValue as e:
+		LOG.info(e)
+		flask.abort(400)
 	return redirect(url_for('characters.view_all', char_id=character.id))
 
 
+@characters.route('/<uuid:char_id>/export', methods=['GET'])
+def export_character(char_id):
+	document = export.export_character(char_id)
+	if document is None:
+		flask.abort(404)
+	return flask.Response(export.dumps(document), mimetype='application/json')
+
+
+@characters.route('/export', methods=['GET'])
+def export_characters():
+	try:
+		user_id = uuid.UUID(hex=request.args.get('user_id', ''))
+	except ValueError:
+		flask.abort(400)
+	documents = export.iter_characters(
+		user_id, request.args.get('chunk_size', export.DEFAULT_CHUNK_SIZE, type=int))
+	return flask.Response(flask.stream_with_context(export.ndjson(documents)),
+						  mimetype='application/x-ndjson')
+
+
+@characters.route('/<uuid:char_id>/inventory', methods=['GET'])
+def inventory(char_id):
+	inventory = models.Character.inventories([char_id]).get(char_id)
+	if inventory is None:
+		flask.abort(404)
+	return flask.jsonify({
+		'inventory': inventory._asdict(),
+		'items': [dict(item._asdict(), id=str(item.id)) for item in
+				  models.Equipment.items(character_id=char_id, limit=None)]
+	})
+
+
+@characters.route('/<uuid:char_id>/builder', methods=['GET'])
+def builder_state(char_id):
+	character = _character(char_id, "full_sheet")
+	with_options = request.args.get('options', 'true').lower() != 'false'
+	return flask.jsonify(helper.builder_state(character, with_options))
+
+
+@characters.route('/<uuid:char_id>/builder', methods=['POST', 'PATCH'])
+def builder_update(char_id):
+	character = _character(char_id, "full_sheet")
+	try:
+		patch = helper.update_builder(request.get_json(silent=True) or {},
+									  character)
+	except exception.CharacterVersionConflict as e:
+		return flask.jsonify({'errors': {'version': [str(e)]}}), 409
+	except exception.InvalidColumnValue as e:
+		return flask.jsonify({'errors': {e.column: [str(e)]}}), 400
+	if patch.errors:
+		return flask.jsonify({'errors': patch.errors}), 400
+	return flask.jsonify(helper.builder_state(character, with_options=False))
+
+
+@characters.route('/<uuid:char_id>/level_up', methods=['GET'])
+def level_up_preview(char_id):
+	character = _character(char_id)
+	level = character.level or 1
+	to_level = request.args.get('level', level + 1, type=int)
+	if to_level <= level or to_level > progression.MAX_LEVEL:
+		flask.abort(400)
+	return flask.jsonify(progression.level_up(
+		character.class_id, character.theme_id, level, to_level))
+
+
+@characters.route('/<uuid:char_id>/feats/eligible', methods=['GET'])
+def eligible_feats(char_id):
+	character = _character(char_id, "feats")
+	eligibility = prerequisites.eligibility(character)
+	for feat_id in request.args.getlist('add', type=int):
+		eligibility.add(feat_id)
+	for feat_id in request.args.getlist('remove', type=int):
+		eligibility.remove(feat_id)
+	return flask.jsonify({'feat_id': eligibility.feat_ids()})
+
+
 @characters.route('/race_selection/<uuid:char_id>', methods=['GET'])
 def race_selection(char_id):
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -61,7 +183,7 @@ def race_selection(char_id):
 @characters.route('/theme_selection/<uuid:char_id>', methods=['GET'])
 def theme_selection(char_id):
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -74,7 +196,7 @@ def theme_selection(char_id):
 @characters.route('/class_selection/<uuid:char_id>', methods=['GET'])
 def class_selection(char_id):
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -87,7 +209,7 @@ def class_selection(char_id):
 @characters.route('/ability_allocation/<uuid:char_id>', methods=['GET'])
 def ability_allocation(char_id):
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -99,11 +221,13 @@ def ability_allocation(char_id):
 
 @characters.route('/class_options/<uuid:char_id>', methods=['GET'])
 def class_option_selection(char_id):
-	#form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	form = forms.CharacterUpdateForm(request.form)
+	character = _character(char_id, "builder")
+	char_class = progression.for_class(character.class_id)
 	context = {
 		'form': form,
 		'character': character,
+		'progression': char_class.at(character.level) if char_class else None,
 		'next': 'characters.spells_selection',
 		'previous': 'characters.ability_allocation'
 	}
@@ -113,20 +237,25 @@ def class_option_selection(char_id):
 @characters.route('/spells_selection/<uuid:char_id>', methods=['GET'])
 def spells_selection(char_id):
 	form = forms.CharacterSpellsForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
+	form.character_id.choices = forms.character_options(
+		character.user_id, character.id)
+	spell_list = spell_lists.for_class(character.class_id)
+	form.spell_id.choices = spell_list.through(
+		spell_lists.max_spell_level(character.level)) if spell_list else []
 	context = {
 		'form': form,
 		'character': character,
 		'next': 'characters.skills_allocation',
-		'previous': 'characters.option_selection'
+		'previous': 'characters.class_option_selection'
 	}
-	return render_template('characters/builder/class_options.html', **context)
+	return render_template('characters/builder/spells.html', **context)
 
 
 @characters.route('/skills_allocation/<uuid:char_id>', methods=['GET'])
 def skills_allocation(char_id):
 	form = forms.CharacterSkillsForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -139,7 +268,12 @@ def skills_allocation(char_id):
 @characters.route('/feat_selection/<uuid:char_id>', methods=['GET'])
 def feat_selection(char_id):
 	form = forms.CharacterFeatsForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "feats")
+	form.character_id.choices = forms.character_options(
+		character.user_id, character.id)
+	eligible = set(prerequisites.eligibility(character).feat_ids())
+	form.feat_id.choices = [(value, label) for value, label in form.feat_id.choices
+							if int(value) in eligible]
 	context = {
 		'form': form,
 		'character': character,
@@ -152,7 +286,7 @@ def feat_selection(char_id):
 @characters.route('/alignment_selection/<uuid:char_id>', methods=['GET'])
 def alignment_selection(char_id):
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -165,7 +299,7 @@ def alignment_selection(char_id):
 @characters.route('/deity_selection/<uuid:char_id>', methods=['GET'])
 def deity_selection(char_id):
 	form = forms.CharacterUpdateForm(request.form)
-	character = models.Character.get(char_id)
+	character = _character(char_id, "builder")
 	context = {
 		'form': form,
 		'character': character,
@@ -177,9 +311,25 @@ def deity_selection(char_id):
 
 @characters.route('/summary/<uuid:char_id>', methods=['GET'])
 def summary(char_id):
-	character = models.Character.get(char_id)
+	form = forms.CharacterUpdateForm(request.form)
+	# The sheet only sees saves once they're written
+	try:
+		saves.SAVES.flush(char_id)
+	except exception.CharacterVersionConflict as e:
+		LOG.info(e)
+		flask.abort(409)
+	character = sheets.get(char_id)
+	if character is None:
+		flask.abort(404)
+	char_class = progression.for_class(
+		character['class']['id'] if character['class'] else None)
+	theme = progression.for_theme(
+		character['theme']['id'] if character['theme'] else None)
 	context = {
+		'form': form,
 		'character': character,
+		'progression': char_class.at(character['level']) if char_class else None,
+		'theme_benefits': theme.at(character['level'], cumulative=True) if theme else (),
 		'next': 'characters.view_all',
 		'previous': 'characters.deity_selection'
 	}
@@ -190,7 +340,9 @@ def summary(char_id):
 def delete():
 	form = forms.CharacterDeleteForm(request.form)
 	LOG.debug("Deleting Character by ID: %s", form.id.data)
-	char = models.Character.get(form.id.data)
+	char = _character(form.id.data)
+	saves.SAVES.discard(char.id)
+	sheets.delete(char.id)
 	models.Session.delete(char)	
 	models.Session.commit()
 	return redirect(url_for('characters.view_all'))
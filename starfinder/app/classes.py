@@ -1,9 +1,43 @@
 import flask
 
+from starfinder import config, exception, export, fragments, optimizer
+from starfinder.db import compendium, models
+
+CONF = config.CONF
+
 classes = flask.Blueprint('classes', __name__, template_folder='templates')
 URL_PREFIX = '/classes'
 BLUEPRINT = classes
 
 @classes.route('/')
 def view_all():
-	return flask.render_template('classes/show.html')
+	return fragments.page('classes/show.html')
+
+
+@classes.route('/<int:class_id>/optimize')
+def optimize_build(class_id):
+	args = flask.request.args
+	level = args.get('level', 1, type=int)
+	if not 1 <= level <= 20:
+		flask.abort(400)
+	if compendium.get(models.Class, class_id) is None:
+		flask.abort(404)
+	try:
+		problem = optimizer.Problem.build(
+			optimizer.parse_target(args.get('target', '')), level, class_id,
+			race_ids=set(args.getlist('race_id', type=int)) or None,
+			theme_ids=set(args.getlist('theme_id', type=int)) or None)
+	except exception.InvalidBuildTarget as e:
+		return flask.jsonify({'errors': {'target': [str(e)]}}), 400
+	budget = min(args.get('budget', CONF.get_duration("optimizer.budget", 10),
+						  type=float),
+				 CONF.get_duration("optimizer.max_budget", 30))
+	top = min(args.get('top', optimizer.DEFAULT_TOP, type=int), 50)
+	if not optimizer.take_slot():
+		flask.abort(503)
+	events = optimizer.events(problem, top, budget)
+	response = flask.Response(flask.stream_with_context(export.ndjson(events)),
+							  mimetype='application/x-ndjson')
+	# Closing runs even when the client leaves before the stream starts
+	response.call_on_close(optimizer.release_slot)
+	return response
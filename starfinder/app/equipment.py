@@ -1,9 +1,68 @@
 import flask
 
+from starfinder import config, damage, dice, fragments, search
+from starfinder.db import models
+
+CONF = config.CONF
+
 equipment = flask.Blueprint('equipment', __name__, template_folder='templates')
 URL_PREFIX = '/equipment'
 BLUEPRINT = equipment
 
 @equipment.route('/')
 def view_all():
-	return flask.render_template('equipment/show.html')
+	return fragments.page('equipment/show.html')
+
+
+EQUIPMENT_KINDS = ('armor', 'ranged_weapons', 'melee_weapons', 'grenades',
+				   'tech_items')
+
+
+@equipment.route('/search/<kind>')
+def search_equipment(kind):
+	if kind not in EQUIPMENT_KINDS:
+		flask.abort(404)
+	text, facets, ranges, limit = search.parse_args(flask.request.args, kind)
+	total, results = search.search(kind, text, facets, ranges, limit)
+	return flask.jsonify({
+		'total': total,
+		'results': [search.jsonable(record, score) for score, record in results]
+	})
+
+
+@equipment.route('/items')
+def items():
+	args = flask.request.args
+	results = models.Equipment.items(
+		item_type=args.get('item_type'),
+		min_level=args.get('level_min', type=int),
+		max_level=args.get('level_max', type=int),
+		max_price=args.get('price_max', type=int),
+		limit=min(args.get('limit', 100, type=int), 500))
+	return flask.jsonify({
+		'results': [dict(item._asdict(), id=str(item.id)) for item in results]
+	})
+
+
+@equipment.route('/weapons/<kind>')
+def weapons(kind):
+	if kind not in damage.WEAPON_KINDS:
+		flask.abort(404)
+	return fragments.page('weapons/{}.html'.format(kind),
+						  weapons=damage.DAMAGE.by_level(kind))
+
+
+@equipment.route('/weapons/<kind>/<int:weapon_id>/damage')
+def weapon_damage(kind, weapon_id):
+	if kind not in damage.WEAPON_KINDS:
+		flask.abort(404)
+	weapon = damage.DAMAGE.get(kind, weapon_id)
+	if weapon is None:
+		flask.abort(404)
+	args = flask.request.args
+	stats = weapon.to_dict(args.get('distribution', 'false').lower() == 'true')
+	rolls = min(args.get('simulate', 0, type=int),
+				CONF.get_int("dice.simulate.max", 100000))
+	if rolls > 0:
+		stats['simulated'] = dice.summarize(weapon.damage.simulate(rolls))
+	return flask.jsonify(stats)
@@ -1,9 +1,40 @@
 import flask
 
+from starfinder import fragments, prerequisites, search
+
 feats = flask.Blueprint('feats', __name__, template_folder='templates')
 URL_PREFIX = '/feats'
 BLUEPRINT = feats
 
 @feats.route('/')
 def view_all():
-	return flask.render_template('feats/show.html')
+	return fragments.page('feats/show.html')
+
+
+@feats.route('/search')
+def search_feats():
+	text, facets, ranges, limit = search.parse_args(flask.request.args, 'feats')
+	total, results = search.search('feats', text, facets, ranges, limit)
+	return flask.jsonify({
+		'total': total,
+		'results': [search.jsonable(record, score) for score, record in results]
+	})
+
+
+def _option_tree(children, parent_id=None):
+	return [dict(record.to_dict(), options=_option_tree(children, record.id))
+			for record in children.get(parent_id, ())]
+
+
+@feats.route('/<int:feat_id>/prerequisites')
+def feat_prerequisites(feat_id):
+	graph = prerequisites.graph()
+	if feat_id not in graph.bits:
+		flask.abort(404)
+	return flask.jsonify({
+		'requirements': graph.requirements[feat_id].to_dict(),
+		'needs': sorted(graph.closure(feat_id)),
+		'options': _option_tree(
+			{parent_id: [record for record in records if record.feat_id == feat_id]
+			 for parent_id, records in graph.options.items()})
+	})
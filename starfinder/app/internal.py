@@ -0,0 +1,89 @@
+import flask
+
+from starfinder import config, export, fragments, profiling
+from starfinder.db import instrumentation, models
+
+CONF = config.CONF
+
+internal = flask.Blueprint('internal', __name__, template_folder='templates')
+URL_PREFIX = '/_internal'
+BLUEPRINT = internal
+
+
+@internal.before_request
+def restrict_to_allowed_ips():
+	allowed = CONF.get_array("internal.allowed_ips", "127.0.0.1")
+	if flask.request.remote_addr not in allowed:
+		flask.abort(404)
+
+
+@internal.route('/db')
+def db_stats():
+	return flask.jsonify(instrumentation.snapshot(models.db_engine.engine))
+
+
+@internal.route('/db/reset', methods=['POST'])
+def db_stats_reset():
+	instrumentation.POOL_STATS.reset()
+	instrumentation.STATEMENT_STATS.reset()
+	return flask.jsonify({'reset': True})
+
+
+@internal.route('/export/characters')
+def export_characters():
+	documents = export.iter_characters(chunk_size=flask.request.args.get(
+		'chunk_size', export.DEFAULT_CHUNK_SIZE, type=int))
+	return flask.Response(flask.stream_with_context(export.ndjson(documents)),
+						  mimetype='application/x-ndjson')
+
+
+@internal.route('/fragments')
+def fragment_stats():
+	return flask.jsonify(fragments.FRAGMENTS.to_dict())
+
+
+@internal.route('/fragments/reset', methods=['POST'])
+def fragment_reset():
+	fragments.FRAGMENTS.clear()
+	return flask.jsonify({'reset': True})
+
+
+@internal.route('/perf')
+def perf_report():
+	return flask.jsonify({
+		'enabled': CONF.get_bool("profiling.enabled", False),
+		'sample_rate': CONF.get_float("profiling.sample_rate", 0.01),
+		'routes': profiling.PROFILER.report(
+			flask.request.args.get('limit', 50, type=int)),
+	})
+
+
+@internal.route('/perf/reset', methods=['POST'])
+def perf_reset():
+	profiling.PROFILER.reset()
+	return flask.jsonify({'reset': True})
+
+
+@internal.route('/perf/arm/<endpoint>', methods=['POST'])
+def perf_arm(endpoint):
+	count = flask.request.args.get('count', 1, type=int)
+	profiling.PROFILER.arm(endpoint, count)
+	return flask.jsonify({'endpoint': endpoint, 'armed': count})
+
+
+@internal.route('/perf/profiles/<endpoint>')
+def perf_profile(endpoint):
+	profile = profiling.PROFILER.profile(
+		endpoint, flask.request.args.get('rank', 0, type=int))
+	if profile is None:
+		flask.abort(404)
+	if flask.request.args.get('format') == 'pstats':
+		response = flask.make_response(profiling.pstats_dump(profile))
+		response.headers['Content-Type'] = 'application/octet-stream'
+		response.headers['Content-Disposition'] = (
+			'attachment; filename={}.pstats'.format(endpoint))
+		return response
+	text = profiling.pstats_text(
+		profile, flask.request.args.get('sort', 'cumulative'),
+		flask.request.args.get('lines', 40, type=int))
+	return flask.Response(text, mimetype='text/plain')
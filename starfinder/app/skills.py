@@ -1,9 +1,11 @@
 import flask
 
+from starfinder import fragments
+
 skills = flask.Blueprint('skills', __name__, template_folder='templates')
 URL_PREFIX = '/skills'
 BLUEPRINT = skills
 
 @skills.route('/')
 def view_all():
-	return flask.render_template('skills/show.html')
+	return fragments.page('skills/show.html')
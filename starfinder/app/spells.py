@@ -1,9 +1,33 @@
 import flask
 
+from starfinder import fragments, search, spell_lists
+
 spells = flask.Blueprint('spells', __name__, template_folder='templates')
 URL_PREFIX = '/spells'
 BLUEPRINT = spells
 
 @spells.route('/')
 def view_all():
-	return flask.render_template('spells/show.html')
+	return fragments.page('spells/show.html')
+
+
+@spells.route('/mystic')
+def mystic_list():
+	return fragments.page('spells/mystic_list.html',
+						  spell_list=spell_lists.get('mystic'))
+
+
+@spells.route('/technomancer')
+def technomancer_list():
+	return fragments.page('spells/technomancer_list.html',
+						  spell_list=spell_lists.get('technomancer'))
+
+
+@spells.route('/search')
+def search_spells():
+	text, facets, ranges, limit = search.parse_args(flask.request.args, 'spells')
+	total, results = search.search('spells', text, facets, ranges, limit)
+	return flask.jsonify({
+		'total': total,
+		'results': [search.jsonable(record, score) for score, record in results]
+	})
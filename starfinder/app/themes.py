@@ -1,9 +1,11 @@
 import flask
 
+from starfinder import fragments
+
 themes = flask.Blueprint('themes', __name__, template_folder='templates')
 URL_PREFIX = '/themes'
 BLUEPRINT = themes
 
 @themes.route('/')
 def view_all():
-	return flask.render_template('themes/show.html')
+	return fragments.page('themes/show.html')
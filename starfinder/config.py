@@ -1,29 +1,198 @@
+import json
 import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+import re
+import signal
+import threading
 
 from starfinder import exception
 
+ENV_FILE = ".env"
+CONFIG_FILE_ENV_KEY = "STARFINDER_CONFIG_FILE"
+TRUE_VALUES = ("1", "true", "t", "yes", "y", "on")
+FALSE_VALUES = ("0", "false", "f", "no", "n", "off", "")
+DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h|d)?\s*$")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_MISSING = object()
+
+
+def _read_env_file(path):
+    values = {}
+    with open(path) as env_file:
+        for line in env_file:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            key = key.strip()
+            if key.startswith("export "):
+                key = key[len("export "):].strip()
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            values[key] = value
+    return values
+
+
+def _read_config_file(path):
+    """ JSON objects are flattened to dotted keys, anything else is .env style """
+    if not path.endswith(".json"):
+        return _read_env_file(path)
+    with open(path) as config_file:
+        data = json.load(config_file)
+    values = {}
+
+    def flatten(prefix, node):
+        for key, value in node.items():
+            name = "{}.{}".format(prefix, key) if prefix else key
+            if isinstance(value, dict):
+                flatten(name, value)
+            else:
+                values[name] = (",".join(str(v) for v in value)
+                                if isinstance(value, list) else str(value))
+    flatten("", data)
+    return values
+
+
+class Snapshot(object):
+    """
+    Immutable view of the configuration at one point in time. Raw values are
+    strings keyed by their env form (db.engine.url -> DB_ENGINE_URL); typed
+    conversions are memoized per snapshot.
+    """
+    __slots__ = ("_values", "_typed")
+
+    def __init__(self, values):
+        self._values = values
+        self._typed = {}
+
+    def raw(self, env_key):
+        return self._values.get(env_key, _MISSING)
+
+
 class Config(object):
+    """
+    Application configuration, loaded once into a Snapshot from (lowest to
+    highest precedence) the optional STARFINDER_CONFIG_FILE, the .env file and
+    the process environment. reload() swaps in a fresh snapshot atomically,
+    so reads never take a lock.
+    """
 
-    def __init__(self):
-    	self._cfg = {}
+    def __init__(self, env_file=ENV_FILE, config_file=None):
+        self._env_file = env_file
+        self._config_file = config_file
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self._snapshot = self._load()
 
     def _to_env_key(self, key):
         return ('_'.join(key.split('.'))).upper()
 
-    def get(self, key, default=None):
-        if key not in self._cfg:
-            env_key = self._to_env_key(key)
-            if env_key not in os.environ:
-                if default:
-                    return default
+    def _load(self):
+        values = {}
+        config_file = (self._config_file or
+                       os.environ.get(CONFIG_FILE_ENV_KEY))
+        for path, reader in ((config_file, _read_config_file),
+                             (self._env_file, _read_env_file)):
+            if path and os.path.isfile(path):
+                values.update((self._to_env_key(key), value)
+                              for key, value in reader(path).items())
+        values.update(os.environ)
+        return Snapshot(values)
+
+    def reload(self):
+        """ Re-reads every source and swaps the new snapshot in. """
+        with self._reload_lock:
+            self._snapshot = self._load()
+        for callback in self._listeners:
+            callback(self)
+
+    def on_reload(self, callback):
+        self._listeners.append(callback)
+        return callback
+
+    def install_reload_signal(self, signum=signal.SIGHUP):
+        """ Reloads on SIGHUP. Only callable from the main thread. """
+        signal.signal(signum, lambda *_: self._reload_later())
+
+    def _reload_later(self):
+        # NOTE: The handler interrupts the main thread, which may be holding
+        #       _reload_lock, so the reload can't run in the handler itself
+        threading.Thread(target=self.reload, name="config-reload",
+                         daemon=True).start()
+
+    def _typed(self, kind, key, default, convert):
+        # Only the parsed value is cached, the default may not be hashable
+        snapshot = self._snapshot
+        cache_key = (kind, key)
+        try:
+            value = snapshot._typed[cache_key]
+        except KeyError:
+            raw = snapshot.raw(self._to_env_key(key))
+            value = raw
+            if raw is not _MISSING:
+                try:
+                    value = convert(raw)
+                except ValueError:
+                    raise exception.InvalidConfigValue(key=key, value=raw)
+            snapshot._typed[cache_key] = value
+        if value is _MISSING:
+            if default is _MISSING:
                 raise exception.ConfigKeyNotFound(key=key)
-            else:
-                self._cfg[key] = os.environ[env_key]
-        return self._cfg[key]
+            return default
+        return value
+
+    def get(self, key, default=_MISSING):
+        """
+        Any default passed is returned for a missing key, None and other
+        falsy values included. Without one a missing key raises.
+        """
+        return self._typed("str", key, default, str)
+
+    def get_int(self, key, default=_MISSING):
+        return self._typed("int", key, default, int)
+
+    def get_float(self, key, default=_MISSING):
+        return self._typed("float", key, default, float)
+
+    def get_bool(self, key, default=_MISSING):
+        return self._typed("bool", key, default, _to_bool)
+
+    def get_list(self, key, default=_MISSING):
+        """ Comma separated values, as a tuple so it can be shared safely """
+        return self._typed("list", key, default, _to_list)
+
+    def get_array(self, key, default=_MISSING):
+        if isinstance(default, str):
+            default = _to_list(default)
+        elif isinstance(default, list):
+            default = tuple(default)
+        return self.get_list(key, default)
+
+    def get_duration(self, key, default=_MISSING):
+        """ Seconds, from values like 250ms, 30, 30s, 5m, 1h or 1d """
+        return self._typed("duration", key, default, _to_duration)
+
+
+def _to_bool(value):
+    lowered = value.strip().lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+def _to_list(value):
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def _to_duration(value):
+    match = DURATION_RE.match(value)
+    if match is None:
+        raise ValueError(value)
+    amount, unit = match.groups()
+    return float(amount) * DURATION_UNITS[unit or "s"]
 
-    def get_array(self, key, default=None):
-        return [value.strip() for value in self.get(key, default).split(",")]
 
 CONF = Config()
@@ -0,0 +1,97 @@
+"""
+Weapon damage statistics.
+
+Compiles the damage and critical text of every weapon in the compendium
+with dice.parse() and keeps the resulting stats per weapon kind, so the
+equipment pages and the weapon stats endpoint never parse text per request.
+The stats are rebuilt lazily after the compendium reloads.
+"""
+import threading
+
+from starfinder import dice, exception, logging
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+# Weapon kind -> (model, damage column, critical column)
+WEAPON_KINDS = {
+    "ranged_weapons": (models.RangedWeapon, "damage", "critical"),
+    "melee_weapons": (models.MeleeWeapon, "damage", "critical"),
+    "solarian_crystals": (models.SolarianCrystal, "damage", "critical"),
+    "grenades": (models.Grenade, "special", None),
+}
+# A critical hit doubles the damage and adds its critical effect
+CRITICAL_MULTIPLIER = 2
+
+
+def _parse(text):
+    try:
+        return dice.parse(text)
+    except exception.InvalidDiceExpression as e:
+        LOG.warning("Unparsable weapon damage: %s", e)
+        return dice.parse("")
+
+
+class WeaponDamage(object):
+    """ The compiled damage of one weapon. """
+    __slots__ = ("kind", "record", "damage", "critical")
+
+    def __init__(self, kind, record, damage_column, critical_column):
+        self.kind = kind
+        self.record = record
+        self.damage = _parse(getattr(record, damage_column))
+        self.critical = (_parse(getattr(record, critical_column))
+                         if critical_column else dice.parse(""))
+
+    @property
+    def critical_mean(self):
+        return CRITICAL_MULTIPLIER * self.damage.mean + self.critical.mean
+
+    def to_dict(self, with_distribution=False):
+        return {
+            "kind": self.kind,
+            "id": self.record.id,
+            "name": getattr(self.record, "name", None),
+            "level": self.record.level,
+            "damage": self.damage.to_dict(with_distribution),
+            "critical": self.critical.to_dict(with_distribution),
+            "critical_mean": self.critical_mean,
+        }
+
+
+class DamageTable(object):
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._kinds = {}
+        cache.on_reload(self._reset)
+
+    def _reset(self, _cache):
+        self._kinds = {}
+
+    def kind(self, kind):
+        """ id -> WeaponDamage for every weapon of one kind. """
+        self._cache.refresh()
+        weapons = self._kinds.get(kind)
+        if weapons is None:
+            model, damage_column, critical_column = WEAPON_KINDS[kind]
+            with self._lock:
+                weapons = self._kinds.get(kind)
+                if weapons is None:
+                    weapons = {
+                        record.id: WeaponDamage(kind, record, damage_column,
+                                                critical_column)
+                        for record in self._cache.all(model)}
+                    self._kinds[kind] = weapons
+        return weapons
+
+    def get(self, kind, weapon_id):
+        return self.kind(kind).get(weapon_id)
+
+    def by_level(self, kind):
+        return sorted(self.kind(kind).values(),
+                      key=lambda weapon: (weapon.record.level or 0,
+                                          weapon.record.id))
+
+
+DAMAGE = DamageTable(compendium.COMPENDIUM)
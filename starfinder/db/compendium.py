@@ -0,0 +1,225 @@
+"""
+In-process cache of the read-only rules tables.
+
+The compendium (races, themes, classes, feats, spells, equipment...) only
+changes when a migration or a data load runs, so each worker loads it once
+into immutable, slot-based records indexed by primary key and by name.
+Every migration bumps the stamp in the compendium_versions table; workers
+compare it against the version they loaded at most once per
+compendium.version.check_interval seconds and reload when it moved.
+"""
+import threading
+import time
+
+import sqlalchemy as sa
+
+from starfinder import config, logging
+from starfinder.db import models
+
+CONF = config.CONF
+LOG = logging.get_logger(__name__)
+
+RULES_MODELS = (
+    models.Modifier, models.Feat, models.Range, models.Spell,
+    models.FeatOption, models.SpellDescriptor, models.Ammunition,
+    models.Armor, models.ArmorUpgrade, models.Augmentation, models.Fusion,
+    models.TechItem, models.PersonalUpgrade, models.Grenade,
+    models.MeleeWeapon, models.WeaponCategory, models.SolarianCrystal,
+    models.OtherEquipment, models.RangedWeapon, models.Class, models.Theme,
+    models.ClassProficiency, models.ClassSpecialSkill, models.ClassFeat,
+    models.Skill, models.MysticSkill, models.OperativeSkill, models.Ability,
+    models.Alignment, models.Size, models.Deity, models.MysticDeity,
+    models.World, models.PlacesOfWorship, models.Descriptor,
+    models.MagicSchool, models.Race, models.RacialTrait, models.NativeRace,
+    models.Language, models.RacialTraitModifier, models.ClassModifier,
+    models.ThemeModifier, models.RaceAssociatedFeat,
+)
+
+
+class Record(object):
+    """
+    Immutable copy of one row. Subclasses are generated per model by
+    record_type() with the model's column names as __slots__.
+    """
+    __slots__ = ()
+    _fields = ()
+    _model = None
+
+    def __init__(self, row):
+        for field in self._fields:
+            object.__setattr__(self, field, getattr(row, field))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("{} is read-only".format(type(self).__name__))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __eq__(self, other):
+        return (isinstance(other, Record) and
+                self._model is other._model and
+                all(getattr(self, f) == getattr(other, f)
+                    for f in self._fields))
+
+    def __hash__(self):
+        return hash((self._model, self.id))
+
+    def __repr__(self):
+        return "<{} {}>".format(type(self).__name__, self.id)
+
+    def __str__(self):
+        return str(getattr(self, "name", self.id))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+
+def record_type(model):
+    fields = tuple(column.key for column in sa.inspect(model).column_attrs)
+    return type("{}Record".format(model.__name__), (Record,),
+                {"__slots__": fields, "_fields": fields, "_model": model})
+
+
+class Table(object):
+    """ Every record of one rules model with its primary key and name indexes. """
+    __slots__ = ("model", "records", "by_id", "by_name")
+
+    def __init__(self, model, rows):
+        record_cls = record_type(model)
+        self.model = model
+        self.records = tuple(record_cls(row) for row in rows)
+        self.by_id = {record.id: record for record in self.records}
+        self.by_name = {}
+        if "name" in record_cls._fields:
+            for record in self.records:
+                if record.name is not None:
+                    self.by_name.setdefault(record.name.lower(), record)
+
+    def get(self, pk):
+        return self.by_id.get(pk)
+
+    def get_by_name(self, name):
+        return self.by_name.get(name.lower()) if name else None
+
+    def all(self):
+        return self.records
+
+    def filter(self, **values):
+        return [record for record in self.records
+                if all(getattr(record, key) == value
+                       for key, value in values.items())]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+
+class Compendium(object):
+    def __init__(self, rules_models, check_interval=None):
+        self._models = rules_models
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._tables = None
+        self._version = None
+        self._updated_at = None
+        self._checked_at = 0.0
+        self._listeners = []
+
+    @property
+    def check_interval(self):
+        if self._check_interval is None:
+            self._check_interval = CONF.get_duration(
+                "compendium.version.check_interval", 30)
+        return self._check_interval
+
+    @property
+    def version(self):
+        self._ensure_fresh()
+        return self._version
+
+    @property
+    def updated_at(self):
+        """ When the loaded version was stamped, None before the first bump """
+        self._ensure_fresh()
+        return self._updated_at
+
+    def on_reload(self, callback):
+        """
+        Registers callback(compendium) to run after every (re)load, for
+        structures derived from the compendium that must be rebuilt with it.
+        """
+        self._listeners.append(callback)
+        return callback
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if (self._tables is not None and
+                now - self._checked_at < self.check_interval):
+            return
+        version = models.compendium_version()
+        self._checked_at = now
+        if self._tables is not None and version == self._version:
+            return
+        with self._lock:
+            if self._tables is None or version != self._version:
+                self._load(version)
+
+    def _load(self, version):
+        LOG.info("Loading compendium version %s", version)
+        tables = {}
+        for model in self._models:
+            tables[model] = Table(model, models.Session.query(model).all())
+        self._updated_at = models.Session.query(
+            models.CompendiumVersion.updated_at).scalar()
+        # NOTE: Swap the whole dict at once so readers never see a
+        #       half-loaded compendium
+        self._tables = tables
+        self._version = version
+        for callback in self._listeners:
+            callback(self)
+
+    def refresh(self):
+        """ Reloads now if the version stamp moved since the last check. """
+        self._ensure_fresh()
+
+    def invalidate(self):
+        """ Forces a version check and reload on the next access. """
+        self._checked_at = 0.0
+        self._version = None
+
+    def table(self, model):
+        self._ensure_fresh()
+        return self._tables[model]
+
+    def get(self, model, pk):
+        return self.table(model).get(pk)
+
+    def get_by_name(self, model, name):
+        return self.table(model).get_by_name(name)
+
+    def all(self, model):
+        return self.table(model).all()
+
+
+COMPENDIUM = Compendium(RULES_MODELS)
+
+
+def table(model):
+    return COMPENDIUM.table(model)
+
+
+def get(model, pk):
+    return COMPENDIUM.get(model, pk)
+
+
+def get_by_name(model, name):
+    return COMPENDIUM.get_by_name(model, name)
+
+
+def get_all(model):
+    return COMPENDIUM.all(model)
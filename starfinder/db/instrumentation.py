@@ -0,0 +1,221 @@
+"""
+Database instrumentation hooks.
+
+Counts the SQL statements executed while serving each request, and the time
+spent in them, so views can be checked against a query budget. The count is
+exposed as the X-Query-Count response header and logged when it exceeds
+db.query.warn_threshold.
+
+The connection pool is an InstrumentedQueuePool, which records how long each
+checkout took and how often it had to wait for a free connection. Together
+with per-statement timings and the pool's in-use/idle gauges these are
+served by /_internal/db through snapshot().
+"""
+import threading
+import time
+
+import flask
+import sqlalchemy as sa
+from sqlalchemy import exc, pool
+
+from starfinder import config, logging
+
+CONF = config.CONF
+LOG = logging.get_logger(__name__)
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+MAX_TRACKED_STATEMENTS = 500
+
+
+class PoolStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def record_checkout(self, seconds, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.waits += int(waited)
+            self.total_checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_checkout_ms": (
+                    1000 * self.total_checkout_seconds / self.checkouts
+                    if self.checkouts else 0.0),
+                "max_checkout_ms": 1000 * self.max_checkout_seconds,
+            }
+
+
+class StatementStats(object):
+    """ count / total / max execution time per distinct statement. """
+
+    def __init__(self, max_statements=MAX_TRACKED_STATEMENTS):
+        self._lock = threading.Lock()
+        self._max_statements = max_statements
+        self._statements = {}
+
+    def record(self, statement, seconds):
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                if len(self._statements) >= self._max_statements:
+                    return
+                stats = self._statements[statement] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}
+
+    def top(self, limit=25):
+        with self._lock:
+            items = list(self._statements.items())
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return [{"statement": statement,
+                 "count": count,
+                 "total_ms": 1000 * total,
+                 "avg_ms": 1000 * total / count,
+                 "max_ms": 1000 * worst}
+                for statement, (count, total, worst) in items[:limit]]
+
+
+POOL_STATS = PoolStats()
+STATEMENT_STATS = StatementStats()
+
+
+class InstrumentedQueuePool(pool.QueuePool):
+    """ QueuePool that records checkout latency and waits in POOL_STATS. """
+
+    def _do_get(self):
+        waited = (self._max_overflow > -1 and
+                  self.checkedout() >= self.size() + self._max_overflow)
+        started = time.monotonic()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            POOL_STATS.record_timeout()
+            raise
+        POOL_STATS.record_checkout(time.monotonic() - started, waited)
+        return connection
+
+
+def _ping(dbapi_connection, connection_record, connection_proxy):
+    # pylint: disable=unused-argument
+    # Pessimistic disconnect handling: the pool retries the checkout with a
+    # fresh connection when this raises DisconnectionError
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT 1")
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+def enable_pre_ping():
+    if not sa.event.contains(InstrumentedQueuePool, "checkout", _ping):
+        sa.event.listen(InstrumentedQueuePool, "checkout", _ping)
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    conn.info.setdefault("query_started", []).append(time.monotonic())
+    if context is not None:
+        context.instrumented = True
+    if flask.has_request_context():
+        flask.g.query_count = getattr(flask.g, "query_count", 0) + 1
+
+
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    started = conn.info.get("query_started")
+    if started:
+        seconds = time.monotonic() - started.pop()
+        STATEMENT_STATS.record(statement, seconds)
+        if flask.has_request_context():
+            flask.g.sql_seconds = sql_seconds() + seconds
+
+
+def _handle_error(context):
+    # after_cursor_execute doesn't run for a failed statement, drop its
+    # start time or it stays on the pooled connection for good
+    execution = context.execution_context
+    if (context.connection is not None and
+            getattr(execution, "instrumented", False)):
+        execution.instrumented = False
+        started = context.connection.info.get("query_started")
+        if started:
+            started.pop()
+
+
+def query_count():
+    """ Number of statements executed so far in the current request. """
+    return getattr(flask.g, "query_count", 0)
+
+
+def sql_seconds():
+    """ Time spent executing statements so far in the current request. """
+    return getattr(flask.g, "sql_seconds", 0.0)
+
+
+def _report_query_count(response):
+    count = query_count()
+    response.headers[QUERY_COUNT_HEADER] = str(count)
+    if count > _warn_threshold():
+        LOG.warning("%s %s executed %d queries", flask.request.method,
+                    flask.request.path, count)
+    return response
+
+
+def _warn_threshold():
+    return CONF.get_int("db.query.warn_threshold", 20)
+
+
+def snapshot(engine):
+    """ Pool gauges, checkout stats and the slowest statements. """
+    engine_pool = engine.pool
+    gauges = {"class": type(engine_pool).__name__}
+    if isinstance(engine_pool, pool.QueuePool):
+        gauges.update({
+            "size": engine_pool.size(),
+            "in_use": engine_pool.checkedout(),
+            "idle": engine_pool.checkedin(),
+            "overflow": engine_pool.overflow(),
+            "max_overflow": engine_pool._max_overflow,
+            "timeout": engine_pool.timeout(),
+        })
+    return {
+        "pool": gauges,
+        "checkouts": POOL_STATS.to_dict(),
+        "statements": STATEMENT_STATS.top(),
+    }
+
+
+def install(app):
+    for event, listener in (("before_cursor_execute", _before_execute),
+                            ("after_cursor_execute", _after_execute),
+                            ("handle_error", _handle_error)):
+        if not sa.event.contains(sa.engine.Engine, event, listener):
+            sa.event.listen(sa.engine.Engine, event, listener)
+    app.after_request(_report_query_count)
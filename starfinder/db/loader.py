@@ -0,0 +1,343 @@
+"""
+Bulk loader for the compendium rules tables.
+
+Source files are streamed row by row and named after the table they fill
+(spells.csv, feats.ndjson, deities.json...). Foreign keys may be given either
+as ids or as the name of the referenced row, e.g. a spells.csv with a
+"school" or "school_id" column holding "Evocation". Names are resolved
+through in-memory name indexes built with one query per referenced table,
+and rows are written with multi-row INSERT ... ON DUPLICATE KEY UPDATE
+batches, one transaction per chunk. Rows of a chunk naming the same row are
+merged, the last one wins. New rows of GUID tables get their GUID before
+they're written; new rows of auto-incremented tables are left to
+AUTO_INCREMENT, so concurrent loads and inserts never pick the same id, and
+their ids are read back by name. A row whose foreign key names a new row of
+its own chunk is written once that row has its id, in the same transaction.
+
+Only the rules tables can be loaded, never user data such as characters.
+"""
+import csv
+import json
+import os
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from starfinder import logging
+from starfinder.db import compendium, models
+from starfinder.db import utils as db_utils
+
+LOG = logging.get_logger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+SOURCE_EXTENSIONS = (".csv", ".json", ".ndjson", ".jsonl")
+TRUE_STRINGS = ("1", "true", "t", "yes", "y")
+# The compendium tables, plus the equipment catalogue it doesn't cache
+LOADABLE_TABLES = frozenset(
+    model.__table__.name
+    for model in compendium.RULES_MODELS + (models.Equipment,))
+
+
+class LoadStats(object):
+    __slots__ = ("table", "rows", "seconds")
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def read_rows(path):
+    """ Streams dict rows out of a CSV, NDJSON or JSON array file. """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding="utf-8") as source:
+        if extension == ".csv":
+            for row in csv.DictReader(source):
+                yield row
+        elif extension in (".ndjson", ".jsonl"):
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # NOTE: Plain JSON has to be parsed whole, prefer NDJSON for
+            #       large sources
+            for row in json.load(source):
+                yield row
+
+
+def discover_sources(paths):
+    """
+    Expands directories into their source files and returns (table, path)
+    pairs ordered so referenced tables load before the tables pointing at
+    them.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name)
+                         for name in sorted(os.listdir(path))
+                         if name.lower().endswith(SOURCE_EXTENSIONS))
+        else:
+            files.append(path)
+    order = {table.name: index for index, table
+             in enumerate(models.db_engine.metadata.sorted_tables)}
+    sources = []
+    for path in files:
+        table_name = os.path.splitext(os.path.basename(path))[0]
+        if table_name not in order:
+            raise ValueError("No table named '{}' for source {}".format(
+                table_name, path))
+        if table_name not in LOADABLE_TABLES:
+            raise ValueError("Table '{}' isn't rules data, refusing to load "
+                             "{}".format(table_name, path))
+        sources.append((table_name, path))
+    return sorted(sources, key=lambda source: order[source[0]])
+
+
+class NameIndex(object):
+    """ Lower-cased name -> id for every table with a name column. """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._indexes = {}
+
+    def _index(self, table):
+        if table.name not in self._indexes:
+            index = {}
+            if "name" in table.c:
+                for pk, name in self._connection.execute(
+                        sa.select([table.c.id, table.c.name])):
+                    if name is not None:
+                        index.setdefault(name.lower(), pk)
+            self._indexes[table.name] = index
+        return self._indexes[table.name]
+
+    def resolve(self, table, name):
+        return self._index(table).get(str(name).strip().lower())
+
+    def add(self, table, name, pk):
+        if name is not None:
+            self._index(table).setdefault(str(name).strip().lower(), pk)
+
+    def load(self, table, names):
+        """ Indexes the ids of these names, as just written """
+        rows = self._connection.execute(
+            sa.select([table.c.id, table.c.name]).where(
+                table.c.name.in_(sorted(set(names)))))
+        for pk, name in rows:
+            self.add(table, name, pk)
+
+
+class _Deferred(Exception):
+    """ A foreign key names a row of the chunk that isn't written yet """
+
+
+class TableLoader(object):
+    """ Coerces, resolves and upserts the rows of one table. """
+
+    def __init__(self, table, names):
+        self.table = table
+        self.names = names
+        # Generated columns are computed by MySQL and can't be written
+        self.columns = [table.c.id] + [column for column in table.c
+                                       if column.name != "id" and
+                                       "generated" not in column.info]
+        self.has_guid = isinstance(table.c.id.type, models.GUID)
+        self.named = "name" in table.c
+        # Names of the chunk's new rows that AUTO_INCREMENT hasn't numbered
+        self._unwritten = set()
+        self.foreign_tables = {
+            column.name: list(column.foreign_keys)[0].column.table
+            for column in self.columns if column.foreign_keys}
+        quoted = ["`{}`".format(column.name) for column in self.columns]
+        self.statement = (
+            "INSERT INTO `{table}` ({columns}) VALUES ({values}) "
+            "ON DUPLICATE KEY UPDATE {updates}".format(
+                table=table.name,
+                columns=", ".join(quoted),
+                values=", ".join(["%s"] * len(quoted)),
+                updates=", ".join("{0}=VALUES({0})".format(name)
+                                  for name in quoted[1:])))
+
+    def _foreign_key(self, column, row):
+        value = row.get(column.name)
+        if value in (None, ""):
+            alias = column.name[:-3] if column.name.endswith("_id") else None
+            value = row.get(alias) if alias else None
+        if value in (None, ""):
+            return None
+        if isinstance(value, int) or str(value).isdigit():
+            return int(value)
+        target = self.foreign_tables[column.name]
+        pk = self.names.resolve(target, value)
+        if pk is None and target is self.table and \
+                _name_key(value) in self._unwritten:
+            raise _Deferred(value)
+        if pk is None:
+            raise ValueError("{}.{}: no {} named '{}'".format(
+                self.table.name, column.name, target.name, value))
+        if isinstance(target.c.id.type, models.GUID):
+            return pk if isinstance(pk, bytes) else uuid.UUID(str(pk)).bytes
+        return pk
+
+    def _value(self, column, row):
+        if column.name in self.foreign_tables:
+            return self._foreign_key(column, row)
+        value = row.get(column.name)
+        if value == "" and column.nullable:
+            return None
+        column_type = column.type
+        if value is None:
+            if column.default is not None and column.default.is_scalar:
+                return column.default.arg
+            return None
+        if isinstance(column_type, sa.JSON):
+            return value if isinstance(value, str) else json.dumps(value)
+        if isinstance(column_type, sa.Boolean):
+            return str(value).strip().lower() in TRUE_STRINGS
+        if isinstance(column_type, sa.Integer):
+            return int(value)
+        if isinstance(column_type, sa.LargeBinary) and \
+                not isinstance(value, bytes):
+            return b"\x01" if str(value).strip().lower() in TRUE_STRINGS \
+                else b"\x00"
+        return value
+
+    def _primary_key(self, row):
+        """ The id of the row, None when AUTO_INCREMENT has to pick it """
+        value = row.get("id")
+        named = self.named and row.get("name")
+        if value not in (None, ""):
+            pk = uuid.UUID(str(value)).bytes if self.has_guid else int(value)
+            if named:
+                self.names.add(self.table, row["name"], pk)
+            return pk
+        if not named:
+            return None
+        pk = self.names.resolve(self.table, row["name"])
+        if pk is None and self.has_guid:
+            # Indexed right away, so the rest of the chunk resolves it
+            pk = db_utils.generate_guid_bytes(1)[0]
+            self.names.add(self.table, row["name"], pk)
+        if self.has_guid and pk is not None and not isinstance(pk, bytes):
+            pk = pk.bytes
+        return pk
+
+    def _merge(self, rows):
+        """ (pk, row) pairs with one row per id or new name, the last wins """
+        merged, positions = [], {}
+        for row in rows:
+            pk = self._primary_key(row)
+            if pk is not None:
+                key = pk
+            elif self.named and row.get("name"):
+                key = ("name", _name_key(row["name"]))
+            else:
+                key = None
+            if key is not None and key in positions:
+                merged[positions[key]] = (pk, row)
+                continue
+            if key is not None:
+                positions[key] = len(merged)
+            merged.append((pk, row))
+        if self.has_guid:
+            fresh = iter(db_utils.generate_guid_bytes(
+                sum(1 for pk, _ in merged if pk is None)))
+            merged = [(pk if pk is not None else next(fresh), row)
+                      for pk, row in merged]
+        return merged
+
+    def load_chunk(self, connection, rows):
+        """
+        Resolves and upserts one chunk in the connection's transaction.
+        Returns the number of rows written.
+        """
+        pending = self._merge(rows)
+        self._unwritten = {_name_key(row["name"]) for pk, row in pending
+                           if pk is None and self.named and row.get("name")}
+        written = 0
+        while pending:
+            params, deferred = [], []
+            for pk, row in pending:
+                try:
+                    values = [pk]
+                    values.extend(self._value(column, row)
+                                  for column in self.columns[1:])
+                except _Deferred:
+                    deferred.append((pk, row))
+                    continue
+                params.append(tuple(values))
+            if not params:
+                raise ValueError("{}: rows naming each other can't be "
+                                 "ordered: {}".format(
+                                     self.table.name,
+                                     sorted(row.get("name") for _, row
+                                            in deferred)))
+            self.write(connection, params)
+            written += len(params)
+            pending = deferred
+        return written
+
+    def write(self, connection, params):
+        connection.execute(self.statement, params)
+        if not self.named:
+            return
+        name_position = [c.name for c in self.columns].index("name")
+        numbered = [values[name_position] for values in params
+                    if values[0] is None and values[name_position]]
+        if numbered:
+            # Only the database knows the ids AUTO_INCREMENT gave them
+            self.names.load(self.table, numbered)
+            self._unwritten.difference_update(
+                _name_key(name) for name in numbered)
+        for values in params:
+            if values[0] is not None:
+                self.names.add(self.table, values[name_position], values[0])
+
+
+def _name_key(name):
+    return str(name).strip().lower()
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def load(paths, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Loads every source under `paths`. progress(stats) is called after each
+    committed chunk. Returns a LoadStats per table and bumps the compendium
+    version once everything is written.
+    """
+    engine = models.db_engine.engine
+    results = []
+    with engine.connect() as connection:
+        names = NameIndex(connection)
+        metadata = models.db_engine.metadata
+        for table_name, path in discover_sources(paths):
+            loader = TableLoader(metadata.tables[table_name], names)
+            stats = LoadStats(table_name)
+            started = time.monotonic()
+            for chunk in _chunks(read_rows(path), chunk_size):
+                with connection.begin():
+                    stats.rows += loader.load_chunk(connection, chunk)
+                stats.seconds = time.monotonic() - started
+                if progress is not None:
+                    progress(stats)
+            LOG.info("Loaded %d rows into %s in %.2fs", stats.rows,
+                     table_name, stats.seconds)
+            results.append(stats)
+    models.bump_compendium_version()
+    return results
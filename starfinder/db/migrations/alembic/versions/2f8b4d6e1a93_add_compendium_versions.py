@@ -0,0 +1,34 @@
+"""Add the compendium_versions stamp
+
+Revision ID: 2f8b4d6e1a93
+Revises: 9e2a6c4f7d13
+Create Date: 2026-10-18 21:06:52.407815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import starfinder.db.models
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8b4d6e1a93'
+down_revision = '9e2a6c4f7d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE: Importing the models runs create_all(), which already creates
+    #       the table on a fresh database
+    table = starfinder.db.models.CompendiumVersion.__table__
+    table.create(bind=op.get_bind(), checkfirst=True)
+    # NOTE: The table holds a single row, the upgrade command bumps it once
+    #       the migrations are done
+    if op.get_bind().execute(sa.select([sa.func.count()]).select_from(
+            table)).scalar() == 0:
+        op.bulk_insert(table, [{"version": 0}])
+
+
+def downgrade():
+    print("Downgrades not supported")
@@ -0,0 +1,33 @@
+"""Add characters.version for optimistic concurrency
+
+Revision ID: 3c1f9a0d2b7e
+Revises: 
+Create Date: 2026-10-18 10:12:41.118374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import starfinder.db.models
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a0d2b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE: Importing the models runs create_all(), which already adds the
+    #       column to a fresh database
+    columns = [column["name"] for column in
+               sa.inspect(op.get_bind()).get_columns("characters")]
+    if "version" not in columns:
+        op.add_column("characters",
+                      sa.Column("version", sa.Integer(), nullable=False,
+                                server_default="1"))
+
+
+def downgrade():
+    print("Downgrades not supported")
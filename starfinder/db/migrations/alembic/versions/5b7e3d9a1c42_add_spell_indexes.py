@@ -0,0 +1,46 @@
+"""Index spell levels, schools and descriptor links
+
+Revision ID: 5b7e3d9a1c42
+Revises: 8d4e2b61c0f5
+Create Date: 2026-10-18 15:02:47.118304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import starfinder.db.models
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e3d9a1c42'
+down_revision = '8d4e2b61c0f5'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "spells": {
+        "ix_spells_mystic_level": ("mystic_level",),
+        "ix_spells_technomancer_level": ("technomancer_level",),
+        "ix_spells_school_id": ("school_id",),
+    },
+    "spell_descriptors": {
+        "ix_spell_descriptors_spell_id_descriptor_id": ("spell_id",
+                                                        "descriptor_id"),
+        "ix_spell_descriptors_descriptor_id": ("descriptor_id",),
+    },
+}
+
+
+def upgrade():
+    # NOTE: Importing the models runs create_all(), which already creates
+    #       these on a fresh database
+    inspector = sa.inspect(op.get_bind())
+    for table, indexes in INDEXES.items():
+        existing = [index["name"] for index in inspector.get_indexes(table)]
+        for name, columns in indexes.items():
+            if name not in existing:
+                op.create_index(name, table, list(columns))
+
+
+def downgrade():
+    print("Downgrades not supported")
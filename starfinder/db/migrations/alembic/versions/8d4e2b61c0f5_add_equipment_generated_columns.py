@@ -0,0 +1,50 @@
+"""Add generated, indexed columns over equipments.attributes
+
+Revision ID: 8d4e2b61c0f5
+Revises: 3c1f9a0d2b7e
+Create Date: 2026-10-18 13:40:02.551920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import starfinder.db.models
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e2b61c0f5'
+down_revision = '3c1f9a0d2b7e'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("level", "price", "bulk", "item_type")
+INDEXES = {
+    "ix_equipments_item_type_level": ("item_type", "level"),
+    "ix_equipments_price": ("price",),
+    "ix_equipments_bulk": ("bulk",),
+}
+
+
+def upgrade():
+    # NOTE: Importing the models runs create_all(), which already creates
+    #       these on a fresh database
+    inspector = sa.inspect(op.get_bind())
+    existing = [column["name"] for column in
+                inspector.get_columns("equipments")]
+    table = starfinder.db.models.Equipment.__table__
+    for name in COLUMNS:
+        if name not in existing:
+            column = table.c[name]
+            op.execute("ALTER TABLE `equipments` ADD COLUMN `{}` {} "
+                       "AS ({}) VIRTUAL".format(
+                           name,
+                           column.type.compile(dialect=op.get_bind().dialect),
+                           column.info["generated"]))
+    indexes = [index["name"] for index in inspector.get_indexes("equipments")]
+    for name, columns in INDEXES.items():
+        if name not in indexes:
+            op.create_index(name, "equipments", list(columns))
+
+
+def downgrade():
+    print("Downgrades not supported")
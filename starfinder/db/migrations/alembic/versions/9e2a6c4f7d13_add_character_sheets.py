@@ -0,0 +1,30 @@
+"""Add the character_sheets read model
+
+Revision ID: 9e2a6c4f7d13
+Revises: 5b7e3d9a1c42
+Create Date: 2026-10-18 17:41:09.530218
+
+"""
+from alembic import op
+
+import starfinder.db.models
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2a6c4f7d13'
+down_revision = '5b7e3d9a1c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # NOTE: Importing the models runs create_all(), which already creates
+    #       the table on a fresh database
+    starfinder.db.models.CharacterSheet.__table__.create(
+        bind=op.get_bind(), checkfirst=True)
+    # NOTE: The sheets are backfilled by the upgrade command, after it bumps
+    #       the compendium version they are built against
+
+
+def downgrade():
+    print("Downgrades not supported")
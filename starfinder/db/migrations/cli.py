@@ -2,6 +2,8 @@
 
 import os
 import sys
+import time
+import uuid
 
 from alembic import command as alembic_command
 from alembic import config as alembic_config
@@ -10,8 +12,8 @@ from alembic import util as alembic_util
 import click
 import sqlalchemy_utils
 
-from starfinder import config, logging
-from starfinder.db import models
+from starfinder import config, exception, export, logging, optimizer, sheets
+from starfinder.db import compendium, loader, models
 
 CONF = config.CONF
 LOG = logging.get_logger(__name__)
@@ -56,6 +58,14 @@ def test_connection():
     print("Connected Successfully.")
 
 
+def rebuild_stale_sheets():
+    """ Rebuilds the sheets left stale by a compendium version bump """
+    # NOTE: The compendium may still hold the version from before the bump
+    compendium.COMPENDIUM.invalidate()
+    print("Rebuilt {:,} stale character sheets".format(
+        sheets.rebuild_all(stale=True)))
+
+
 def _dispatch_alembic_cmd(config, cmd, *args, **kwargs):
     try:
         getattr(alembic_command, cmd)(config, *args, **kwargs)
@@ -99,6 +109,129 @@ def upgrade(ctx, migration_revision):
                          "'create_database' first")
     migration_revision = migration_revision.lower()
     _dispatch_alembic_cmd(config, "upgrade", revision=migration_revision)
+    models.bump_compendium_version()
+    rebuild_stale_sheets()
+
+
+@migrate_cli.command(help="Bumps the compendium version so every worker "
+                          "reloads its cached rules data")
+def bump_compendium_version():
+    test_connection()
+    print("Compendium version is now {}".format(
+        models.bump_compendium_version()))
+    rebuild_stale_sheets()
+
+
+@migrate_cli.command(name="load-compendium",
+                     help="Bulk loads rules data from CSV, JSON or NDJSON "
+                          "files named after their tables. Directories are "
+                          "expanded and tables load in dependency order")
+@click.argument("paths", nargs=-1, required=True,
+                type=click.Path(exists=True))
+@click.option("--chunk-size", default=loader.DEFAULT_CHUNK_SIZE,
+              show_default=True, help="Rows per INSERT batch and transaction")
+def load_compendium(paths, chunk_size):
+    test_connection()
+
+    def progress(stats):
+        click.echo("\r{:<24} {:>10,} rows {:>10,.0f} rows/s".format(
+            stats.table, stats.rows, stats.rows_per_second), nl=False)
+
+    started = time.monotonic()
+    results = loader.load(paths, chunk_size=chunk_size, progress=progress)
+    click.echo()
+    total = sum(stats.rows for stats in results)
+    elapsed = time.monotonic() - started
+    click.echo("Loaded {:,} rows into {} tables in {:.2f}s ({:,.0f} rows/s)"
+               .format(total, len(results), elapsed,
+                       total / elapsed if elapsed else 0))
+    rebuild_stale_sheets()
+
+
+@migrate_cli.command(name="export-characters",
+                     help="Streams characters as NDJSON, one export document "
+                          "per line, either every character or one user's")
+@click.option("--user-id", default=None, help="Only this user's characters")
+@click.option("--output", type=click.File("w"), default="-",
+              show_default=True, help="File to write, - for stdout")
+@click.option("--chunk-size", default=export.DEFAULT_CHUNK_SIZE,
+              show_default=True, help="Characters fetched per batch")
+def export_characters(user_id, output, chunk_size):
+    # NOTE: test_connection() prints to stdout, where the export may go
+    if not models.can_connect():
+        click.echo("Couldn't connect to the database", err=True)
+        sys.exit(1)
+    if user_id is not None:
+        user_id = uuid.UUID(user_id)
+    count = 0
+    started = time.monotonic()
+    for line in export.ndjson(export.iter_characters(user_id, chunk_size)):
+        output.write(line)
+        count += 1
+    click.echo("Exported {:,} characters in {:.2f}s".format(
+        count, time.monotonic() - started), err=True)
+
+
+@migrate_cli.command(name="rebuild-sheets",
+                     help="Rebuilds the character sheet read model, either "
+                          "every character's or one user's, one transaction "
+                          "per batch")
+@click.option("--user-id", default=None, help="Only this user's characters")
+@click.option("--stale", is_flag=True,
+              help="Only the sheets that are missing or out of date")
+@click.option("--chunk-size", default=sheets.DEFAULT_CHUNK_SIZE,
+              show_default=True, help="Characters rebuilt per transaction")
+def rebuild_sheets(user_id, stale, chunk_size):
+    test_connection()
+    if user_id is not None:
+        user_id = uuid.UUID(user_id)
+
+    def progress(count):
+        click.echo("\r{:>10,} sheets".format(count), nl=False)
+
+    started = time.monotonic()
+    count = sheets.rebuild_all(user_id, stale, chunk_size, progress)
+    click.echo()
+    click.echo("Rebuilt {:,} character sheets in {:.2f}s".format(
+        count, time.monotonic() - started))
+
+
+@migrate_cli.command(name="optimize-build",
+                     help="Searches the best builds of a class at a level "
+                          "for a target such as eac,ranged_atk:2 and streams "
+                          "the top builds as NDJSON while they improve")
+@click.option("--class-id", type=int, required=True)
+@click.option("--level", type=click.IntRange(1, 20), default=1,
+              show_default=True)
+@click.option("--target", required=True,
+              help="Comma separated stats, each with an optional :weight")
+@click.option("--race-id", type=int, multiple=True,
+              help="Only these races, repeatable")
+@click.option("--theme-id", type=int, multiple=True,
+              help="Only these themes, repeatable")
+@click.option("--top", default=optimizer.DEFAULT_TOP, show_default=True)
+@click.option("--budget", default=60.0, show_default=True,
+              help="Seconds to search for")
+@click.option("--output", type=click.File("w"), default="-",
+              show_default=True, help="File to write, - for stdout")
+def optimize_build(class_id, level, target, race_id, theme_id, top, budget,
+                   output):
+    if not models.can_connect():
+        click.echo("Couldn't connect to the database", err=True)
+        sys.exit(1)
+    try:
+        problem = optimizer.Problem.build(
+            optimizer.parse_target(target), level, class_id,
+            race_ids=set(race_id) or None, theme_ids=set(theme_id) or None)
+    except exception.InvalidBuildTarget as e:
+        raise click.BadParameter(str(e))
+    for event in optimizer.events(problem, top, budget):
+        output.write(export.dumps(event) + "\n")
+        output.flush()
+    summary = event["stats"]
+    click.echo("Searched {searched} of {pairs} race/theme pairs ({pruned} "
+               "pruned, {nodes:,} nodes) in {seconds}s, complete: "
+               "{complete}".format(**summary), err=True)
 
 
 def main():
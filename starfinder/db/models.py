@@ -1,13 +1,15 @@
+import collections
 import contextlib
 import functools
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 import sqlalchemy as sa
-from sqlalchemy import orm, func
-from sqlalchemy.ext import declarative
+from sqlalchemy import orm, func, schema
+from sqlalchemy.ext import compiler, declarative
 import sqlalchemy_utils
 
-from starfinder import config, logging, flask_app
+from starfinder import config, exception, logging, flask_app, stats
+from starfinder.db import instrumentation
 from starfinder.db import utils as db_utils
 
 CONF = config.CONF
@@ -17,12 +19,53 @@ TABLE_KWARGS = {"mysql_engine": "InnoDB",
                 "mysql_collate": "utf8_general_ci"}
 
 flask_app.config['SQLALCHEMY_DATABASE_URI'] = CONF.get('db.engine.url')
-db_engine = SQLAlchemy(flask_app)
+# setdefault so an entry point (see starfinder.wsgi) can size the pool first
+flask_app.config.setdefault('SQLALCHEMY_POOL_SIZE',
+                            CONF.get_int('db.pool.size', 10))
+flask_app.config.setdefault('SQLALCHEMY_MAX_OVERFLOW',
+                            CONF.get_int('db.pool.max_overflow', 10))
+flask_app.config.setdefault('SQLALCHEMY_POOL_RECYCLE',
+                            CONF.get_duration('db.pool.recycle', 3600))
+flask_app.config.setdefault('SQLALCHEMY_POOL_TIMEOUT',
+                            CONF.get_duration('db.pool.timeout', 30))
+if CONF.get_bool('db.pool.pre_ping', True):
+    instrumentation.enable_pre_ping()
+
+
+class InstrumentedSQLAlchemy(SQLAlchemy):
+    """ Builds the engine on top of the instrumented connection pool. """
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        if not info.drivername.startswith('sqlite'):
+            options['poolclass'] = instrumentation.InstrumentedQueuePool
+
+
+db_engine = InstrumentedSQLAlchemy(flask_app)
 Session = db_engine.session
 
 
+def eager_load(model, path):
+    """
+    Builds a loader option for a dotted relationship path. Collections are
+    loaded with a subquery and scalar references are joined in.
+    """
+    option = None
+    for name in path.split('.'):
+        prop = sa.inspect(model).relationships[name]
+        strategy = "subqueryload" if prop.uselist else "joinedload"
+        if option is None:
+            option = getattr(orm, strategy)(name)
+        else:
+            option = getattr(option, strategy)(name)
+        model = prop.mapper.class_
+    return option
+
+
 class ModelBase(object):
     __table_args__ = TABLE_KWARGS
+    # Named sets of relationship paths to eager load, see load_options()
+    __load_profiles__ = {}
 
     @declarative.declared_attr
     def __tablename__(cls):
@@ -56,8 +99,27 @@ class ModelBase(object):
         return self
 
     @classmethod
-    def get(cls, pk):
-        return Session.query(cls).filter(cls.id == pk).first()
+    def load_options(cls, profile):
+        key = (cls, profile)
+        if key not in _LOAD_OPTIONS:
+            if profile not in cls.__load_profiles__:
+                raise exception.UnknownLoadProfile(model=cls.__name__,
+                                                   profile=profile)
+            _LOAD_OPTIONS[key] = tuple(
+                eager_load(cls, path)
+                for path in cls.__load_profiles__[profile])
+        return _LOAD_OPTIONS[key]
+
+    @classmethod
+    def query_for(cls, profile=None):
+        query = Session.query(cls)
+        if profile is not None:
+            query = query.options(*cls.load_options(profile))
+        return query
+
+    @classmethod
+    def get(cls, pk, profile=None):
+        return cls.query_for(profile).filter(cls.id == pk).first()
 
     @classmethod
     def _get_by_property(cls, prop):
@@ -89,6 +151,28 @@ class ModelBase(object):
                 if not callable(value) and not key.startswith('_')}
 
 
+_LOAD_OPTIONS = {}
+
+# What unselected select fields submit
+EMPTY_VALUES = ("", "None")
+
+
+def _coerce(column, value):
+    if value is None or (isinstance(value, str) and
+                         value.strip() in EMPTY_VALUES):
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if isinstance(value, python_type):
+        return value
+    try:
+        return python_type(value)
+    except (TypeError, ValueError):
+        raise exception.InvalidColumnValue(column=column.key, value=value)
+
+
 def save(model):
     Session.add(model)
     Session.commit()
@@ -108,6 +192,54 @@ class GUID(sqlalchemy_utils.UUIDType):
         super(GUID, self).__init__(binary, native)
 
 
+def json_number(key, sql_type="SIGNED"):
+    """ MySQL expression casting attributes.<key> to sql_type, else NULL. """
+    path = "JSON_EXTRACT(`attributes`, '$.{}')".format(key)
+    return ("CASE WHEN JSON_TYPE({path}) IN ('INTEGER', 'UNSIGNED INTEGER', "
+            "'DOUBLE', 'DECIMAL') THEN CAST({path} AS {type}) "
+            "WHEN JSON_UNQUOTE({path}) REGEXP '^[0-9]+$' "
+            "THEN CAST(JSON_UNQUOTE({path}) AS {type}) END").format(
+                path=path, type=sql_type)
+
+
+def json_bulk(key):
+    """ Bulk is a number of units or "L" for light, a tenth of a unit. """
+    path = "JSON_EXTRACT(`attributes`, '$.{}')".format(key)
+    return ("CASE WHEN JSON_UNQUOTE({path}) = 'L' THEN 0.1 "
+            "ELSE {number} END").format(
+                path=path, number=json_number(key, "DECIMAL(6, 1)"))
+
+
+def json_string(key, length):
+    path = "JSON_EXTRACT(`attributes`, '$.{}')".format(key)
+    return ("CASE WHEN JSON_TYPE({path}) = 'STRING' "
+            "THEN LEFT(JSON_UNQUOTE({path}), {length}) END").format(
+                path=path, length=length)
+
+
+def generated_column(type_, expression):
+    """
+    A column MySQL computes from `expression` (a VIRTUAL generated column).
+    The ORM and the bulk loader never write it.
+    """
+    return db_engine.Column(type_, nullable=True,
+                            info={"generated": expression},
+                            server_default=schema.FetchedValue(),
+                            server_onupdate=schema.FetchedValue())
+
+
+@compiler.compiles(schema.CreateColumn, "mysql")
+def _create_generated_column(element, ddl_compiler, **kw):
+    column = element.element
+    expression = column.info.get("generated")
+    if expression is None:
+        return ddl_compiler.visit_create_column(element, **kw)
+    return "{} {} AS ({}) VIRTUAL".format(
+        ddl_compiler.preparer.format_column(column),
+        ddl_compiler.dialect.type_compiler.process(column.type),
+        expression)
+
+
 class HasGuid(object):
     """id mixin, add to subclasses that have a Globally Unique Identifier."""
 
@@ -171,6 +303,13 @@ class Range(db_engine.Model, ModelBase, HasId):
 
 
 class Spell(db_engine.Model, ModelBase, HasId):
+    __table_args__ = (
+        db_engine.Index("ix_spells_mystic_level", "mystic_level"),
+        db_engine.Index("ix_spells_technomancer_level", "technomancer_level"),
+        db_engine.Index("ix_spells_school_id", "school_id"),
+        TABLE_KWARGS,
+    )
+
     school_id = db_engine.Column(db_engine.ForeignKey("magic_schools.id"),
                                  nullable=False)
     range_id = db_engine.Column(db_engine.ForeignKey("ranges.id"),
@@ -202,18 +341,73 @@ class FeatOption(db_engine.Model, ModelBase, HasId):
 
 
 class SpellDescriptor(db_engine.Model, ModelBase, HasId):
+    __table_args__ = (
+        db_engine.Index("ix_spell_descriptors_spell_id_descriptor_id",
+                        "spell_id", "descriptor_id"),
+        db_engine.Index("ix_spell_descriptors_descriptor_id",
+                        "descriptor_id"),
+        TABLE_KWARGS,
+    )
+
     spell_id = db_engine.Column(db_engine.ForeignKey("spells.id"),
                                      nullable=False)
     descriptor_id = db_engine.Column(db_engine.ForeignKey("descriptors.id"),
                                      nullable=False)
 
 
+EquipmentItem = collections.namedtuple(
+    "EquipmentItem", ("id", "item_type", "level", "price", "bulk"))
+Inventory = collections.namedtuple(
+    "Inventory", ("items", "total_bulk", "total_value", "encumbrance"))
+
+
 class Equipment(db_engine.Model, ModelBase, HasGuid):
+    __table_args__ = (
+        db_engine.Index("ix_equipments_item_type_level", "item_type", "level"),
+        db_engine.Index("ix_equipments_price", "price"),
+        db_engine.Index("ix_equipments_bulk", "bulk"),
+        TABLE_KWARGS,
+    )
+
     attributes = db_engine.Column(db_engine.JSON("equipments.attributes"),
                                      nullable=False)
+    # Typed, indexed copies of the attributes used for filtering and sums
+    level = generated_column(db_engine.Integer(), json_number("level"))
+    price = generated_column(db_engine.Integer(), json_number("price"))
+    bulk = generated_column(db_engine.Numeric(6, 1, asdecimal=False),
+                            json_bulk("bulk"))
+    item_type = generated_column(db_engine.String(64),
+                                 json_string("item_type", 64))
 
     character_equipment = orm.relationship('CharacterEquipment', backref='equipment')
 
+    @classmethod
+    def items(cls, item_type=None, min_level=None, max_level=None,
+              max_price=None, character_id=None, limit=100):
+        """
+        EquipmentItem projections over the generated columns, cheapest first
+        within each level. Never reads the attributes JSON.
+        """
+        query = Session.query(cls.id, cls.item_type, cls.level, cls.price,
+                              cls.bulk)
+        if character_id is not None:
+            query = query.join(
+                CharacterEquipment,
+                CharacterEquipment.equipment_id == cls.id).filter(
+                    CharacterEquipment.character_id == character_id)
+        if item_type is not None:
+            query = query.filter(cls.item_type == item_type)
+        if min_level is not None:
+            query = query.filter(cls.level >= min_level)
+        if max_level is not None:
+            query = query.filter(cls.level <= max_level)
+        if max_price is not None:
+            query = query.filter(cls.price <= max_price)
+        query = query.order_by(cls.level, cls.price)
+        if limit is not None:
+            query = query.limit(limit)
+        return [EquipmentItem(*row) for row in query]
+
 
 class Ammunition(db_engine.Model, ModelBase, HasId):
     name = db_engine.Column(db_engine.String(832), nullable=False)
@@ -621,79 +815,257 @@ class Character(db_engine.Model, ModelBase, HasGuid):
     intelligence = db_engine.Column(db_engine.Integer(), nullable=True)
     wisdom = db_engine.Column(db_engine.Integer(), nullable=True)
     charisma = db_engine.Column(db_engine.Integer(), nullable=True)
+    # Optimistic concurrency: every UPDATE is guarded by, and bumps, version
+    version = db_engine.Column(db_engine.Integer(), nullable=False,
+                               default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
     character_skills = orm.relationship('CharacterSkill', backref='character')
     character_feats = orm.relationship('CharacterFeat', backref='character')
     character_equipment = orm.relationship('CharacterEquipment', backref='character')
     character_spells = orm.relationship('CharacterSpell', backref='character')
 
+    __load_profiles__ = {
+        "card": ("race",),
+        "builder": ("race", "class", "theme"),
+        "feats": ("class", "character_feats", "character_skills"),
+        "full_sheet": (
+            "race",
+            "class",
+            "theme",
+            "deity",
+            "world",
+            "character_feats",
+            "character_spells.spell",
+            "character_equipment.equipment",
+            "character_skills",
+        ),
+    }
+
+    @classmethod
+    def cards(cls, after=None, limit=50, user_id=None):
+        """
+        Keyset-paginated (id, name, race) projection for the character cards.
+        GUIDs are time ordered, so paging on the primary key walks the
+        clustered index in creation order without an OFFSET scan. Returns the
+        rows and the id to pass as `after` for the next page, or None.
+        """
+        query = Session.query(
+            cls.id, cls.name, Race.name.label("race")).outerjoin(
+                Race, cls.race_id == Race.id)
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+        if after is not None:
+            query = query.filter(cls.id > after)
+        rows = query.order_by(cls.id).limit(limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def diff(self, values):
+        """
+        The entries of values, coerced to their column types, that differ
+        from the loaded state. Keys that aren't writable columns are ignored.
+        """
+        columns = sa.inspect(type(self)).columns
+        changes = {}
+        for key, value in values.items():
+            column = columns.get(key)
+            if column is None or column.primary_key or key == "version":
+                continue
+            value = _coerce(column, value)
+            if value != getattr(self, key):
+                changes[key] = value
+        return changes
+
+    _sheet = None
+    _modifiers = None
+
+    def snapshot(self):
+        """ Collects every input of the stat engine in a single walk. """
+        # NOTE: modifiers reads the compendium, which imports this module
+        from starfinder import modifiers
+        race = self.race
+        char_class = getattr(self, 'class')
+        self._modifiers = modifiers.totals(
+            self.race_id, self.theme_id,
+            [link.feat_id for link in self.character_feats],
+            current=self._modifiers)
+        armor = [item.equipment.attributes
+                 for item in self.character_equipment if not item.in_bag]
+        return stats.Snapshot(
+            character_id=self.id,
+            level=self.level,
+            scores={ability: getattr(self, ability)
+                    for ability in stats.ABILITIES},
+            race_hit_points=race.hit_points if race else None,
+            class_hit_points=char_class.hit_points if char_class else None,
+            class_stamina_points=(char_class.stamina_points
+                                  if char_class else None),
+            class_name=char_class.name if char_class else None,
+            armor=armor,
+            misc=self._modifiers.misc)
+
+    @property
+    def sheet(self):
+        """ Every derived stat, computed once per loaded instance. """
+        if self._sheet is None:
+            self._sheet = stats.compute(self.snapshot())
+        return self._sheet
+
+    def invalidate_sheet(self):
+        self._sheet = None
+
+    @classmethod
+    def snapshots(cls, character_ids=None):
+        """
+        Builds snapshots for many characters in a fixed number of queries,
+        regardless of how many characters are requested.
+        """
+        # NOTE: modifiers reads the compendium, which imports this module
+        from starfinder import modifiers
+        query = Session.query(
+            cls.id, cls.level, cls.race_id, cls.theme_id,
+            cls.strength, cls.dexterity, cls.constitution,
+            cls.intelligence, cls.wisdom, cls.charisma,
+            Race.hit_points, Class.hit_points, Class.stamina_points,
+            Class.name).outerjoin(Race, cls.race_id == Race.id).outerjoin(
+                Class, cls.class_id == Class.id)
+        if character_ids is not None:
+            query = query.filter(cls.id.in_(character_ids))
+        characters = query.all()
+        ids = [row[0] for row in characters]
+        if not ids:
+            return []
+
+        armor = {}
+        for char_id, attributes in Session.query(
+                CharacterEquipment.character_id, Equipment.attributes).join(
+                    Equipment,
+                    CharacterEquipment.equipment_id == Equipment.id).filter(
+                        CharacterEquipment.character_id.in_(ids),
+                        CharacterEquipment.in_bag.is_(False)):
+            armor.setdefault(char_id, []).append(attributes)
+
+        feat_ids = {}
+        for char_id, feat_id in Session.query(
+                CharacterFeat.character_id, CharacterFeat.feat_id).filter(
+                    CharacterFeat.character_id.in_(ids)):
+            feat_ids.setdefault(char_id, []).append(feat_id)
+
+        snapshots = []
+        for row in characters:
+            (char_id, level, race_id, theme_id), scores = row[:4], row[4:10]
+            race_hp, class_hp, class_sp, class_name = row[10:]
+            totals = modifiers.totals(race_id, theme_id,
+                                      feat_ids.get(char_id, ()))
+            snapshots.append(stats.Snapshot(
+                character_id=char_id,
+                level=level,
+                scores=dict(zip(stats.ABILITIES, scores)),
+                race_hit_points=race_hp,
+                class_hit_points=class_hp,
+                class_stamina_points=class_sp,
+                class_name=class_name,
+                armor=armor.get(char_id, ()),
+                misc=totals.misc))
+        return snapshots
+
+    @classmethod
+    def sheets(cls, character_ids=None):
+        """
+        Computes sheets for many characters at once. Returns the snapshots
+        and a dict of stat name -> array aligned with them.
+        """
+        snapshots = cls.snapshots(character_ids)
+        return snapshots, stats.compute_many(snapshots)
+
+    @classmethod
+    def inventories(cls, character_ids):
+        """
+        character id -> Inventory, summed by the database over the generated
+        equipment columns in one query.
+        """
+        inventories = {}
+        for char_id, strength, items, bulk, value in Session.query(
+                cls.id, cls.strength, func.count(CharacterEquipment.id),
+                func.sum(Equipment.bulk), func.sum(Equipment.price)).outerjoin(
+                    CharacterEquipment,
+                    CharacterEquipment.character_id == cls.id).outerjoin(
+                        Equipment,
+                        CharacterEquipment.equipment_id == Equipment.id).filter(
+                            cls.id.in_(character_ids)).group_by(
+                                cls.id, cls.strength):
+            bulk = float(bulk or 0)
+            inventories[char_id] = Inventory(
+                items=items, total_bulk=bulk, total_value=int(value or 0),
+                encumbrance=stats.encumbrance(strength, bulk))
+        return inventories
+
+    def inventory(self):
+        return self.inventories([self.id])[self.id]
+
     @property
     def stamina(self):
-        # stamina = constitution - con_mod - race.points
-        return " "
+        return self.sheet["stamina"]
     def hit_points(self):
-        # hit_points = race.hit_points + (class.hit_points * class.level)
-        return " "
+        return self.sheet["hit_points"]
     def str_mod(self):
-        # str_mod = (strength / 2) - 5
-        return " "
+        return self.sheet["str_mod"]
     def dex_mod(self):
-        # dex_mod = (dexterity / 2) - 5
-        return " "
+        return self.sheet["dex_mod"]
     def con_mod(self):
-        # con_mod = (constitution / 2) - 5
-        return " "
+        return self.sheet["con_mod"]
     def int_mod(self):
-        # int_mod = (intelligence / 2) - 5
-        return " "
+        return self.sheet["int_mod"]
     def wis_mod(self):
-        # wis_mod = (wisdom / 2) - 5
-        return " "
+        return self.sheet["wis_mod"]
     def char_mod (self):
-        # char_mod = (charisma / 2) - 5
-        return " "
-    def misc_mod(self):
-        # misc_mod = ?
-        return " "
-    def armor_bonus(self):
-        # armor_bonus = ?
-        return " "
+        return self.sheet["char_mod"]
+    def misc_mod(self, stat):
+        # The modifier totals are kept from the snapshot the sheet was
+        # computed from, no need for another walk
+        if self._sheet is None or self._modifiers is None:
+            self.sheet
+        return self._modifiers.misc.get(stats.normalize_stat(stat), 0)
+    def armor_bonus(self, armor_class="eac"):
+        return self.sheet["armor_bonus_{}".format(armor_class)]
     def eac(self):
-        # eac = 10 + armor_bonus + dex_mod + misc_mod
-        return " "
+        # eac = 10 + armor_bonus + dex_mod (capped by armor) + misc_mod
+        return self.sheet["eac"]
     def kac(self):
-        # kac = 10 + armor_bonus + dex_mod + misc_mod
-        return " "
+        # kac = 10 + armor_bonus + dex_mod (capped by armor) + misc_mod
+        return self.sheet["kac"]
     def ac_vs_combat(self):
         # ac_vs_combat = 8 + kac
-        return " "
+        return self.sheet["ac_vs_combat"]
     def initiative(self):
         # initiative = dex_mod + misc_mod
-        return " "
-    def base_save(self):
-        # base_save = ?
-        return " "
+        return self.sheet["initiative"]
+    def base_save(self, save="fortitude"):
+        # base_save = level / 2 + 2 for good saves, level / 3 for poor saves
+        return self.sheet["base_{}".format(save)]
     def fortitude_save(self):
-        # fortitude_save = base_save + str_mod + misc_mod
-        return " "
+        # fortitude_save = base_save + con_mod + misc_mod
+        return self.sheet["fortitude_save"]
     def reflex_save(self):
         # reflex_save = base_save + dex_mod + misc_mod
-        return " "
+        return self.sheet["reflex_save"]
     def will_save(self):
         # will_save = base_save + wis_mod + misc_mod
-        return " "
+        return self.sheet["will_save"]
     def base_atk_bonus(self):
-        # base_atk_bonus = ?
-        return " "
+        # base_atk_bonus = level, or level * 3/4 for most classes
+        return self.sheet["base_atk_bonus"]
     def melee_atk(self):
         # melee_atk = base_atk_bonus + str_mod + misc_mod
-        return " "
+        return self.sheet["melee_atk"]
     def ranged_atk(self):
         # ranged_atk = base_atk_bonus + dex_mod + misc_mod
-        return " "
+        return self.sheet["ranged_atk"]
     def thrown_atk(self):
         # thrown_atk = base_atk_bonus + str_mod + misc_mod
-        return " "
+        return self.sheet["thrown_atk"]
     def alignment(self):
         # alignment = ?
         return " "
@@ -751,5 +1123,76 @@ class CharacterSkill(db_engine.Model, ModelBase, HasGuid):
     survival = db_engine.Column(db_engine.Integer(), nullable=False, default=False)
 
 
+class CharacterSheet(db_engine.Model, ModelBase):
+    """
+    Read model of a character: its fully resolved export document, derived
+    stats included, plus the card columns. starfinder.sheets rebuilds it in
+    the same transaction as every write to the character.
+    """
+    __table_args__ = (
+        db_engine.Index("ix_character_sheets_user_id_character_id",
+                        "user_id", "character_id"),
+        TABLE_KWARGS,
+    )
+
+    character_id = db_engine.Column(
+        GUID, db_engine.ForeignKey("characters.id", ondelete="CASCADE"),
+        primary_key=True)
+    user_id = db_engine.Column(GUID, nullable=True)
+    # The characters.version and compendium version it was built from
+    version = db_engine.Column(db_engine.Integer(), nullable=False)
+    compendium_version = db_engine.Column(db_engine.Integer(), nullable=False)
+    name = db_engine.Column(db_engine.String(16), nullable=True)
+    race = db_engine.Column(db_engine.String(64), nullable=True)
+    # export.dumps() of the document, served and parsed as is
+    document = db_engine.Column(db_engine.Text(16777215), nullable=False)
+
+    @classmethod
+    def cards(cls, after=None, limit=50, user_id=None):
+        """
+        Same contract as Character.cards(), reading the card columns stored
+        with the sheets. Characters without a sheet yet still get listed,
+        their race joined in from the compendium.
+        """
+        query = Session.query(
+            Character.id, Character.name,
+            func.coalesce(cls.race, Race.name).label("race")).outerjoin(
+                cls, cls.character_id == Character.id).outerjoin(
+                    Race, sa.and_(cls.character_id.is_(None),
+                                  Character.race_id == Race.id))
+        if user_id is not None:
+            query = query.filter(Character.user_id == user_id)
+        if after is not None:
+            query = query.filter(Character.id > after)
+        rows = query.order_by(Character.id).limit(limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+
+class CompendiumVersion(db_engine.Model, ModelBase, HasId):
+    """
+    Single row stamp of the rules data version. Bumped by every migration
+    and data load so in-process compendium caches know to reload.
+    """
+    version = db_engine.Column(db_engine.Integer(), nullable=False, default=0)
+    updated_at = db_engine.Column(db_engine.DateTime(), nullable=False,
+                                  default=func.now(), onupdate=func.now())
+
+
+def compendium_version():
+    return Session.query(CompendiumVersion.version).scalar() or 0
+
+
+def bump_compendium_version():
+    stamp = Session.query(CompendiumVersion).first()
+    if stamp is None:
+        stamp = CompendiumVersion(version=0)
+        Session.add(stamp)
+    stamp.version = (stamp.version or 0) + 1
+    Session.commit()
+    LOG.info("Compendium version bumped to %s", stamp.version)
+    return stamp.version
+
+
 # For maintenance and removal of database: db_engine.drop_all()
 db_engine.create_all()
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+Character saves.
+
+A save writes only the columns that changed, guarded by the character's
+version column, so concurrent edits to other columns survive and a form
+rendered from an older version is rejected instead of overwriting newer data.
+
+Builder steps save one or two columns each, often seconds apart. With
+characters.save.coalesce_window above 0 the changes of successive saves to a
+character are merged in this process and written as one UPDATE once the
+window passes without another save. Until then reads in this process see
+the pending values through overlay(), but other workers read the stored row,
+so only enable it behind sticky sessions. The default, 0, writes through.
+A coalesced save that loses the version check is kept as a conflict and
+raised to the next save of the character, as a write through one would be.
+
+Either way the character's sheet (see starfinder.sheets) is rebuilt in the
+transaction that writes its columns.
+"""
+import atexit
+import threading
+
+from sqlalchemy.orm import attributes
+from sqlalchemy.orm import exc as orm_exc
+
+from starfinder import config, exception, flask_app, logging, sheets
+from starfinder.db import models
+
+CONF = config.CONF
+LOG = logging.get_logger(__name__)
+
+
+class PendingSave(object):
+    __slots__ = ("version", "changes", "timer")
+
+    def __init__(self, version):
+        self.version = version
+        self.changes = {}
+        self.timer = None
+
+
+class CharacterSaves(object):
+    def __init__(self, window=None):
+        self._window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        # character id -> the CharacterVersionConflict of a coalesced save
+        self._conflicts = {}
+        self.writes = 0
+        self.coalesced = 0
+
+    @property
+    def window(self):
+        if self._window is None:
+            return CONF.get_duration("characters.save.coalesce_window", 0)
+        return self._window
+
+    def save(self, char, changes, expected_version=None):
+        """
+        Saves changes, a dict of column -> value as built by
+        Character.diff(). Raises CharacterVersionConflict when
+        expected_version is given and isn't the character's version, or
+        when an earlier coalesced save of the character was lost to one.
+        """
+        self.check(char, expected_version)
+        if not changes:
+            return changes
+        char.invalidate_sheet()
+        if self.window <= 0:
+            self._write_through(char, changes)
+        else:
+            self._defer(char, changes)
+        return changes
+
+    def check(self, char, expected_version=None):
+        with self._lock:
+            conflict = self._conflicts.pop(char.id, None)
+        if conflict is not None:
+            raise conflict
+        if expected_version is not None and expected_version != char.version:
+            raise exception.CharacterVersionConflict(
+                character_id=char.id, expected=expected_version,
+                found=char.version)
+
+    def bump(self, char):
+        """
+        Bumps the version of a character whose feats, spells or skills are
+        changing, so the version guards those rows as it guards columns.
+        The UPDATE is flushed with the caller's transaction; pending changes
+        of the character are rebased on the new version.
+        """
+        # NOTE: An explicit value overrides the mapper's version generator,
+        #       the UPDATE is still guarded by the loaded version
+        char.version = char.version + 1
+        with self._lock:
+            pending = self._pending.get(char.id)
+            if pending is not None:
+                pending.version = char.version
+
+    def _write_through(self, char, changes):
+        for key, value in changes.items():
+            setattr(char, key, value)
+        expected = char.version
+        try:
+            sheets.rebuild([char.id])
+            models.Session.commit()
+        except orm_exc.StaleDataError:
+            models.Session.rollback()
+            raise exception.CharacterVersionConflict(
+                character_id=char.id, expected=expected, found="newer")
+        except Exception:
+            models.Session.rollback()
+            raise
+        self.writes += 1
+
+    def _defer(self, char, changes):
+        with self._lock:
+            pending = self._pending.get(char.id)
+            if pending is None:
+                pending = self._pending[char.id] = PendingSave(char.version)
+            else:
+                pending.timer.cancel()
+                self.coalesced += 1
+            pending.changes.update(changes)
+            pending.timer = threading.Timer(self.window,
+                                            self.flush_detached, (char.id,))
+            pending.timer.daemon = True
+            pending.timer.start()
+        self.overlay(char)
+
+    def overlay(self, char):
+        """ Shows the pending changes of char without marking it dirty. """
+        pending = self._pending.get(char.id) if char is not None else None
+        if pending is not None:
+            for key, value in dict(pending.changes).items():
+                attributes.set_committed_value(char, key, value)
+        return char
+
+    def discard(self, char_id):
+        """ Drops the pending changes of a character that's being deleted """
+        with self._lock:
+            pending = self._pending.pop(char_id, None)
+            self._conflicts.pop(char_id, None)
+        if pending is not None:
+            pending.timer.cancel()
+
+    def _take(self, char_id):
+        with self._lock:
+            if char_id is None:
+                flushing, self._pending = self._pending, {}
+            else:
+                flushing = {}
+                if char_id in self._pending:
+                    flushing[char_id] = self._pending.pop(char_id)
+        for pending in flushing.values():
+            pending.timer.cancel()
+        return flushing
+
+    def flush(self, char_id=None):
+        """
+        Writes the pending changes of one character, or of all of them, in
+        the caller's session, which must not be in a transaction of its own.
+        Raises CharacterVersionConflict when a character was changed
+        elsewhere since its changes were coalesced.
+        """
+        conflicts = self._write_all(self._take(char_id))
+        if conflicts:
+            raise next(iter(conflicts.values()))
+
+    def flush_detached(self, char_id=None):
+        """
+        flush() from outside of any request, as the window timers and exit
+        do, in an app context and session of its own. Conflicts are kept
+        and raised to the next save of their character.
+        """
+        conflicts = {}
+        with flask_app.app_context():
+            try:
+                conflicts = self._write_all(self._take(char_id))
+            except Exception:
+                LOG.exception("Writing coalesced saves failed")
+            finally:
+                models.Session.remove()
+        with self._lock:
+            self._conflicts.update(conflicts)
+
+    def _write_all(self, flushing):
+        conflicts = {}
+        for char_id, pending in flushing.items():
+            conflict = self._write(char_id, pending)
+            if conflict is not None:
+                conflicts[char_id] = conflict
+        return conflicts
+
+    def _write(self, char_id, pending):
+        """ Returns a CharacterVersionConflict when the version moved on """
+        values = dict(pending.changes)
+        values["version"] = models.Character.version + 1
+        try:
+            updated = models.Session.query(models.Character).filter(
+                models.Character.id == char_id,
+                models.Character.version == pending.version).update(
+                    values, synchronize_session=False)
+            if updated:
+                sheets.rebuild([char_id])
+            models.Session.commit()
+        except Exception:
+            models.Session.rollback()
+            raise
+        if updated:
+            self.writes += 1
+            return None
+        LOG.warning("Coalesced save of character %s conflicts, it was "
+                    "changed elsewhere since version %s: %s", char_id,
+                    pending.version, sorted(pending.changes))
+        return exception.CharacterVersionConflict(
+            character_id=char_id, expected=pending.version, found="newer")
+
+    def to_dict(self):
+        return {"window": self.window, "pending": len(self._pending),
+                "writes": self.writes, "coalesced": self.coalesced}
+
+
+SAVES = CharacterSaves()
+atexit.register(SAVES.flush_detached)
@@ -1,7 +1,17 @@
+import collections
+import os
+import random
+import threading
+import time
 import uuid
-from starfinder import exception
+
+from starfinder import config, exception
 
 MAX_SHARD = 4096
+# 100ns intervals between the UUID epoch (1582-10-15) and the unix epoch
+UUID_EPOCH_OFFSET = 0x01B21DD213814000
+# GUIDs generate_guid() reserves at once for the process shard
+GUID_BLOCK_SIZE = 256
 
 
 def to_snake_case(name):
@@ -37,7 +47,7 @@ def pluralize(name):
 #      could also be a string argument for the actual column name
 
 
-def generate_guid(shard=0, base_uuid=None):
+def generate_guid(shard=None, base_uuid=None):
     """
     Generates an "optimized" UUID that accomodates the btree indexing
     algorithms used in database index b-trees. Check the internet for
@@ -75,18 +85,202 @@ def generate_guid(shard=0, base_uuid=None):
     default we're allowing for 4096 shards, which is overkill for everyone but
     Facebook. However, it's easy to work with since every character in the
     UUID represents 4 bits, so all we have to do is overwrite 3 characters.
+
+    The reordering is done directly on the 128 bit integer: the reordered
+    fields EFG9ABC12345678 are just the 60 bit UUID1 timestamp in big endian
+    order, so the GUID is (timestamp, version, clock_seq, node, shard) packed
+    from the most significant bit down. When no base_uuid is supplied the
+    timestamp is generated in-process and forced to be strictly increasing,
+    which keeps GUIDs from a single process monotonic.
+
+    When no shard is passed (as when called as a column default) the process
+    shard from set_process_shard() or the db.shard.id config key is used,
+    and the GUID comes from a block of GUID_BLOCK_SIZE reserved at once, so
+    most calls cost a pop. Any other reservation drops what is left of the
+    block, which keeps GUIDs increasing across every path.
+    """
+    if shard is None and base_uuid is None:
+        return _GENERATOR.next_uuid()
+    if shard is None:
+        shard = process_shard()
+    _check_shard(shard)
+    if base_uuid is not None:
+        return _to_uuid(_reorder(uuid.UUID(str(base_uuid)).int, shard))
+    return _to_uuid(_GENERATOR.next_int(shard))
+
+
+def generate_guids(count, shard=None):
+    """
+    Hands out a block of `count` ordered GUIDs at once, for bulk inserts.
+    The whole block is reserved under a single lock acquisition.
+    """
+    if shard is None:
+        shard = process_shard()
+    _check_shard(shard)
+    return [_to_uuid(value) for value in _GENERATOR.next_ints(count, shard)]
+
+
+def generate_guid_bytes(count, shard=None):
     """
+    Binary fast path of generate_guids(). Returns the 16 byte big endian
+    form stored in BINARY(16) GUID columns, skipping uuid.UUID construction.
+    """
+    if shard is None:
+        shard = process_shard()
+    _check_shard(shard)
+    return [value.to_bytes(16, 'big')
+            for value in _GENERATOR.next_ints(count, shard)]
+
+
+_new_uuid = object.__new__
+# UUIDs carry an is_safe attribute from python 3.7 on
+_SAFE_UNKNOWN = getattr(getattr(uuid, 'SafeUUID', None), 'unknown', None)
+try:
+    # From python 3.8 on UUID has __slots__, which UUID.__setattr__ guards
+    _set_int = uuid.UUID.int.__set__
+    _set_is_safe = uuid.UUID.is_safe.__set__
+except AttributeError:
+    _set_int = _set_is_safe = None
+
+
+def _to_uuid(value):
+    """
+    uuid.UUID(int=value) without the argument parsing and range checks of
+    UUID.__init__, which cost more than generating the value. value is
+    always a 128 bit int here.
+    """
+    guid = _new_uuid(uuid.UUID)
+    if _set_int is not None:
+        _set_int(guid, value)
+        _set_is_safe(guid, _SAFE_UNKNOWN)
+        return guid
+    fields = guid.__dict__
+    fields['int'] = value
+    if _SAFE_UNKNOWN is not None:
+        fields['is_safe'] = _SAFE_UNKNOWN
+    return guid
+
 
-    base_uuid = base_uuid or str(uuid.uuid1())
-    if shard > MAX_SHARD:
+def _check_shard(shard):
+    if not 0 <= shard < MAX_SHARD:
         raise exception.InvalidShardId(shard_id=shard, max_shard=MAX_SHARD)
 
-    shard_id = "{:03X}".format(shard)
-    return uuid.UUID(''.join([base_uuid[15:18],
-                              base_uuid[9],
-                              base_uuid[10:13],
-                              base_uuid[:8],
-                              base_uuid[14],
-                              base_uuid[19:23],
-                              base_uuid[24:33],
-                              shard_id]))
+
+def _reorder(uuid1_int, shard):
+    time_low = uuid1_int >> 96
+    time_mid = (uuid1_int >> 80) & 0xFFFF
+    time_hi = (uuid1_int >> 64) & 0x0FFF
+    clock_seq = (uuid1_int >> 48) & 0xFFFF
+    node_high = (uuid1_int & 0xFFFFFFFFFFFF) >> 12
+    return ((time_hi << 116) | (time_mid << 100) | (time_low << 68) |
+            (1 << 64) | (clock_seq << 48) | (node_high << 12) | shard)
+
+
+class _GuidGenerator(object):
+    """
+    Per-process source of reordered UUID1 integers. Timestamps are counted in
+    100ns intervals since the UUID epoch and never repeat within a process.
+    The clock sequence is re-randomized after a fork so sibling workers on
+    the same shard can't collide.
+
+    next_uuid() serves the process shard from a reserved block of UUIDs.
+    Popping from the deque is atomic, so only refills take the lock. A
+    forked child must not reuse its parent's block: with os.register_at_fork
+    after_fork() drops it, before python 3.7 every call compares the pid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_timestamp = 0
+        self._fixed_bits = 0
+        self._block = collections.deque()
+        self._block_pid = None
+        self._fork_hooked = False
+
+    def _reseed(self):
+        clock_seq = 0x8000 | random.getrandbits(14)
+        node_high = uuid.getnode() >> 12
+        self._fixed_bits = (1 << 64) | (clock_seq << 48) | (node_high << 12)
+        self._pid = os.getpid()
+
+    def _reserve(self, count):
+        with self._lock:
+            return self._reserve_locked(count)
+
+    def _reserve_locked(self, count):
+        if self._pid != os.getpid():
+            self._reseed()
+        # Later GUIDs must sort after the rest of the block, skip it
+        self._block.clear()
+        timestamp = int(time.time() * 10000000) + UUID_EPOCH_OFFSET
+        if timestamp <= self._last_timestamp:
+            timestamp = self._last_timestamp + 1
+        self._last_timestamp = timestamp + count - 1
+        return timestamp, self._fixed_bits
+
+    def next_int(self, shard):
+        timestamp, fixed_bits = self._reserve(1)
+        return (timestamp << 68) | fixed_bits | shard
+
+    def next_ints(self, count, shard):
+        timestamp, fixed_bits = self._reserve(count)
+        fixed_bits |= shard
+        return [((timestamp + offset) << 68) | fixed_bits
+                for offset in range(count)]
+
+    def next_uuid(self):
+        if self._fork_hooked or self._block_pid == os.getpid():
+            try:
+                return self._block.popleft()
+            except IndexError:
+                pass
+        with self._lock:
+            if self._block_pid != os.getpid():
+                self._block.clear()
+            if not self._block:
+                shard = process_shard()
+                _check_shard(shard)
+                timestamp, fixed_bits = self._reserve_locked(GUID_BLOCK_SIZE)
+                fixed_bits |= shard
+                self._block.extend(
+                    _to_uuid(((timestamp + offset) << 68) | fixed_bits)
+                    for offset in range(GUID_BLOCK_SIZE))
+                self._block_pid = os.getpid()
+            return self._block.popleft()
+
+    def hook_fork(self):
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.after_fork)
+            self._fork_hooked = True
+
+    def after_fork(self):
+        # Another thread may have held the lock when the parent forked
+        self._lock = threading.Lock()
+        self._block.clear()
+        self._block_pid = None
+
+    def discard(self):
+        """ Drops the reserved block, as when the process shard changes """
+        with self._lock:
+            self._block.clear()
+
+
+_GENERATOR = _GuidGenerator()
+_GENERATOR.hook_fork()
+_PROCESS_SHARD = None
+
+
+def set_process_shard(shard):
+    """ Pins the shard used for GUIDs generated by this process. """
+    global _PROCESS_SHARD
+    _check_shard(shard)
+    _PROCESS_SHARD = shard
+    _GENERATOR.discard()
+
+
+def process_shard():
+    global _PROCESS_SHARD
+    if _PROCESS_SHARD is None:
+        _PROCESS_SHARD = config.CONF.get_int("db.shard.id", 0)
+    return _PROCESS_SHARD
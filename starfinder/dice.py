@@ -0,0 +1,238 @@
+"""
+Dice expressions.
+
+The rules data stores damage as text: "1d6 F", "2d8+3", "burn 1d4",
+"explode (1d6 E & F, 15 ft.)". parse() compiles such a string once into an
+Expression (dice terms, a constant, damage types and a leading effect label)
+and caches it, so the same text is never parsed twice.
+
+An Expression knows its exact damage distribution, built by convolving the
+integer outcome counts of its dice. Simulation doesn't roll dice one by one:
+it draws whole batches from that distribution by inverse CDF sampling
+(random.choices with cumulative weights) into an array, so a million rolls
+cost one bisect each whatever the number of dice.
+"""
+import array
+import functools
+import math
+import random
+import re
+
+from starfinder import exception
+
+MAX_DICE = 100
+MAX_SIDES = 1000
+
+DICE_RE = re.compile(r"([+-]?)\s*(\d*)d(\d+)\b", re.IGNORECASE)
+CONSTANT_RE = re.compile(r"([+-])\s*(\d+)\b")
+WORD_RE = re.compile(r"[A-Za-z]+")
+DAMAGE_TYPES = {
+    "A": "acid",
+    "B": "bludgeoning",
+    "C": "cold",
+    "E": "electricity",
+    "F": "fire",
+    "P": "piercing",
+    "S": "slashing",
+    "So": "sonic",
+}
+
+
+class Distribution(object):
+    """
+    Exact outcome counts: counts[i] ways to roll minimum + i, out of total.
+    Counts are integers, so probabilities don't accumulate rounding errors.
+    """
+    __slots__ = ("minimum", "counts", "total", "_cumulative")
+
+    def __init__(self, minimum, counts):
+        self.minimum = minimum
+        self.counts = tuple(counts)
+        self.total = sum(self.counts)
+        self._cumulative = None
+
+    @property
+    def maximum(self):
+        return self.minimum + len(self.counts) - 1
+
+    @property
+    def mean(self):
+        return sum((self.minimum + i) * count
+                   for i, count in enumerate(self.counts)) / self.total
+
+    @property
+    def variance(self):
+        mean = self.mean
+        return sum((self.minimum + i - mean) ** 2 * count
+                   for i, count in enumerate(self.counts)) / self.total
+
+    def probability(self, value):
+        index = value - self.minimum
+        if not 0 <= index < len(self.counts):
+            return 0.0
+        return self.counts[index] / self.total
+
+    def at_least(self, value):
+        index = max(value - self.minimum, 0)
+        return sum(self.counts[index:]) / self.total
+
+    def convolve(self, other):
+        counts = [0] * (len(self.counts) + len(other.counts) - 1)
+        for i, left in enumerate(self.counts):
+            if left:
+                for j, right in enumerate(other.counts):
+                    counts[i + j] += left * right
+        return Distribution(self.minimum + other.minimum, counts)
+
+    def shift(self, constant):
+        return Distribution(self.minimum + constant, self.counts)
+
+    def sample(self, count, rng=None):
+        """ count outcomes drawn in one batch, as an array of ints. """
+        if self._cumulative is None:
+            cumulative, running = [], 0
+            for outcome_count in self.counts:
+                running += outcome_count
+                cumulative.append(running)
+            self._cumulative = cumulative
+        outcomes = range(self.minimum, self.maximum + 1)
+        return array.array("l", (rng or random).choices(
+            outcomes, cum_weights=self._cumulative, k=count))
+
+    def to_dict(self):
+        return {str(self.minimum + i): count / self.total
+                for i, count in enumerate(self.counts) if count}
+
+
+CONSTANT = Distribution(0, (1,))
+
+
+@functools.lru_cache(maxsize=None)
+def die(sides):
+    return Distribution(1, (1,) * sides)
+
+
+@functools.lru_cache(maxsize=1024)
+def dice(count, sides):
+    """ The distribution of the sum of count dice, by repeated squaring. """
+    result, power = CONSTANT, die(sides)
+    while count:
+        if count & 1:
+            result = result.convolve(power)
+        count >>= 1
+        if count:
+            power = power.convolve(power)
+    return result
+
+
+class Expression(object):
+    """ A compiled dice expression. Immutable, shared through parse(). """
+    __slots__ = ("text", "terms", "constant", "damage_types", "label",
+                 "_distribution")
+
+    def __init__(self, text, terms, constant, damage_types, label):
+        self.text = text
+        self.terms = terms
+        self.constant = constant
+        self.damage_types = damage_types
+        self.label = label
+        self._distribution = None
+
+    def __bool__(self):
+        return bool(self.terms) or bool(self.constant)
+
+    @property
+    def distribution(self):
+        if self._distribution is None:
+            result = CONSTANT
+            for sign, count, sides in self.terms:
+                term = dice(count, sides)
+                if sign < 0:
+                    term = Distribution(-term.maximum,
+                                        reversed(term.counts))
+                result = result.convolve(term)
+            self._distribution = result.shift(self.constant)
+        return self._distribution
+
+    @property
+    def mean(self):
+        # Linear, so no need for the distribution
+        return self.constant + sum(sign * count * (sides + 1) / 2
+                                   for sign, count, sides in self.terms)
+
+    @property
+    def minimum(self):
+        return self.distribution.minimum
+
+    @property
+    def maximum(self):
+        return self.distribution.maximum
+
+    @property
+    def stdev(self):
+        return math.sqrt(sum(count * (sides ** 2 - 1) / 12
+                             for _, count, sides in self.terms))
+
+    def simulate(self, count, rng=None):
+        return self.distribution.sample(count, rng)
+
+    def to_dict(self, with_distribution=False):
+        summary = {
+            "expression": self.text,
+            "label": self.label,
+            "damage_types": [DAMAGE_TYPES[code]
+                             for code in self.damage_types],
+            "min": self.minimum,
+            "max": self.maximum,
+            "mean": self.mean,
+            "stdev": self.stdev,
+        }
+        if with_distribution:
+            summary["distribution"] = self.distribution.to_dict()
+        return summary
+
+
+def _terms(text):
+    terms = []
+    for sign, count, sides in DICE_RE.findall(text):
+        count, sides = int(count or 1), int(sides)
+        if not 0 < sides <= MAX_SIDES:
+            raise exception.InvalidDiceExpression(
+                expression=text, reason="dice need 1 to {} sides".format(
+                    MAX_SIDES))
+        terms.append((-1 if sign == "-" else 1, count, sides))
+    if sum(count for _, count, _ in terms) > MAX_DICE:
+        raise exception.InvalidDiceExpression(
+            expression=text, reason="more than {} dice".format(MAX_DICE))
+    return tuple(terms)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse(text):
+    """
+    Compiles a dice expression. Text without dice or numbers, like "wound",
+    gives an empty Expression holding only its label.
+    """
+    text = (text or "").strip()
+    terms = _terms(text)
+    rest = DICE_RE.sub(" ", text)
+    constant = sum(int(value) * (-1 if sign == "-" else 1)
+                   for sign, value in CONSTANT_RE.findall(rest))
+    first_dice = DICE_RE.search(text)
+    head = text[:first_dice.start()] if first_dice else text
+    label = " ".join(word.lower() for word in WORD_RE.findall(head)
+                     if word not in DAMAGE_TYPES) or None
+    damage_types = tuple(sorted({word for word in WORD_RE.findall(rest)
+                                 if word in DAMAGE_TYPES}))
+    return Expression(text, terms, constant, damage_types, label)
+
+
+def summarize(samples):
+    """ Mean, standard deviation and range of simulated outcomes. """
+    count = len(samples)
+    if not count:
+        return {"count": 0}
+    mean = math.fsum(samples) / count
+    variance = math.fsum((value - mean) ** 2 for value in samples) / count
+    return {"count": count, "mean": mean, "stdev": math.sqrt(variance),
+            "min": min(samples), "max": max(samples)}
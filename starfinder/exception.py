@@ -9,3 +9,38 @@ class StarfinderException(Exception):
 class ConfigKeyNotFound(StarfinderException):
     message = ("The requested key '%(key)s' does not exist in the "
                "application configuration")
+
+
+class InvalidConfigValue(StarfinderException):
+    message = ("The value '%(value)s' is not valid for the configuration "
+               "key '%(key)s'")
+
+
+class InvalidShardId(StarfinderException):
+    message = ("Shard id %(shard_id)s is out of range, it must be lower "
+               "than %(max_shard)s")
+
+
+class UnknownLoadProfile(StarfinderException):
+    message = "Model '%(model)s' has no load profile named '%(profile)s'"
+
+
+class InvalidColumnValue(StarfinderException):
+    message = "'%(value)s' is not a valid value for column '%(column)s'"
+
+    def __init__(self, **keys):
+        self.column = keys.get("column")
+        super().__init__(**keys)
+
+
+class CharacterVersionConflict(StarfinderException):
+    message = ("Character %(character_id)s was changed by someone else, "
+               "expected version %(expected)s but found %(found)s")
+
+
+class InvalidDiceExpression(StarfinderException):
+    message = "'%(expression)s' is not a valid dice expression: %(reason)s"
+
+
+class InvalidBuildTarget(StarfinderException):
+    message = "'%(target)s' is not a valid build target: %(reason)s"
@@ -0,0 +1,154 @@
+"""
+Character export.
+
+Characters are serialized into a versioned, stable JSON document (SCHEMA):
+references to the rules data (race, class, theme, feats, spells...) are
+resolved from the compendium, collections are ordered by id and keys are
+sorted, so an unchanged character always exports to the same bytes.
+
+Bulk exports stream the characters table through a server-side cursor on a
+dedicated connection and process it chunk_size rows at a time: each chunk's
+feats, spells, equipment, skills and stats are fetched with one IN query per
+collection. Only one chunk is ever held in memory, whatever the row count.
+"""
+import json
+
+import sqlalchemy as sa
+
+from starfinder import logging, stats
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+SCHEMA = "starfinder.character/1"
+DEFAULT_CHUNK_SIZE = 500
+
+CHARACTERS = models.Character.__table__
+SKILL_COLUMNS = tuple(column for column in models.CharacterSkill.__table__.c
+                      if column.key not in ("id", "character_id"))
+
+
+def _ref(model, pk, *fields):
+    record = compendium.get(model, pk) if pk is not None else None
+    if record is None:
+        return None
+    ref = {"id": record.id, "name": record.name}
+    ref.update((field, getattr(record, field)) for field in fields)
+    return ref
+
+
+def _grouped(query):
+    grouped = {}
+    for row in query:
+        grouped.setdefault(row[0], []).append(row[1:])
+    return grouped
+
+
+class Chunk(object):
+    """ The related rows of a batch of characters, one query per collection """
+
+    def __init__(self, ids):
+        self.feats = _grouped(models.Session.query(
+            models.CharacterFeat.character_id,
+            models.CharacterFeat.feat_id).filter(
+                models.CharacterFeat.character_id.in_(ids)))
+        self.spells = _grouped(models.Session.query(
+            models.CharacterSpell.character_id,
+            models.CharacterSpell.spell_id).filter(
+                models.CharacterSpell.character_id.in_(ids)))
+        self.equipment = _grouped(models.Session.query(
+            models.CharacterEquipment.character_id,
+            models.CharacterEquipment.equipment_id,
+            models.CharacterEquipment.in_bag,
+            models.Equipment.attributes).join(
+                models.Equipment, models.CharacterEquipment.equipment_id ==
+                models.Equipment.id).filter(
+                    models.CharacterEquipment.character_id.in_(ids)))
+        skills = models.CharacterSkill.__table__
+        self.skills = {row[0]: dict(zip((c.key for c in SKILL_COLUMNS),
+                                        row[1:]))
+                       for row in models.Session.execute(
+                           sa.select([skills.c.character_id] +
+                                     list(SKILL_COLUMNS)).where(
+                                         skills.c.character_id.in_(ids)))}
+        snapshots = models.Character.snapshots(ids)
+        self.sheets = dict(stats.rows(snapshots,
+                                      stats.compute_many(snapshots)))
+
+
+def serialize(row, chunk):
+    """ The export document of one characters row. """
+    char_id = row[CHARACTERS.c.id]
+    return {
+        "schema": SCHEMA,
+        "id": str(char_id),
+        "user_id": (str(row[CHARACTERS.c.user_id])
+                    if row[CHARACTERS.c.user_id] else None),
+        "version": row[CHARACTERS.c.version],
+        "name": row[CHARACTERS.c.name],
+        "level": row[CHARACTERS.c.level],
+        "gender": row[CHARACTERS.c.gender],
+        "description": row[CHARACTERS.c.description],
+        "abilities": {ability: row[CHARACTERS.c[ability]]
+                      for ability in stats.ABILITIES},
+        "race": _ref(models.Race, row[CHARACTERS.c.race_id], "race_type"),
+        "class": _ref(models.Class, row[CHARACTERS.c.class_id],
+                      "key_ability_score_text"),
+        "theme": _ref(models.Theme, row[CHARACTERS.c.theme_id]),
+        "alignment": _ref(models.Alignment, row[CHARACTERS.c.alignment_id],
+                          "shorthand"),
+        "deity": _ref(models.Deity, row[CHARACTERS.c.deity_id]),
+        "home_world": _ref(models.World, row[CHARACTERS.c.home_world_id]),
+        "feats": [_ref(models.Feat, feat_id, "combat_feat")
+                  for feat_id, in sorted(chunk.feats.get(char_id, ()))],
+        "spells": [_ref(models.Spell, spell_id, "mystic_level",
+                        "technomancer_level")
+                   for spell_id, in sorted(chunk.spells.get(char_id, ()))],
+        "equipment": [{"id": str(equipment_id), "in_bag": bool(in_bag),
+                       "attributes": attributes}
+                      for equipment_id, in_bag, attributes in sorted(
+                          chunk.equipment.get(char_id, ()),
+                          key=lambda item: str(item[0]))],
+        "skills": chunk.skills.get(char_id, {}),
+        "stats": chunk.sheets.get(char_id, {}),
+    }
+
+
+def export_character(char_id):
+    """ The export document of one character, or None. """
+    row = models.Session.execute(
+        sa.select([CHARACTERS]).where(CHARACTERS.c.id == char_id)).first()
+    if row is None:
+        return None
+    return serialize(row, Chunk([row[CHARACTERS.c.id]]))
+
+
+def iter_characters(user_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yields the export document of every character, or of one user's. """
+    query = sa.select([CHARACTERS]).order_by(CHARACTERS.c.id)
+    if user_id is not None:
+        query = query.where(CHARACTERS.c.user_id == user_id)
+    # NOTE: A streaming result keeps its connection busy until it's
+    #       exhausted, so the chunk queries run on the Session's connection
+    with models.db_engine.engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True).execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunk = Chunk([row[CHARACTERS.c.id] for row in rows])
+                for row in rows:
+                    yield serialize(row, chunk)
+        finally:
+            result.close()
+
+
+def dumps(document):
+    return json.dumps(document, sort_keys=True, default=str)
+
+
+def ndjson(documents):
+    for document in documents:
+        yield dumps(document) + "\n"
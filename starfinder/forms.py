@@ -1,57 +1,88 @@
+import time
+
 import arrow
 import wtforms
 from wtforms.csrf.session import SessionCSRF
 from flask import session
 
 from starfinder import config, logging
-from starfinder.db import models
+from starfinder.db import compendium, models
 
 CONF = config.CONF
 LOG = logging.get_logger(__name__)
 
-races = models.Race.query.all()
+class ChoiceCache(object):
+	"""
+	Shared cache of select field choices. Entries are rebuilt when the
+	compendium version moves or after CHOICES_TTL seconds, whichever is first.
+	"""
 
-def race_options():
-	# These Left & Right values are occasionally inverting...?
-	return [('1','Android'),
-			('2','Human'),
-			('3', 'Kasatha')]
+	def __init__(self, ttl):
+		self._ttl = ttl
+		self._entries = {}
+
+	def get(self, loader):
+		version = compendium.COMPENDIUM.version
+		now = time.monotonic()
+		entry = self._entries.get(loader)
+		if entry is not None:
+			cached_version, loaded_at, choices = entry
+			if cached_version == version and now - loaded_at < self._ttl:
+				return choices
+		choices = tuple(loader())
+		self._entries[loader] = (version, now, choices)
+		return choices
+
+	def clear(self):
+		self._entries = {}
+
+
+CHOICES = ChoiceCache(CONF.get_duration("forms.choices.ttl", 60))
+
+
+class LazyChoices(object):
+	""" Resolves a field's choices from CHOICES each time it's iterated. """
+
+	def __init__(self, loader):
+		self._loader = loader
+
+	def __iter__(self):
+		return iter(CHOICES.get(self._loader))
 
+	def __len__(self):
+		return len(CHOICES.get(self._loader))
+
+	def __copy__(self):
+		return self
+
+
+def _compendium_options(model):
+	return [(str(record.id), record.name)
+			for record in compendium.get_all(model)]
+
+
+def race_options():
+	return _compendium_options(models.Race)
 
-themes = models.Theme.query.all()
 
 def theme_options():
-	return [('Ace Pilot','Ace Pilot'),
-			('Bounty Hunter','Bounty Hunter'),
-			('Xenoseeker', 'Xenoseeker'),
-			('Outlaw','Outlaw'),
-			('Priest', 'Priest')]
+	return _compendium_options(models.Theme)
 
 
 def alignment_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
-
+	return _compendium_options(models.Alignment)
 
-classes = models.Class.query.all()
 
 def class_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
+	return _compendium_options(models.Class)
 
 
 def deity_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
+	return _compendium_options(models.Deity)
 
 
 def world_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
+	return _compendium_options(models.World)
 
 
 def gender_options():
@@ -60,22 +91,39 @@ def gender_options():
 			('c', 'c')]
 
 
-def character_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
+def character_options(user_id, character_id=None):
+	"""
+	The characters of one user, or only character_id when there's no user.
+	User data, so it's queried per request and never kept in CHOICES.
+	"""
+	query = models.Session.query(models.Character.id, models.Character.name)
+	if user_id is not None:
+		query = query.filter(models.Character.user_id == user_id)
+	else:
+		query = query.filter(models.Character.id == character_id)
+	return [(str(char_id), name) for char_id, name in query]
 
 
 def spell_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
+	return _compendium_options(models.Spell)
 
 
 def feat_options():
-	return [('a', 'a'),
-			('b', 'b'),
-			('c', 'c')]
+	return _compendium_options(models.Feat)
+
+
+# Option lists served with the builder state, by the field they fill
+BUILDER_OPTIONS = {
+	'race_id': race_options,
+	'theme_id': theme_options,
+	'class_id': class_options,
+	'alignment_id': alignment_options,
+	'deity_id': deity_options,
+	'home_world_id': world_options,
+	'gender': gender_options,
+	'feat_id': feat_options,
+	'spell_id': spell_options,
+}
 
 
 class MyBaseForm(wtforms.Form):
@@ -104,15 +152,16 @@ class CharacterDeleteForm(MyBaseForm):
 
 class CharacterUpdateForm(MyBaseForm):
 	id = wtforms.StringField("")
-	alignment_id = wtforms.SelectField('Select Alignment', choices=alignment_options())
-	class_id = wtforms.SelectField('Select Class', choices=class_options())
-	deity_id = wtforms.SelectField('Select Deity', choices=deity_options())
+	version = wtforms.IntegerField("", widget=wtforms.widgets.HiddenInput())
+	alignment_id = wtforms.SelectField('Select Alignment', choices=LazyChoices(alignment_options))
+	class_id = wtforms.SelectField('Select Class', choices=LazyChoices(class_options))
+	deity_id = wtforms.SelectField('Select Deity', choices=LazyChoices(deity_options))
 	description = wtforms.StringField('Describe Character')
-	home_world_id = wtforms.SelectField('Select Home World', choices=world_options())
-	gender = wtforms.SelectField('Select Gender', choices=gender_options())
+	home_world_id = wtforms.SelectField('Select Home World', choices=LazyChoices(world_options))
+	gender = wtforms.SelectField('Select Gender', choices=LazyChoices(gender_options))
 	name = wtforms.StringField('Change Name')
-	race_id = wtforms.SelectField('Select Race', choices=race_options())
-	theme_id = wtforms.SelectField('Select Theme', choices=theme_options())
+	race_id = wtforms.SelectField('Select Race', choices=LazyChoices(race_options))
+	theme_id = wtforms.SelectField('Select Theme', choices=LazyChoices(theme_options))
 	strength = wtforms.IntegerField('Strength')
 	dexterity = wtforms.IntegerField('Dexterity')
 	constitution = wtforms.IntegerField('Constitution')
@@ -124,14 +173,16 @@ class CharacterUpdateForm(MyBaseForm):
 
 class CharacterFeatsForm(MyBaseForm):
 	id = wtforms.StringField("")
-	character_id = wtforms.SelectField('Select Character', choices=character_options())
-	feat_id = wtforms.SelectField('Select Feat', choices=feat_options())
+	# Set per request with character_options()
+	character_id = wtforms.SelectField('Select Character', choices=())
+	feat_id = wtforms.SelectField('Select Feat', choices=LazyChoices(feat_options))
 
 
 class CharacterSpellsForm(MyBaseForm):
 	id = wtforms.StringField("")
-	character_id = wtforms.SelectField('Select Character', choices=character_options())
-	spell_id = wtforms.SelectField('Select Spell', choices=spell_options())
+	# Set per request with character_options()
+	character_id = wtforms.SelectField('Select Character', choices=())
+	spell_id = wtforms.SelectField('Select Spell', choices=LazyChoices(spell_options))
 
 
 class CharacterSkillsForm(MyBaseForm):
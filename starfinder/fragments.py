@@ -0,0 +1,167 @@
+"""
+Rendered fragment cache.
+
+Compendium pages and character cards render the same HTML for everyone, so
+the rendered output is kept in a process-wide LRU, keyed by template, the
+render arguments and the compendium version, and bounded by
+fragments.max_bytes. A compendium reload changes the version, which retires
+the old entries as they fall off the end of the LRU.
+
+page() serves a whole template with a strong ETag (a digest of the HTML) and
+Last-Modified (the compendium version stamp), and answers conditional
+requests with 304 straight from the cache index, without rendering.
+Cache-Control lets browsers and proxies keep pages for fragments.max_age.
+
+Templates cache part of themselves with a call block; per-visitor values,
+such as CSRF tokens, go in slots that are filled after the lookup:
+
+    {% call cached_fragment('card', char.id, char.name,
+                            slots={'csrf': form.csrf_token(id=False)}) %}
+        ... {{ fragment_slot('csrf') }} ...
+    {% endcall %}
+"""
+import collections
+import datetime
+import hashlib
+import sys
+import threading
+
+import flask
+
+from starfinder import config, logging
+from starfinder.db import compendium
+
+CONF = config.CONF
+LOG = logging.get_logger(__name__)
+
+SLOT_MARKER = "<!--fragment-slot:{}-->"
+START_TIME = datetime.datetime.utcnow().replace(microsecond=0)
+
+
+class Fragment(object):
+    __slots__ = ("html", "etag", "size")
+
+    def __init__(self, html):
+        self.html = html
+        self.etag = hashlib.sha1(html.encode("utf-8")).hexdigest()
+        self.size = sys.getsizeof(html)
+
+
+class FragmentCache(object):
+    """ LRU of Fragments, evicting the oldest once max_bytes is exceeded. """
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is None:
+            self._max_bytes = CONF.get_int("fragments.max_bytes",
+                                           32 * 1024 * 1024)
+        return self._max_bytes
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key, html):
+        fragment = Fragment(html)
+        if fragment.size > self.max_bytes:
+            return fragment
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[key] = fragment
+            self.size += fragment.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def to_dict(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size,
+                    "max_bytes": self.max_bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+FRAGMENTS = FragmentCache()
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item))
+                            for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def cache_key(name, *args, **kwargs):
+    return (name, _freeze(args), _freeze(kwargs),
+            compendium.COMPENDIUM.version)
+
+
+def fetch(key, render):
+    """ The cached Fragment for key, rendering it with render() on a miss """
+    fragment = FRAGMENTS.get(key)
+    if fragment is None:
+        fragment = FRAGMENTS.put(key, render())
+    return fragment
+
+
+def fragment_slot(name):
+    return flask.Markup(SLOT_MARKER.format(name))
+
+
+def cached_fragment(name, *args, slots=None, caller=None):
+    """ Jinja call block wrapper, see the module docstring. """
+    html = fetch(cache_key(name, *args), lambda: str(caller())).html
+    for slot, value in (slots or {}).items():
+        html = html.replace(SLOT_MARKER.format(slot), str(value))
+    return flask.Markup(html)
+
+
+def last_modified():
+    return compendium.COMPENDIUM.updated_at or START_TIME
+
+
+def page(template, **context):
+    """
+    Renders template through the cache as a conditional response. Only for
+    templates that don't depend on the visitor or their session.
+    """
+    key = cache_key(template, **context)
+    fragment = fetch(key,
+                     lambda: flask.render_template(template, **context))
+    response = flask.Response(fragment.html, mimetype="text/html")
+    response.set_etag(fragment.etag)
+    response.last_modified = last_modified()
+    response.cache_control.public = True
+    response.cache_control.max_age = int(
+        CONF.get_duration("fragments.max_age", 60))
+    return response.make_conditional(flask.request)
+
+
+def install(app):
+    app.jinja_env.globals.update(cached_fragment=cached_fragment,
+                                 fragment_slot=fragment_slot)
@@ -1,16 +1,227 @@
-from starfinder.db import models
-from starfinder import logging
+import sqlalchemy as sa
+from werkzeug import datastructures
+
+from starfinder.db import compendium, models, saves
+from starfinder import forms, logging, sheets
 
 LOG = logging.get_logger(__name__)
 
+# Builder fields that aren't Character columns: the link tables they fill,
+# as (link model, link column, Character relationship, target model)
+BUILDER_LINKS = {
+	'feat_id': (models.CharacterFeat, 'feat_id', 'character_feats', models.Feat),
+	'spell_id': (models.CharacterSpell, 'spell_id', 'character_spells', models.Spell),
+}
+BUILDER_COLUMNS = ('name', 'gender', 'description', 'level', 'race_id',
+				   'theme_id', 'class_id', 'alignment_id', 'deity_id',
+				   'home_world_id', 'strength', 'dexterity', 'constitution',
+				   'intelligence', 'wisdom', 'charisma')
+FORM_ONLY_FIELDS = ('id', 'version', 'csrf_token', 'submit')
+
+
+def submitted_data(form):
+	""" Data of the fields present in the request, by field name. """
+	return {field.short_name: field.data for field in form
+			if getattr(field, 'raw_data', None) and not field.process_errors}
+
+
+def expected_version(form):
+	version = getattr(form, 'version', None)
+	if version is None or not getattr(version, 'raw_data', None):
+		return None
+	return version.data
+
+
+def skill_columns():
+	return [column.key for column in sa.inspect(models.CharacterSkill).columns
+			if column.key not in ('id', 'character_id')]
+
+
+def _formdata(values, csrf_token):
+	data = datastructures.MultiDict(
+		(key, '' if value is None else str(value))
+		for key, value in values.items())
+	data['csrf_token'] = csrf_token or ''
+	return data
+
+
+class BuilderPatch(object):
+	"""
+	Any number of builder steps, folded in order into one change set and
+	validated with the builder forms. Steps are dicts of form field values;
+	feat_id and spell_id take {'add': [...], 'remove': [...]}.
+	"""
+
+	def __init__(self, data):
+		self.columns, self.skills = {}, {}
+		self.links = {name: {} for name in BUILDER_LINKS}
+		self.errors = {}
+		if not isinstance(data, dict):
+			self.errors['patch'] = ['Expected an object']
+			data = {}
+		self.version = data.get('version')
+		steps = data.get('steps', [])
+		if not isinstance(steps, list):
+			self.errors['steps'] = ['Expected a list of steps']
+			steps = []
+		skills = set(skill_columns())
+		for index, step in enumerate(steps):
+			if not isinstance(step, dict):
+				self.errors.setdefault('steps', []).append(
+					'Step {} is not an object'.format(index))
+				continue
+			for key, value in step.items():
+				if key in BUILDER_LINKS:
+					self._fold_links(key, value)
+				elif key in skills:
+					self.skills[key] = value
+				else:
+					self.columns[key] = value
+		csrf_token = data.get('csrf_token')
+		self.form = forms.CharacterUpdateForm(
+			_formdata(self.columns, csrf_token))
+		self.skills_form = forms.CharacterSkillsForm(
+			_formdata(self.skills, csrf_token))
+		self._validate()
+
+	def _fold_links(self, key, value):
+		if not isinstance(value, dict):
+			value = {'add': value if isinstance(value, list) else [value]}
+		for action, add in (('remove', False), ('add', True)):
+			target_ids = value.get(action, [])
+			if not isinstance(target_ids, list):
+				self.errors[key] = ["'{}' takes a list of ids".format(action)]
+				continue
+			for target_id in target_ids:
+				if _to_int(target_id) is None:
+					self.errors[key] = ['Invalid id: {!r}'.format(target_id)]
+				else:
+					self.links[key][_to_int(target_id)] = add
+
+	def _validate(self):
+		for key in self.columns:
+			if key not in self.form or key in FORM_ONLY_FIELDS:
+				self.errors[key] = ['Unknown builder field']
+		for form in (self.form, self.skills_form):
+			if not form.csrf_token.validate(form):
+				self.errors['csrf_token'] = form.csrf_token.errors
+			for field in form:
+				if (field.short_name in FORM_ONLY_FIELDS or
+						not getattr(field, 'raw_data', None)):
+					continue
+				if not field.validate(form):
+					self.errors[field.short_name] = field.errors
+		for key, targets in self.links.items():
+			target_model = BUILDER_LINKS[key][3]
+			unknown = [target_id for target_id in targets
+					   if compendium.get(target_model, target_id) is None]
+			if unknown:
+				self.errors[key] = ['Unknown ids: {}'.format(unknown)]
+
+	def apply(self, char):
+		"""
+		Writes the whole patch in one transaction and returns the changed
+		Character columns. Raises CharacterVersionConflict when the patch
+		was built from an older version of the character.
+		"""
+		saves.SAVES.check(char, self.version)
+		try:
+			linked = self._apply_links(char)
+			linked = self._apply_skills(char) or linked
+			changes = char.diff(submitted_data(self.form))
+			if linked:
+				# The link and skill rows have no version of their own
+				saves.SAVES.bump(char)
+			saves.SAVES.save(char, changes)
+			# Links and skills still need committing when no column changed,
+			# or when column saves are being coalesced
+			sheets.rebuild([char.id])
+			models.Session.commit()
+		except Exception:
+			models.Session.rollback()
+			raise
+		char.invalidate_sheet()
+		return changes
+
+	def _apply_links(self, char):
+		""" Adds and removes the link rows, returns whether any changed """
+		changed = False
+		for key, targets in self.links.items():
+			model, column, relation, _ = BUILDER_LINKS[key]
+			links = getattr(char, relation)
+			current = {getattr(link, column): link for link in links}
+			for target_id, add in targets.items():
+				if add and target_id not in current:
+					links.append(model(**{column: target_id}))
+					changed = True
+				elif not add and target_id in current:
+					links.remove(current[target_id])
+					models.Session.delete(current[target_id])
+					changed = True
+		return changed
+
+	def _apply_skills(self, char):
+		ranks = {key: value for key, value in
+				 submitted_data(self.skills_form).items()
+				 if key in self.skills}
+		if not ranks:
+			return False
+		if char.character_skills:
+			row = char.character_skills[0]
+			changed = any(row[key] != value for key, value in ranks.items())
+		else:
+			row = models.CharacterSkill(
+				**{column: 0 for column in skill_columns()})
+			char.character_skills.append(row)
+			changed = True
+		row.update(**ranks)
+		return changed
+
+
+def _to_int(value):
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return None
+
+
 class Helper(object):
 
 	def update_character(self, form, char):
-		attributes = char.to_dict().keys()
-		LOG.debug(attributes)
-		for key in attributes:
-			if key in form:
-				field = getattr(form, key)
-				setattr(char, key, field.data)
-		models.Session.add(char)
-		models.Session.commit()
+		"""
+		Saves the columns the form submitted that differ from the loaded
+		character and returns them. Raises CharacterVersionConflict when the
+		form was rendered from an older version of the character.
+		"""
+		changes = char.diff(submitted_data(form))
+		LOG.debug("Character %s changes: %s", char.id, sorted(changes))
+		return saves.SAVES.save(char, changes, expected_version(form))
+
+	def update_builder(self, data, char):
+		"""
+		Validates and applies a batch of builder steps. Returns the patch,
+		with its errors when nothing was written.
+		"""
+		patch = BuilderPatch(data)
+		if not patch.errors:
+			patch.apply(char)
+		return patch
+
+	def builder_state(self, char, with_options=True):
+		""" The character, its picks, derived stats and the builder options. """
+		skills = char.character_skills[0] if char.character_skills else None
+		state = {
+			'character': dict(
+				{key: getattr(char, key) for key in BUILDER_COLUMNS},
+				id=str(char.id), version=char.version),
+			'skills': {column: getattr(skills, column)
+					   for column in skill_columns()} if skills else {},
+			'feat_id': [link.feat_id for link in char.character_feats],
+			'spell_id': [link.spell_id for link in char.character_spells],
+			'stats': char.sheet,
+			'csrf_token': forms.CharacterUpdateForm().csrf_token.current_token,
+		}
+		if with_options:
+			state['options'] = {field: forms.CHOICES.get(loader)
+								for field, loader in forms.BUILDER_OPTIONS.items()}
+		return state
@@ -1,6 +1,25 @@
 # pylint: disable=abstract-method
+"""
+Non-blocking, structured logging.
+
+Request threads only render the log message and put the record on a bounded
+queue (AsyncQueueHandler); a background QueueListener thread does the JSON
+formatting and the stream/file I/O. When the queue is full records are
+dropped and counted rather than blocking the request.
+
+Hot DEBUG call sites can be sampled per logger with log.debug.sample, e.g.
+LOG_DEBUG_SAMPLE=starfinder.db.models=0.01,starfinder.helpers.helper=0.1
+keeps 1% and 10% of their DEBUG records. Sampled out records never reach
+the queue.
+"""
+import atexit
+import datetime
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+from logging import handlers
 
 from starfinder import config, exception
 
@@ -30,6 +49,87 @@ class LevelOnlyFilter(logging.Filter):
         return record.levelno == self._level
 
 
+class DebugSamplingFilter(logging.Filter):
+    """ Keeps only a fraction of the DEBUG records of the configured loggers """
+
+    def __init__(self, rates):
+        self._rates = rates
+        super().__init__()
+
+    def _rate(self, name):
+        while name:
+            if name in self._rates:
+                return self._rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or not self._rates:
+            return True
+        return random.random() < self._rate(record.name)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.utcfromtimestamp(
+                record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+            "at": "{}:{}".format(record.pathname, record.lineno),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class AsyncQueueHandler(handlers.QueueHandler):
+    """
+    Enqueues records for a background QueueListener. The message is rendered
+    here, on the calling thread, so the writer never touches objects (ORM
+    instances in particular) that belong to the request. The listener is
+    restarted in forked children, where the parent's thread doesn't exist.
+    """
+
+    def __init__(self, targets, maxsize):
+        self._targets = targets
+        self._maxsize = maxsize
+        self.dropped = 0
+        self._pid = None
+        self.listener = None
+        super().__init__(None)
+        self.start()
+
+    def start(self):
+        self.queue = queue.Queue(self._maxsize)
+        self.listener = handlers.QueueListener(
+            self.queue, *self._targets, respect_handler_level=True)
+        self.listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
 def verify_log_level(log_level_name, key):
     # TODO This validation will happen in tortilla later
     acceptable_levels = ["DEBUG", "WARNING", "INFO", "ERROR", "CRITICAL"]
@@ -38,33 +138,68 @@ def verify_log_level(log_level_name, key):
                                            value=CONF.get(key))
 
 
+def _formatter():
+    if CONF.get("log.format", "json") == "json":
+        return JsonFormatter()
+    return logging.Formatter(LOG_FORMAT)
+
+
 def file_log_handler():
+    """
+    Rotates by time when log.file.when is set (e.g. midnight), by size
+    (log.file.max_bytes) otherwise, keeping log.file.backups old files.
+    """
     env = CONF.get("environment")
     path = CONF.get("log.file.path").format(env)
-    file_handler = RotatingFileHandler(path)
+    backups = CONF.get_int("log.file.backups", 5)
+    when = CONF.get("log.file.when", "")
+    if when:
+        file_handler = handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backups)
+    else:
+        file_handler = handlers.RotatingFileHandler(
+            path, maxBytes=CONF.get_int("log.file.max_bytes", 10 * 1024 * 1024),
+            backupCount=backups)
     file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s '
-        '[in %(pathname)s:%(lineno)d]'
-    ))
+    file_handler.setFormatter(_formatter())
     return file_handler
 
 
+def _sample_rates():
+    rates = {}
+    for entry in CONF.get_list("log.debug.sample", ()):
+        name, _, rate = entry.partition('=')
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            raise exception.InvalidConfigValue(key="log.debug.sample",
+                                               value=entry)
+    return rates
+
+
 def setup_logging():
     app_logger = logging.getLogger(BASE_NAME)
-    app_handler = logging.StreamHandler()
 
     conf_log_level = CONF.get("loglevel", "DEBUG")
     verify_log_level(conf_log_level, "loglevel")
-
     app_logger.setLevel(conf_log_level)
-    app_formatter = logging.Formatter(LOG_FORMAT)
-    app_handler.setFormatter(app_formatter)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(_formatter())
+    targets = [stream_handler]
+    if CONF.get("log.file.path", ""):
+        targets.append(file_log_handler())
+
+    app_handler = AsyncQueueHandler(targets,
+                                    CONF.get_int("log.queue.size", 10000))
+    app_handler.addFilter(DebugSamplingFilter(_sample_rates()))
     app_logger.addHandler(app_handler)
+    atexit.register(app_handler.stop)
+    return app_handler
 
 
 def get_logger(name):
     return logging.getLogger(name)
 
 
-setup_logging()
+HANDLER = setup_logging()
@@ -0,0 +1,179 @@
+"""
+Modifier aggregation.
+
+Modifiers reach a character from four places: its feats (Feat.modifier_id),
+its race (RacialTrait -> RacialTraitModifier), and its theme (ThemeModifier,
+and ClassModifier, whose rows point at themes). When the compendium loads,
+each Modifier's free text effected_stat is resolved once and every source
+is compiled into a vector with one slot per stat in stats.STATS, so a
+character's totals are a sum of a few cached vectors.
+
+Totals keeps the sources it was built from. sync() only subtracts and adds
+the sources that changed, so swapping a feat or a theme costs one vector
+operation each, whatever the character already has.
+"""
+import array
+import threading
+
+from starfinder import logging, stats
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+STAT_INDEX = {stat: index for index, stat in enumerate(stats.STATS)}
+SIZE = len(stats.STATS)
+
+
+def zero():
+    return array.array('l', [0]) * SIZE
+
+
+def compile_pairs(pairs):
+    """ The vector of (effected_stat, modification) pairs. """
+    vector = zero()
+    for stat, modification in pairs:
+        index = STAT_INDEX.get(stats.normalize_stat(stat))
+        if index is not None and modification:
+            vector[index] += modification
+    return vector
+
+
+def to_misc(vector):
+    """ The stat -> total dict that stats.Snapshot takes. """
+    return {stat: vector[index] for stat, index in STAT_INDEX.items()
+            if vector[index]}
+
+
+class ModifierVectors(object):
+    """ Every modifier source compiled at one compendium version. """
+
+    def __init__(self, cache):
+        modifiers = {record.id: (record.effected_stat, record.modification)
+                     for record in cache.all(models.Modifier)}
+        self.feats = {}
+        for feat in cache.all(models.Feat):
+            if feat.modifier_id in modifiers:
+                self.feats[feat.id] = compile_pairs(
+                    [modifiers[feat.modifier_id]])
+        self.themes = self._group(
+            modifiers, ((link.theme_id, link.modifier_id) for link in
+                        cache.all(models.ThemeModifier)),
+            ((link.theme_id, link.modifier_id) for link in
+             cache.all(models.ClassModifier)))
+        trait_races = {trait.id: trait.race_id
+                       for trait in cache.all(models.RacialTrait)}
+        self.races = self._group(
+            modifiers, ((trait_races.get(link.trait_id), link.modifier_id)
+                        for link in cache.all(models.RacialTraitModifier)))
+
+    @staticmethod
+    def _group(modifiers, *links):
+        pairs = {}
+        for source in links:
+            for owner_id, modifier_id in source:
+                if owner_id is not None and modifier_id in modifiers:
+                    pairs.setdefault(owner_id, []).append(
+                        modifiers[modifier_id])
+        return {owner_id: compile_pairs(owner_pairs)
+                for owner_id, owner_pairs in pairs.items()}
+
+
+class Totals(object):
+    """ One character's summed modifiers, kept up to date incrementally. """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.vector = zero()
+        self.race_id = None
+        self.theme_id = None
+        self.feat_ids = {}
+
+    def _apply(self, source, sign):
+        if source is not None:
+            vector = self.vector
+            for index in range(SIZE):
+                vector[index] += sign * source[index]
+
+    def set_race(self, race_id):
+        if race_id != self.race_id:
+            self._apply(self.vectors.races.get(self.race_id), -1)
+            self._apply(self.vectors.races.get(race_id), 1)
+            self.race_id = race_id
+
+    def set_theme(self, theme_id):
+        if theme_id != self.theme_id:
+            self._apply(self.vectors.themes.get(self.theme_id), -1)
+            self._apply(self.vectors.themes.get(theme_id), 1)
+            self.theme_id = theme_id
+
+    def add_feat(self, feat_id):
+        self.feat_ids[feat_id] = self.feat_ids.get(feat_id, 0) + 1
+        self._apply(self.vectors.feats.get(feat_id), 1)
+
+    def remove_feat(self, feat_id):
+        if self.feat_ids.get(feat_id):
+            self.feat_ids[feat_id] -= 1
+            if not self.feat_ids[feat_id]:
+                del self.feat_ids[feat_id]
+            self._apply(self.vectors.feats.get(feat_id), -1)
+
+    def sync(self, race_id, theme_id, feat_ids):
+        """ Applies only the sources that differ from the current ones. """
+        self.set_race(race_id)
+        self.set_theme(theme_id)
+        wanted = {}
+        for feat_id in feat_ids:
+            wanted[feat_id] = wanted.get(feat_id, 0) + 1
+        for feat_id in set(self.feat_ids) | set(wanted):
+            for _ in range(wanted.get(feat_id, 0) -
+                           self.feat_ids.get(feat_id, 0)):
+                self.add_feat(feat_id)
+            for _ in range(self.feat_ids.get(feat_id, 0) -
+                           wanted.get(feat_id, 0)):
+                self.remove_feat(feat_id)
+        return self
+
+    @property
+    def misc(self):
+        return to_misc(self.vector)
+
+
+class ModifierEngine(object):
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._vectors = None
+        cache.on_reload(self._reset)
+
+    def _reset(self, _cache):
+        self._vectors = None
+
+    def vectors(self):
+        self._cache.refresh()
+        vectors = self._vectors
+        if vectors is None:
+            with self._lock:
+                vectors = self._vectors
+                if vectors is None:
+                    vectors = self._vectors = ModifierVectors(self._cache)
+                    LOG.debug("Compiled modifiers of %d feats, %d themes "
+                              "and %d races", len(vectors.feats),
+                              len(vectors.themes), len(vectors.races))
+        return vectors
+
+    def totals(self, race_id=None, theme_id=None, feat_ids=(), current=None):
+        """
+        Totals of these sources. current, a Totals from an earlier call, is
+        updated in place when it was built from the same compendium.
+        """
+        vectors = self.vectors()
+        if current is None or current.vectors is not vectors:
+            current = Totals(vectors)
+        return current.sync(race_id, theme_id, feat_ids)
+
+
+ENGINE = ModifierEngine(compendium.COMPENDIUM)
+
+
+def totals(race_id=None, theme_id=None, feat_ids=(), current=None):
+    return ENGINE.totals(race_id, theme_id, feat_ids, current)
@@ -0,0 +1,553 @@
+"""
+Character build optimizer.
+
+Finds the best legal builds of a class at a level for a target, a weighted
+sum of derived stats such as "eac,ranged_atk". A build is a race, a theme,
+a point buy over the ability scores and the feats for the level's feat
+slots. Ability score increases from levelling up aren't modelled.
+
+Every (race, theme) pair is one branch-and-bound search. The target is
+linear in the ability modifiers and in the stat modifiers of feats, so the
+value each ability point and each feat can add is measured once per
+problem. Abilities are then assigned depth first, most valuable first; a
+branch is cut when its value so far, plus the most the remaining points and
+the feat slots could add, can't beat the worst of the top builds. Only
+spends that change a modifier or reach a feat's ability prerequisite are
+tried. At each leaf the feats are picked by a second small
+branch-and-bound over the eligible feats.
+
+The pairs run on a process pool, most promising first. Each one is given
+the current N-th best score as its floor, so later searches prune against
+what earlier ones found. optimize() yields the top builds as they improve
+and stops at the time budget, saying whether the search was complete.
+Problems only hold plain tuples, so they pickle cheaply to the workers,
+which never touch the database.
+
+Every web worker process has its own pool. By default the pools share the
+cores between the web workers, and each web worker runs at most
+optimizer.concurrency searches at once, see take_slot().
+"""
+import collections
+import heapq
+import itertools
+import multiprocessing
+import threading
+import time
+from concurrent import futures
+
+from starfinder import config, exception, logging, prerequisites, stats
+from starfinder.db import compendium, models
+
+CONF = config.CONF
+LOG = logging.get_logger(__name__)
+
+POINT_BUY = 10
+MAX_START_SCORE = 18
+DEFAULT_TOP = 5
+# Deadline checks happen every this many search nodes
+CHECK_EVERY = 1024
+
+Choice = collections.namedtuple(
+    "Choice", ("id", "name", "hit_points", "adjustments", "misc"))
+ClassChoice = collections.namedtuple(
+    "ClassChoice", ("id", "name", "hit_points", "stamina_points"))
+FeatChoice = collections.namedtuple(
+    "FeatChoice", ("id", "name", "misc", "abilities", "level",
+                   "base_attack_bonus", "classes", "requires"))
+Build = collections.namedtuple(
+    "Build", ("score", "race", "theme", "scores", "feats", "unspent"))
+
+
+def parse_target(text):
+    """ "eac,ranged_atk:2" -> {"eac": 1.0, "ranged_atk": 2.0} """
+    weights = {}
+    for term in (text or "").split(","):
+        if not term.strip():
+            continue
+        name, _, weight = term.partition(":")
+        stat = stats.normalize_stat(name)
+        if stat is None:
+            raise exception.InvalidBuildTarget(
+                target=text, reason="unknown stat '{}'".format(name.strip()))
+        try:
+            weights[stat] = weights.get(stat, 0) + float(weight or 1)
+        except ValueError:
+            raise exception.InvalidBuildTarget(
+                target=text, reason="bad weight '{}'".format(weight))
+    if not weights:
+        raise exception.InvalidBuildTarget(target=text, reason="no stats")
+    return weights
+
+
+def _ability(name):
+    key = (name or "").strip().lower()
+    for ability in stats.ABILITIES:
+        if key in (ability, ability[:3]):
+            return ability
+    return None
+
+
+def _split_modifiers(pairs):
+    """ Ability score adjustments, and the rest as collect_modifiers() does """
+    adjustments = dict.fromkeys(stats.ABILITIES, 0)
+    rest = []
+    for stat, modification in pairs:
+        ability = _ability(stat)
+        if ability is not None:
+            adjustments[ability] += modification or 0
+        else:
+            rest.append((stat, modification))
+    return (tuple(adjustments[ability] for ability in stats.ABILITIES),
+            stats.collect_modifiers(rest))
+
+
+def _merge(*miscs):
+    merged = {}
+    for misc in miscs:
+        for stat, value in misc.items():
+            merged[stat] = merged.get(stat, 0) + value
+    return merged
+
+
+class Problem(object):
+    """ Everything a search needs, as plain picklable data. """
+
+    def __init__(self, weights, level, class_choice, races, themes, feats,
+                 points=POINT_BUY):
+        self.weights = weights
+        self.level = level
+        self.class_choice = class_choice
+        self.races = tuple(races)
+        self.themes = tuple(themes)
+        self.feats = {feat.id: feat for feat in feats}
+        self.points = points
+        self.feat_slots = (level + 1) // 2
+        self.base_attack_bonus = stats.base_bonuses(
+            class_choice.name, level)["base_atk_bonus"]
+        baseline = self.value(self.sheet(None, None, (10,) * 6, ()))
+        # What one more ability modifier point, and each feat, adds
+        self.ability_values = []
+        for index in range(len(stats.ABILITIES)):
+            scores = [10] * 6
+            scores[index] = 12
+            self.ability_values.append(
+                self.value(self.sheet(None, None, scores, ())) - baseline)
+        self.feat_values = {
+            feat.id: self.value(self.sheet(None, None, (10,) * 6,
+                                           (feat.id,))) - baseline
+            for feat in feats}
+
+    @classmethod
+    def build(cls, weights, level, class_id, race_ids=None, theme_ids=None,
+              points=POINT_BUY):
+        """ Builds a problem from the compendium. """
+        class_record = compendium.get(models.Class, class_id)
+        if class_record is None:
+            raise exception.InvalidBuildTarget(
+                target=class_id, reason="unknown class")
+        modifiers = compendium.table(models.Modifier)
+
+        def pairs(links):
+            return [(modifiers.get(link.modifier_id).effected_stat,
+                     modifiers.get(link.modifier_id).modification)
+                    for link in links
+                    if modifiers.get(link.modifier_id) is not None]
+
+        traits = {}
+        for trait in compendium.get_all(models.RacialTrait):
+            traits[trait.id] = trait.race_id
+        race_links, theme_links = {}, {}
+        for link in compendium.get_all(models.RacialTraitModifier):
+            race_links.setdefault(traits.get(link.trait_id), []).append(link)
+        for link in compendium.get_all(models.ThemeModifier):
+            theme_links.setdefault(link.theme_id, []).append(link)
+
+        races = [Choice(race.id, race.name, race.hit_points,
+                        *_split_modifiers(pairs(race_links.get(race.id, ()))))
+                 for race in compendium.get_all(models.Race)
+                 if race_ids is None or race.id in race_ids]
+        themes = [Choice(theme.id, theme.name, 0,
+                         *_split_modifiers(pairs(theme_links.get(theme.id,
+                                                                 ()))))
+                  for theme in compendium.get_all(models.Theme)
+                  if theme_ids is None or theme.id in theme_ids]
+        class_choice = ClassChoice(class_record.id, class_record.name,
+                                   class_record.hit_points,
+                                   class_record.stamina_points)
+        return cls(weights, level, class_choice, races, themes,
+                   _feat_choices(), points)
+
+    def sheet(self, race, theme, scores, feat_ids):
+        misc = _merge(race.misc if race else {}, theme.misc if theme else {},
+                      *[self.feats[feat_id].misc for feat_id in feat_ids])
+        return stats.compute(stats.Snapshot(
+            level=self.level,
+            scores=dict(zip(stats.ABILITIES, scores)),
+            race_hit_points=race.hit_points if race else 0,
+            class_hit_points=self.class_choice.hit_points,
+            class_stamina_points=self.class_choice.stamina_points,
+            class_name=self.class_choice.name,
+            misc=misc))
+
+    def value(self, sheet):
+        return sum(weight * sheet[stat]
+                   for stat, weight in self.weights.items())
+
+    def feat_allowed(self, feat, scores):
+        if self.level < feat.level:
+            return False
+        if self.base_attack_bonus < feat.base_attack_bonus:
+            return False
+        if any(score < minimum
+               for score, minimum in zip(scores, feat.abilities)):
+            return False
+        return all(class_id == self.class_choice.id and self.level >= level
+                   for class_id, level in feat.classes.items())
+
+
+def _feat_choices():
+    """
+    The feats with stat modifiers, and the feats they require. Feats whose
+    prerequisites couldn't be fully compiled (skill ranks, alternatives, free
+    text) are left out, since their legality can't be checked.
+    """
+    graph = prerequisites.graph()
+    modifiers = compendium.table(models.Modifier)
+    wanted = set()
+    for feat in graph.feats:
+        modifier = modifiers.get(feat.modifier_id) if feat.modifier_id else None
+        if modifier is not None and stats.collect_modifiers(
+                [(modifier.effected_stat, modifier.modification)]):
+            wanted.add(feat.id)
+            wanted.update(graph.closure(feat.id))
+    choices = []
+    for feat_id in sorted(wanted):
+        requirements = graph.requirements[feat_id]
+        if (requirements.skills or requirements.any_of or
+                requirements.unparsed):
+            continue
+        feat = compendium.get(models.Feat, feat_id)
+        modifier = modifiers.get(feat.modifier_id) if feat.modifier_id else None
+        misc = (stats.collect_modifiers([(modifier.effected_stat,
+                                          modifier.modification)])
+                if modifier is not None else {})
+        choices.append(FeatChoice(
+            feat.id, feat.name, misc,
+            tuple(requirements.abilities.get(ability, 0)
+                  for ability in stats.ABILITIES),
+            requirements.level, requirements.base_attack_bonus,
+            dict(requirements.classes),
+            tuple(sorted(graph.closure(feat_id)))))
+    return choices
+
+
+class Search(object):
+    """ The branch-and-bound search of one (race, theme) pair. """
+
+    def __init__(self, problem, race, theme, top, floor, deadline):
+        self.problem = problem
+        self.race = race
+        self.theme = theme
+        self.top = top
+        self.floor = floor
+        self.deadline = deadline
+        self.builds = []
+        self.nodes = 0
+        self.complete = True
+        self.base = tuple(10 + r + t for r, t in zip(race.adjustments,
+                                                     theme.adjustments))
+        values = problem.ability_values
+        thresholds = [set() for _ in stats.ABILITIES]
+        for feat in problem.feats.values():
+            for index, minimum in enumerate(feat.abilities):
+                if minimum:
+                    thresholds[index].add(minimum)
+        # Abilities worth spending on, most valuable first
+        self.order = sorted(
+            (index for index in range(len(stats.ABILITIES))
+             if values[index] > 0 or thresholds[index]),
+            key=lambda index: -values[index])
+        self.spends = [self._spends(index, thresholds[index])
+                       for index in self.order]
+        self.best_gain = [self._best_gains(position)
+                          for position in range(len(self.order) + 1)]
+        self.feat_bound = sum(sorted(
+            (value for value in problem.feat_values.values() if value > 0),
+            reverse=True)[:problem.feat_slots])
+        self._feat_memo = {}
+
+    def _spends(self, index, thresholds):
+        base = self.base[index]
+        top = min(self.problem.points, MAX_START_SCORE - base)
+        spends = [spend for spend in range(top + 1)
+                  if spend == 0 or (base + spend) % 2 == 0 or
+                  base + spend in thresholds]
+        return [(spend, self.problem.ability_values[index] *
+                 (stats.ability_modifier(base + spend) -
+                  stats.ability_modifier(base)))
+                for spend in spends]
+
+    def _best_gains(self, position):
+        """ best[points] = the most the abilities from position on can add """
+        best = [0.0] * (self.problem.points + 1)
+        for later in range(position, len(self.order)):
+            for points in range(self.problem.points + 1):
+                best[points] += max(gain for spend, gain in self.spends[later]
+                                    if spend <= points)
+        return best
+
+    @property
+    def threshold(self):
+        if len(self.builds) < self.top:
+            return self.floor
+        return max(self.floor, self.builds[0][0])
+
+    def run(self):
+        start = self.problem.value(self.problem.sheet(
+            self.race, self.theme, self.base, ()))
+        self._assign(0, list(self.base), self.problem.points, start)
+        return self
+
+    def _expired(self):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0 and time.time() > self.deadline:
+            self.complete = False
+        return not self.complete
+
+    def _assign(self, position, scores, points, value):
+        if self._expired():
+            return
+        if value + self.best_gain[position][points] + self.feat_bound <= \
+                self.threshold:
+            return
+        if position == len(self.order):
+            self._leaf(scores, points)
+            return
+        index = self.order[position]
+        base = scores[index]
+        # Biggest spends first, so good builds are found early
+        for spend, gain in reversed(self.spends[position]):
+            if spend > points:
+                continue
+            scores[index] = base + spend
+            self._assign(position + 1, scores, points - spend, value + gain)
+        scores[index] = base
+
+    def _leaf(self, scores, unspent):
+        scores = tuple(scores)
+        eligible = tuple(feat_id for feat_id, feat in
+                         sorted(self.problem.feats.items())
+                         if self.problem.feat_allowed(feat, scores))
+        feats = self._feat_memo.get(eligible)
+        if feats is None:
+            feats = self._feat_memo[eligible] = self._best_feats(eligible)
+        score = self.problem.value(self.problem.sheet(
+            self.race, self.theme, scores, feats))
+        if score <= self.threshold:
+            return
+        entry = (score, next(_TIEBREAK), Build(
+            score, self.race.id, self.theme.id, scores, feats, unspent))
+        if len(self.builds) < self.top:
+            heapq.heappush(self.builds, entry)
+        else:
+            heapq.heapreplace(self.builds, entry)
+
+    def _best_feats(self, eligible):
+        """ The most valuable set of eligible feats that fits the slots. """
+        allowed = set(eligible)
+        values = self.problem.feat_values
+        items = sorted(
+            (feat_id for feat_id in eligible if values[feat_id] > 0 and
+             allowed.issuperset(self.problem.feats[feat_id].requires)),
+            key=lambda feat_id: -values[feat_id])
+        slots = self.problem.feat_slots
+        best = [0.0, frozenset()]
+
+        def visit(position, chosen, value):
+            if value > best[0]:
+                best[:] = [value, chosen]
+            room = slots - len(chosen)
+            if position == len(items) or room <= 0:
+                return
+            if value + sum(values[feat_id] for feat_id in
+                           items[position:position + room]) <= best[0]:
+                return
+            feat_id = items[position]
+            wanted = chosen.union((feat_id,),
+                                  self.problem.feats[feat_id].requires)
+            if len(wanted) <= slots:
+                visit(position + 1, wanted,
+                      sum(values[wanted_id] for wanted_id in wanted))
+            visit(position + 1, chosen, value)
+
+        visit(0, frozenset(), 0.0)
+        return tuple(sorted(best[1]))
+
+
+_TIEBREAK = itertools.count()
+
+
+def search(problem, race_index, theme_index, top, floor, deadline):
+    """ Runs one pair's search; the process pool entry point. """
+    result = Search(problem, problem.races[race_index],
+                    problem.themes[theme_index], top, floor, deadline).run()
+    return ([build for _, _, build in result.builds], result.nodes,
+            result.complete)
+
+
+def _bound(problem, race, theme):
+    """ An optimistic score for a pair, to search the best ones first. """
+    probe = Search(problem, race, theme, 1, float("-inf"), float("inf"))
+    start = problem.value(problem.sheet(race, theme, probe.base, ()))
+    return start + probe.best_gain[0][problem.points] + probe.feat_bound
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_SLOTS = None
+
+
+def pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = futures.ProcessPoolExecutor(workers())
+        return _POOL
+
+
+def workers():
+    """ Pool size, by default this process' share of the cores """
+    web_workers = CONF.get_int("web.workers",
+                               multiprocessing.cpu_count() * 2 + 1)
+    return CONF.get_int("optimizer.workers",
+                        max(multiprocessing.cpu_count() // web_workers, 1))
+
+
+def take_slot():
+    """
+    Takes one of this process' optimizer.concurrency search slots without
+    waiting. Returns False when they're all busy, else release_slot() must
+    be called once the search is over.
+    """
+    global _SLOTS
+    with _POOL_LOCK:
+        if _SLOTS is None:
+            _SLOTS = threading.BoundedSemaphore(
+                CONF.get_int("optimizer.concurrency", 1))
+    return _SLOTS.acquire(blocking=False)
+
+
+def release_slot():
+    _SLOTS.release()
+
+
+def optimize(problem, top=DEFAULT_TOP, budget=None, executor=None):
+    """
+    Yields ("top", builds) each time the top builds change, then
+    ("done", builds, stats). Runs on executor, the shared process pool by
+    default; pass executor=False to search in this process.
+    """
+    budget = budget or CONF.get_duration("optimizer.budget", 10)
+    deadline = time.time() + budget
+    started = time.monotonic()
+    pairs = sorted(
+        ((_bound(problem, race, theme), race_index, theme_index)
+         for race_index, race in enumerate(problem.races)
+         for theme_index, theme in enumerate(problem.themes)),
+        reverse=True)
+    best = []
+    totals = {"pairs": len(pairs), "searched": 0, "pruned": 0, "nodes": 0,
+              "complete": True}
+
+    def threshold():
+        return best[0][0] if len(best) >= top else float("-inf")
+
+    def merge(result):
+        builds, nodes, complete = result
+        totals["searched"] += 1
+        totals["nodes"] += nodes
+        totals["complete"] &= complete
+        changed = False
+        for build in builds:
+            if len(best) < top:
+                heapq.heappush(best, (build.score, next(_TIEBREAK), build))
+            elif build.score > best[0][0]:
+                heapq.heapreplace(best,
+                                  (build.score, next(_TIEBREAK), build))
+            else:
+                continue
+            changed = True
+        return changed
+
+    def ranked():
+        return [build for _, _, build in sorted(best, reverse=True)]
+
+    pending = collections.deque(pairs)
+    if executor is False:
+        while pending and time.time() < deadline:
+            bound, race_index, theme_index = pending.popleft()
+            if bound <= threshold():
+                totals["pruned"] += 1
+                continue
+            if merge(search(problem, race_index, theme_index, top,
+                            threshold(), deadline)):
+                yield "top", ranked()
+    else:
+        executor = executor or pool()
+        running = set()
+        while (pending or running) and time.time() < deadline:
+            while pending and len(running) < workers() * 2:
+                bound, race_index, theme_index = pending.popleft()
+                if bound <= threshold():
+                    totals["pruned"] += 1
+                    continue
+                running.add(executor.submit(search, problem, race_index,
+                                            theme_index, top, threshold(),
+                                            deadline))
+            if not running:
+                continue
+            done, running = futures.wait(
+                running, timeout=max(deadline - time.time(), 0),
+                return_when=futures.FIRST_COMPLETED)
+            changed = False
+            for future in done:
+                changed |= merge(future.result())
+            if changed:
+                yield "top", ranked()
+        for future in running:
+            future.cancel()
+    if pending:
+        totals["complete"] = False
+    totals["seconds"] = round(time.monotonic() - started, 3)
+    yield "done", ranked(), totals
+
+
+def build_to_dict(problem, build):
+    races = {race.id: race for race in problem.races}
+    themes = {theme.id: theme for theme in problem.themes}
+    race, theme = races[build.race], themes[build.theme]
+    return {
+        "score": build.score,
+        "race": {"id": race.id, "name": race.name},
+        "theme": {"id": theme.id, "name": theme.name},
+        "class": {"id": problem.class_choice.id,
+                  "name": problem.class_choice.name},
+        "level": problem.level,
+        "scores": dict(zip(stats.ABILITIES, build.scores)),
+        "unspent_points": build.unspent,
+        "feats": [{"id": feat_id, "name": problem.feats[feat_id].name}
+                  for feat_id in build.feats],
+        "free_feat_slots": problem.feat_slots - len(build.feats),
+        "sheet": problem.sheet(race, theme, build.scores, build.feats),
+    }
+
+
+def events(problem, top=DEFAULT_TOP, budget=None, executor=None):
+    """ optimize() as JSON-ready dicts, for the endpoint and the CLI. """
+    for event in optimize(problem, top, budget, executor):
+        document = {"event": event[0],
+                    "builds": [build_to_dict(problem, build)
+                               for build in event[1]]}
+        if event[0] == "done":
+            document["stats"] = event[2]
+        yield document
@@ -0,0 +1,462 @@
+"""
+Feat prerequisites and eligibility.
+
+Feat.prereq_text is free text ("Dex 15, Weapon Focus, base attack bonus +1").
+When the compendium loads every feat is given a bit position and its text is
+compiled into structured requirements: minimum ability scores, character
+level, base attack bonus, class levels, skill ranks (or training) and
+other feats, and "A or B" clauses into groups of alternatives. Feat to feat
+requirements form a DAG; cycles are reported and broken. Feats with clauses
+that can't be compiled are logged and never offered, as their
+prerequisites can't be checked.
+
+For every threshold requirement the graph keeps, per possible value, the
+bitmask of the feats that value satisfies (feats without that requirement
+included). A character's eligibility is then an AND of one precomputed mask
+per ability, level, class and skill, plus the feats whose required feats
+are all owned. The few feats with alternatives are checked one by one on
+top. Eligibility caches the first part, so adding or removing a feat in the
+picker only redoes the feat part.
+
+FeatOption and ClassSpecialSkill rows point at their parent with parent_id;
+those trees are built here too, for the pickers that show them.
+"""
+import re
+import threading
+
+from starfinder import logging, stats
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+MAX_SCORE = 40
+MAX_LEVEL = 20
+MAX_RANKS = 20
+
+ABILITY_NAMES = {ability[:3]: ability for ability in stats.ABILITIES}
+NONE_TEXT = ("", "-", "none", "—", "–")
+
+CLAUSE_SPLIT_RE = re.compile(r"\s*(?:[,;]|\band\b)\s*", re.IGNORECASE)
+OR_SPLIT_RE = re.compile(r"\s+or\s+", re.IGNORECASE)
+ABILITY_RE = re.compile(r"^(str|dex|con|int|wis|cha)[a-z]*\s+(\d+)$")
+BAB_RE = re.compile(r"^base attack bonus\s*\+?(\d+)$")
+CHARACTER_LEVEL_RE = re.compile(r"^character level\s+(\d+)(?:st|nd|rd|th)?$")
+CLASS_LEVEL_RE = re.compile(r"^([a-z ]+?)\s+level\s+(\d+)(?:st|nd|rd|th)?$")
+SKILL_RANKS_RE = re.compile(r"^([a-z ()]+?)\s+(\d+)\s+ranks?$")
+TRAINED_RE = re.compile(r"^trained in (?:the )?([a-z ()]+?)(?: skill)?$")
+# Skills whose CharacterSkill column is spelled differently
+SKILL_COLUMNS = {"mysticism": "mysticsm"}
+
+
+class Requirements(object):
+    """ The compiled prerequisites of one feat. """
+    __slots__ = ("abilities", "level", "base_attack_bonus", "classes",
+                 "skills", "feats", "any_of", "unparsed")
+
+    def __init__(self):
+        self.abilities = {}
+        self.level = 0
+        self.base_attack_bonus = 0
+        self.classes = {}
+        self.skills = {}
+        self.feats = set()
+        # Groups of Requirements, one of each group must be met
+        self.any_of = []
+        self.unparsed = []
+
+    def satisfied(self, abilities, level, class_id, base_attack_bonus,
+                  skills):
+        """ Whether everything but the feats is met. """
+        level = level or 0
+        return (all((abilities.get(ability) or 0) >= minimum
+                    for ability, minimum in self.abilities.items()) and
+                level >= self.level and
+                (base_attack_bonus or 0) >= self.base_attack_bonus and
+                all(class_id == required and level >= minimum
+                    for required, minimum in self.classes.items()) and
+                all((skills.get(skill) or 0) >= minimum
+                    for skill, minimum in self.skills.items()))
+
+    def to_dict(self):
+        return {"abilities": self.abilities, "level": self.level,
+                "base_attack_bonus": self.base_attack_bonus,
+                "classes": self.classes, "skills": self.skills,
+                "feats": sorted(self.feats),
+                "any_of": [[alternative.to_dict() for alternative in group]
+                           for group in self.any_of],
+                "unparsed": self.unparsed}
+
+
+def _skill_key(name):
+    key = re.sub(r"[^a-z]+", "_", name.lower()).strip("_")
+    return SKILL_COLUMNS.get(key, key)
+
+
+def compile_requirements(text, feats_by_name, classes_by_name, skill_keys):
+    """ Requirements of a prereq_text, resolving names with the lookups. """
+    requirements = Requirements()
+    text = (text or "").strip()
+    if text.lower() in NONE_TEXT:
+        return requirements
+    for clause in CLAUSE_SPLIT_RE.split(text.rstrip(".")):
+        clause = clause.strip()
+        lowered = clause.lower()
+        if not clause:
+            continue
+        match = ABILITY_RE.match(lowered)
+        if match:
+            ability = ABILITY_NAMES[match.group(1)]
+            requirements.abilities[ability] = int(match.group(2))
+            continue
+        match = BAB_RE.match(lowered)
+        if match:
+            requirements.base_attack_bonus = int(match.group(1))
+            continue
+        match = CHARACTER_LEVEL_RE.match(lowered)
+        if match:
+            requirements.level = int(match.group(1))
+            continue
+        match = CLASS_LEVEL_RE.match(lowered)
+        if match and match.group(1) in classes_by_name:
+            requirements.classes[classes_by_name[match.group(1)]] = int(
+                match.group(2))
+            continue
+        match = SKILL_RANKS_RE.match(lowered)
+        if match and _skill_key(match.group(1)) in skill_keys:
+            requirements.skills[_skill_key(match.group(1))] = int(
+                match.group(2))
+            continue
+        match = TRAINED_RE.match(lowered)
+        if match and _skill_key(match.group(1)) in skill_keys:
+            # Trained is at least one rank
+            skill = _skill_key(match.group(1))
+            requirements.skills[skill] = max(
+                requirements.skills.get(skill, 0), 1)
+            continue
+        feat_id = feats_by_name.get(lowered)
+        if feat_id is None:
+            # "Weapon Focus (any)" and the like name the base feat
+            feat_id = feats_by_name.get(lowered.split("(")[0].strip())
+        if feat_id is not None:
+            requirements.feats.add(feat_id)
+            continue
+        alternatives = OR_SPLIT_RE.split(clause)
+        if len(alternatives) > 1:
+            alternatives = [
+                compile_requirements(alternative, feats_by_name,
+                                     classes_by_name, skill_keys)
+                for alternative in alternatives]
+            if not any(alternative.unparsed for alternative in alternatives):
+                requirements.any_of.append(alternatives)
+                continue
+        requirements.unparsed.append(clause)
+    return requirements
+
+
+def _threshold_masks(required, everyone, top):
+    """
+    masks[value] = feats satisfied at value: those without this requirement
+    and those requiring at most value. required maps bit -> minimum.
+    """
+    masks, mask = [], everyone
+    for bit, minimum in required.items():
+        if minimum > 0:
+            mask &= ~(1 << bit)
+    by_minimum = {}
+    for bit, minimum in required.items():
+        by_minimum[minimum] = by_minimum.get(minimum, 0) | (1 << bit)
+    for value in range(top + 1):
+        mask |= by_minimum.get(value, 0)
+        masks.append(mask)
+    return masks
+
+
+def _clamp(value, top):
+    return min(max(value or 0, 0), top)
+
+
+def _tree(records):
+    """ parent id -> children, for rows linked by parent_id. """
+    children = {}
+    for record in sorted(records, key=lambda record: record.id):
+        children.setdefault(record.parent_id or None, []).append(record)
+    return children
+
+
+class FeatGraph(object):
+    """ The compiled prerequisites of every feat at one compendium version """
+
+    def __init__(self, cache):
+        feats = sorted(cache.all(models.Feat), key=lambda feat: feat.id)
+        self.feats = tuple(feats)
+        self.bits = {feat.id: bit for bit, feat in enumerate(feats)}
+        self.everyone = (1 << len(feats)) - 1
+        feats_by_name = {feat.name.lower(): feat.id for feat in feats}
+        classes_by_name = {record.name.lower(): record.id
+                           for record in cache.all(models.Class)}
+        skill_keys = {column.key
+                      for column in models.CharacterSkill.__table__.c}
+        self.requirements = {
+            feat.id: compile_requirements(feat.prereq_text, feats_by_name,
+                                          classes_by_name, skill_keys)
+            for feat in feats}
+        unparsed = {feat_id: requirements.unparsed for feat_id, requirements
+                    in self.requirements.items() if requirements.unparsed}
+        if unparsed:
+            LOG.warning("%d feats have prerequisites that can't be compiled "
+                        "and are never offered", len(unparsed))
+            for feat_id, clauses in sorted(unparsed.items()):
+                LOG.debug("Feat %s prerequisites not compiled: %s", feat_id,
+                          clauses)
+        self.unverified = self.mask(unparsed)
+        self._break_cycles()
+        self._build_masks(classes_by_name.values(), skill_keys)
+        self.options = _tree(cache.all(models.FeatOption))
+        self.special_skills = _tree(cache.all(models.ClassSpecialSkill))
+
+    def _break_cycles(self):
+        """ Drops the feat requirements that close a cycle, depth first. """
+        done, path = set(), []
+
+        def visit(feat_id):
+            path.append(feat_id)
+            requirements = self.requirements[feat_id]
+            for required in sorted(requirements.feats):
+                if required in path:
+                    LOG.warning("Feat prerequisite cycle %s, dropping %s -> "
+                                "%s", path[path.index(required):], feat_id,
+                                required)
+                    requirements.feats.discard(required)
+                elif required not in done:
+                    visit(required)
+            path.pop()
+            done.add(feat_id)
+
+        for feat in self.feats:
+            if feat.id not in done:
+                visit(feat.id)
+
+    def _build_masks(self, class_ids, skill_keys):
+        by_bit = {self.bits[feat_id]: requirements for feat_id, requirements
+                  in self.requirements.items()}
+        self.ability_masks = {
+            ability: _threshold_masks(
+                {bit: r.abilities.get(ability, 0) for bit, r in by_bit.items()},
+                self.everyone, MAX_SCORE)
+            for ability in stats.ABILITIES}
+        self.level_masks = _threshold_masks(
+            {bit: r.level for bit, r in by_bit.items()}, self.everyone,
+            MAX_LEVEL)
+        self.bab_masks = _threshold_masks(
+            {bit: r.base_attack_bonus for bit, r in by_bit.items()},
+            self.everyone, MAX_LEVEL)
+        self.skill_masks = {
+            skill: _threshold_masks(
+                {bit: r.skills[skill] for bit, r in by_bit.items()
+                 if skill in r.skills}, self.everyone, MAX_RANKS)
+            for skill in skill_keys
+            if any(skill in r.skills for r in by_bit.values())}
+        # A character has one class: a feat with class requirements is only
+        # satisfiable by a character of that class, at that level
+        classless = self.everyone
+        for bit, requirements in by_bit.items():
+            if requirements.classes:
+                classless &= ~(1 << bit)
+        self.classless = classless
+        self.class_masks = {}
+        for class_id in class_ids:
+            self.class_masks[class_id] = _threshold_masks(
+                {bit: r.classes[class_id] for bit, r in by_bit.items()
+                 if set(r.classes) == {class_id}}, 0, MAX_LEVEL)
+        # "A or B" groups, as (alternatives without feats, mask of the feat
+        # alternatives). Eligibility checks the former once per character
+        # and treats the latter like required feats, any one of them will do
+        self.any_of = {}
+        for bit, requirements in by_bit.items():
+            if requirements.any_of:
+                self.any_of[bit] = [
+                    ([alternative for alternative in group
+                      if not alternative.feats],
+                     self.mask(feat_id for alternative in group
+                               for feat_id in alternative.feats))
+                    for group in requirements.any_of]
+        self.skill_keys = set(self.skill_masks).union(
+            skill for requirements in by_bit.values()
+            for group in requirements.any_of for alternative in group
+            for skill in alternative.skills)
+        # Feat -> feat edges both ways: what each feat needs and unlocks
+        self.requires, self.dependents = {}, {}
+        for bit, requirements in by_bit.items():
+            if requirements.feats:
+                self.requires[bit] = self.mask(requirements.feats)
+            unlocking = set(requirements.feats).union(
+                feat_id for group in requirements.any_of
+                for alternative in group for feat_id in alternative.feats)
+            for feat_id in unlocking:
+                required = self.bits[feat_id]
+                self.dependents[required] = (self.dependents.get(required, 0) |
+                                             (1 << bit))
+
+    def mask(self, feat_ids):
+        mask = 0
+        for feat_id in feat_ids:
+            bit = self.bits.get(feat_id)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def feat_ids(self, mask):
+        ids = []
+        while mask:
+            low = mask & -mask
+            ids.append(self.feats[low.bit_length() - 1].id)
+            mask ^= low
+        return ids
+
+    def closure(self, feat_id):
+        """ Every feat feat_id needs, directly or through other feats. """
+        needed, pending = set(), list(self.requirements[feat_id].feats)
+        while pending:
+            required = pending.pop()
+            if required not in needed:
+                needed.add(required)
+                pending.extend(self.requirements[required].feats)
+        return needed
+
+
+class Eligibility(object):
+    """
+    The feats one character qualifies for. The ability, level, class and
+    skill part is computed once; add() and remove() only redo the feat part.
+    """
+
+    def __init__(self, graph, abilities, level, class_id, base_attack_bonus,
+                 skills, owned=()):
+        self.graph = graph
+        static = graph.level_masks[_clamp(level, MAX_LEVEL)]
+        static &= graph.bab_masks[_clamp(base_attack_bonus, MAX_LEVEL)]
+        for ability, masks in graph.ability_masks.items():
+            static &= masks[_clamp(abilities.get(ability), MAX_SCORE)]
+        for skill, masks in graph.skill_masks.items():
+            static &= masks[_clamp(skills.get(skill), MAX_RANKS)]
+        class_masks = graph.class_masks.get(class_id)
+        static &= graph.classless | (
+            class_masks[_clamp(level, MAX_LEVEL)] if class_masks else 0)
+        # Per feat with alternatives, the feat masks of the groups that no
+        # other alternative satisfies: one feat of each must be owned
+        self.needs_any = {}
+        for bit, groups in graph.any_of.items():
+            needs = []
+            for alternatives, feat_mask in groups:
+                if any(alternative.satisfied(abilities, level, class_id,
+                                             base_attack_bonus, skills)
+                       for alternative in alternatives):
+                    continue
+                if not feat_mask:
+                    static &= ~(1 << bit)
+                    break
+                needs.append(feat_mask)
+            else:
+                if needs:
+                    self.needs_any[bit] = needs
+        self.static = static
+        self.owned = graph.mask(owned)
+        # Feats with a required feat that isn't owned
+        self.blocked = 0
+        for bit in set(graph.requires) | set(self.needs_any):
+            if self._missing_feats(bit):
+                self.blocked |= 1 << bit
+
+    @classmethod
+    def for_character(cls, graph, char):
+        record = compendium.get(models.Class, char.class_id)
+        level = char.level or stats.DEFAULT_LEVEL
+        bonuses = stats.base_bonuses(record.name if record else None, level)
+        skills = char.character_skills[0] if char.character_skills else None
+        return cls(graph,
+                   {ability: getattr(char, ability) for ability in
+                    stats.ABILITIES},
+                   level, char.class_id, bonuses["base_atk_bonus"],
+                   {key: getattr(skills, key) for key in graph.skill_keys}
+                   if skills else {},
+                   [link.feat_id for link in char.character_feats])
+
+    def _missing_feats(self, bit):
+        """ Whether the feat at bit needs a feat that isn't owned """
+        if self.graph.requires.get(bit, 0) & ~self.owned:
+            return True
+        return any(not needs & self.owned
+                   for needs in self.needs_any.get(bit, ()))
+
+    def add(self, feat_id):
+        """ Owns feat_id; only the feats it unlocks are rechecked. """
+        bit = self.graph.bits.get(feat_id)
+        if bit is None:
+            return
+        self.owned |= 1 << bit
+        dependents = self.graph.dependents.get(bit, 0) & self.blocked
+        while dependents:
+            low = dependents & -dependents
+            dependents ^= low
+            if not self._missing_feats(low.bit_length() - 1):
+                self.blocked &= ~low
+
+    def remove(self, feat_id):
+        bit = self.graph.bits.get(feat_id)
+        if bit is None:
+            return
+        self.owned &= ~(1 << bit)
+        # Another alternative may still unlock a dependent
+        dependents = self.graph.dependents.get(bit, 0) & ~self.blocked
+        while dependents:
+            low = dependents & -dependents
+            dependents ^= low
+            if self._missing_feats(low.bit_length() - 1):
+                self.blocked |= low
+
+    @property
+    def mask(self):
+        """ Qualifying feats that aren't owned yet. """
+        return (self.static & ~self.blocked & ~self.owned &
+                ~self.graph.unverified & self.graph.everyone)
+
+    def feat_ids(self):
+        return self.graph.feat_ids(self.mask)
+
+    def qualifies(self, feat_id):
+        bit = self.graph.bits.get(feat_id)
+        return bit is not None and bool(self.mask & (1 << bit))
+
+
+class FeatGraphs(object):
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._graph = None
+        cache.on_reload(self._reset)
+
+    def _reset(self, _cache):
+        self._graph = None
+
+    def graph(self):
+        self._cache.refresh()
+        graph = self._graph
+        if graph is None:
+            with self._lock:
+                graph = self._graph
+                if graph is None:
+                    graph = self._graph = FeatGraph(self._cache)
+                    LOG.debug("Compiled prerequisites of %d feats",
+                              len(graph.feats))
+        return graph
+
+
+GRAPHS = FeatGraphs(compendium.COMPENDIUM)
+
+
+def graph():
+    return GRAPHS.graph()
+
+
+def eligibility(char):
+    return Eligibility.for_character(graph(), char)
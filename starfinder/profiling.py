@@ -0,0 +1,254 @@
+"""
+Opt-in request profiling.
+
+A sampled fraction of requests (profiling.sample_rate, when profiling.enabled
+is set) has its wall time split into SQL, template rendering and the rest,
+which is booked as Python time. Requests from internal.allowed_ips can ask
+for it with an X-Profile header; "X-Profile: cprofile" also runs the request
+under cProfile. Profiled responses carry a Server-Timing header.
+
+Timings are kept per endpoint in a rolling window (profiling.window samples)
+from which /_internal/perf reports p50/p95/p99. cProfile can be armed for the
+next requests of an endpoint from /_internal/perf/arm/<endpoint>; the slowest
+profiles (profiling.keep_profiles per endpoint) are kept for pstats dumps.
+"""
+import collections
+import cProfile
+import heapq
+import io
+import itertools
+import marshal
+import math
+import pstats
+import random
+import threading
+import time
+
+import flask
+import jinja2
+
+from starfinder import config, logging
+from starfinder.db import instrumentation
+
+CONF = config.CONF
+LOG = logging.get_logger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+class RouteStats(object):
+    """ The last `window` (wall, sql, template) samples of one endpoint. """
+
+    def __init__(self, window, keep_profiles):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.armed = 0
+        self.keep_profiles = keep_profiles
+        self.profiles = []
+
+    def add(self, wall, sql, template):
+        self.samples.append((wall, sql, template))
+        self.count += 1
+
+    def add_profile(self, wall, profile, tiebreak):
+        entry = (wall, tiebreak, profile)
+        if len(self.profiles) < self.keep_profiles:
+            heapq.heappush(self.profiles, entry)
+        elif wall > self.profiles[0][0]:
+            heapq.heapreplace(self.profiles, entry)
+
+    def to_dict(self):
+        samples = list(self.samples)
+        walls = sorted(wall for wall, _, _ in samples)
+        size = len(samples) or 1
+        sql = sum(sample[1] for sample in samples) / size
+        template = sum(sample[2] for sample in samples) / size
+        wall = sum(walls) / size
+        return {
+            "count": self.count,
+            "window": len(samples),
+            "p50_ms": 1000 * _percentile(walls, 0.50),
+            "p95_ms": 1000 * _percentile(walls, 0.95),
+            "p99_ms": 1000 * _percentile(walls, 0.99),
+            "max_ms": 1000 * (walls[-1] if walls else 0.0),
+            "avg_ms": 1000 * wall,
+            "avg_sql_ms": 1000 * sql,
+            "avg_template_ms": 1000 * template,
+            "avg_python_ms": 1000 * max(wall - sql - template, 0.0),
+            "armed": self.armed,
+            "profiles": [round(1000 * entry[0], 3) for entry in
+                         sorted(self.profiles, reverse=True)],
+        }
+
+
+class Profiler(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._armed = 0
+        self._tiebreak = itertools.count()
+
+    def _route(self, endpoint):
+        route = self._routes.get(endpoint)
+        if route is None:
+            route = self._routes[endpoint] = RouteStats(
+                CONF.get_int("profiling.window", 1024),
+                CONF.get_int("profiling.keep_profiles", 3))
+        return route
+
+    def arm(self, endpoint, count=1):
+        """ Runs the next `count` requests of endpoint under cProfile. """
+        with self._lock:
+            self._route(endpoint).armed += count
+            self._armed += count
+
+    def take_armed(self, endpoint):
+        if not self._armed:
+            return False
+        with self._lock:
+            route = self._routes.get(endpoint)
+            if route is None or not route.armed:
+                return False
+            route.armed -= 1
+            self._armed -= 1
+            return True
+
+    def record(self, endpoint, wall, sql, template, profile=None):
+        with self._lock:
+            route = self._route(endpoint)
+            route.add(wall, sql, template)
+            if profile is not None:
+                route.add_profile(wall, profile, next(self._tiebreak))
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+            self._armed = 0
+
+    def report(self, limit=50):
+        """ Per endpoint stats, slowest p95 first. """
+        with self._lock:
+            routes = [dict(route.to_dict(), endpoint=endpoint)
+                      for endpoint, route in self._routes.items()]
+        routes.sort(key=lambda route: route["p95_ms"], reverse=True)
+        return routes[:limit]
+
+    def profile(self, endpoint, rank=0):
+        """ The rank-th slowest kept cProfile.Profile of endpoint, or None """
+        with self._lock:
+            route = self._routes.get(endpoint)
+            profiles = sorted(route.profiles, reverse=True) if route else []
+        if rank >= len(profiles):
+            return None
+        return profiles[rank][2]
+
+
+PROFILER = Profiler()
+
+
+def pstats_text(profile, sort="cumulative", lines=40):
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats(sort).print_stats(lines)
+    return stream.getvalue()
+
+
+def pstats_dump(profile):
+    """ Marshalled stats, loadable with pstats.Stats(path) or snakeviz. """
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+
+class TimedTemplate(jinja2.Template):
+    """ Books render time, minus the SQL it triggers, to the request. """
+
+    def render(self, *args, **kwargs):
+        if not (flask.has_request_context() and
+                getattr(flask.g, "profile_started", None)):
+            return super().render(*args, **kwargs)
+        depth = flask.g.template_depth
+        flask.g.template_depth = depth + 1
+        started = time.perf_counter()
+        sql_started = instrumentation.sql_seconds()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            flask.g.template_depth = depth
+            if not depth:
+                flask.g.template_seconds += (
+                    time.perf_counter() - started -
+                    (instrumentation.sql_seconds() - sql_started))
+
+
+def _requested():
+    """ (profile?, cprofile?) for the current request. """
+    header = flask.request.headers.get(PROFILE_HEADER)
+    if header and flask.request.remote_addr in CONF.get_array(
+            "internal.allowed_ips", "127.0.0.1"):
+        return True, header.strip().lower() == "cprofile"
+    if CONF.get_bool("profiling.enabled", False):
+        return (random.random() < CONF.get_float("profiling.sample_rate",
+                                                 0.01), False)
+    return False, False
+
+
+def _start():
+    endpoint = flask.request.endpoint or UNMATCHED_ENDPOINT
+    sampled, use_cprofile = _requested()
+    use_cprofile = PROFILER.take_armed(endpoint) or use_cprofile
+    if not (sampled or use_cprofile):
+        return
+    flask.g.template_depth = 0
+    flask.g.template_seconds = 0.0
+    flask.g.profile_sql_started = instrumentation.sql_seconds()
+    flask.g.profile_started = time.perf_counter()
+    if use_cprofile:
+        flask.g.profile = cProfile.Profile()
+        flask.g.profile.enable()
+
+
+def _stop_profile():
+    profile = getattr(flask.g, "profile", None)
+    if profile is not None:
+        profile.disable()
+        flask.g.profile = None
+    return profile
+
+
+def _finish(response):
+    started = getattr(flask.g, "profile_started", None)
+    if not started:
+        return response
+    profile = _stop_profile()
+    wall = time.perf_counter() - started
+    sql = instrumentation.sql_seconds() - flask.g.profile_sql_started
+    template = flask.g.template_seconds
+    endpoint = flask.request.endpoint or UNMATCHED_ENDPOINT
+    PROFILER.record(endpoint, wall, sql, template, profile)
+    flask.g.profile_started = None
+    response.headers["Server-Timing"] = (
+        "sql;dur={:.2f}, template;dur={:.2f}, python;dur={:.2f}".format(
+            1000 * sql, 1000 * template,
+            1000 * max(wall - sql - template, 0.0)))
+    return response
+
+
+def _teardown(error=None):
+    # pylint: disable=unused-argument
+    # after_request doesn't run when the view raised
+    _stop_profile()
+
+
+def install(app):
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
@@ -0,0 +1,206 @@
+"""
+Class and theme progression by level.
+
+What a class grants at each level is spread over ClassFeat,
+ClassSpecialSkill, OperativeSkill and ClassProficiency, and themes keep
+theirs in the level_1/6/12/18 columns. When the compendium loads, these are
+folded into dense per-class and per-theme tables indexed by level, holding
+what is gained at each level and everything gained up to it. Lookups are
+then a list index. The tables are rebuilt with the compendium.
+"""
+import threading
+
+from starfinder import logging, stats
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+MAX_LEVEL = 20
+THEME_LEVELS = (1, 6, 12, 18)
+
+
+class Level(object):
+    """ What a class grants at one level, and in total up to it. """
+    __slots__ = ("level", "features", "special_skills", "operative_skills",
+                 "proficiencies", "bonuses", "all_features",
+                 "all_special_skills", "all_operative_skills")
+
+    def __init__(self, level, gained, previous, proficiencies, bonuses):
+        self.level = level
+        self.features, self.special_skills, self.operative_skills = gained
+        self.proficiencies = proficiencies
+        self.bonuses = bonuses
+        self.all_features = previous.all_features + self.features
+        self.all_special_skills = (previous.all_special_skills +
+                                   self.special_skills)
+        self.all_operative_skills = (previous.all_operative_skills +
+                                     self.operative_skills)
+
+    def to_dict(self, cumulative=False):
+        prefix = "all_" if cumulative else ""
+        return {
+            "level": self.level,
+            "features": [record.to_dict() for record in
+                         getattr(self, prefix + "features")],
+            "special_skills": [record.to_dict() for record in
+                               getattr(self, prefix + "special_skills")],
+            "operative_skills": [record.to_dict() for record in
+                                 getattr(self, prefix + "operative_skills")],
+            "proficiencies": [record.to_dict()
+                              for record in self.proficiencies],
+            "bonuses": self.bonuses,
+        }
+
+
+class _Start(object):
+    """ The empty level 0 every table starts from. """
+    all_features = all_special_skills = all_operative_skills = ()
+
+
+class ClassProgression(object):
+    __slots__ = ("class_id", "levels")
+
+    def __init__(self, record, features, special_skills, operative_skills,
+                 proficiencies):
+        self.class_id = record.id
+        levels = [None]
+        previous = _Start()
+        for level in range(1, MAX_LEVEL + 1):
+            gained = (features.get(level, ()), special_skills.get(level, ()),
+                      operative_skills.get(level, ()))
+            previous = Level(level, gained, previous,
+                             proficiencies if level == 1 else (),
+                             stats.base_bonuses(record.name, level))
+            levels.append(previous)
+        self.levels = tuple(levels)
+
+    def at(self, level):
+        """ The Level entry, clamped to 1..MAX_LEVEL. """
+        return self.levels[min(max(level or 1, 1), MAX_LEVEL)]
+
+
+class ThemeProgression(object):
+    __slots__ = ("theme_id", "benefits", "all_benefits")
+
+    def __init__(self, record):
+        self.theme_id = record.id
+        benefits, all_benefits, total = [()], [()], ()
+        for level in range(1, MAX_LEVEL + 1):
+            gained = ()
+            if level in THEME_LEVELS:
+                gained = ((level, getattr(record, "level_{}".format(level))),)
+            total += gained
+            benefits.append(gained)
+            all_benefits.append(total)
+        self.benefits = tuple(benefits)
+        self.all_benefits = tuple(all_benefits)
+
+    def at(self, level, cumulative=False):
+        table = self.all_benefits if cumulative else self.benefits
+        return table[min(max(level or 1, 1), MAX_LEVEL)]
+
+
+def _by_level(records):
+    table = {}
+    for record in sorted(records, key=lambda record: (record.level,
+                                                      record.id)):
+        table.setdefault(record.class_id, {}).setdefault(
+            record.level, []).append(record)
+    return {class_id: {level: tuple(entries)
+                       for level, entries in levels.items()}
+            for class_id, levels in table.items()}
+
+
+class ProgressionTables(object):
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._classes = {}
+        self._themes = {}
+        self._stale = True
+        cache.on_reload(self._mark_stale)
+
+    def _mark_stale(self, _cache):
+        self._stale = True
+
+    def _refresh(self):
+        # NOTE: a compendium reload marks us stale through on_reload
+        self._cache.refresh()
+        if not self._stale:
+            return
+        with self._lock:
+            if self._stale:
+                self._build()
+                self._stale = False
+
+    def _build(self):
+        cache = self._cache
+        features = _by_level(cache.all(models.ClassFeat))
+        special_skills = _by_level(cache.all(models.ClassSpecialSkill))
+        operative_skills = _by_level(cache.all(models.OperativeSkill))
+        proficiencies = {}
+        for link in cache.all(models.ClassProficiency):
+            feat = cache.get(models.Feat, link.feats_id)
+            if feat is not None:
+                proficiencies.setdefault(link.class_id, []).append(feat)
+        classes = {
+            record.id: ClassProgression(
+                record, features.get(record.id, {}),
+                special_skills.get(record.id, {}),
+                operative_skills.get(record.id, {}),
+                tuple(proficiencies.get(record.id, ())))
+            for record in cache.all(models.Class)}
+        themes = {record.id: ThemeProgression(record)
+                  for record in cache.all(models.Theme)}
+        LOG.debug("Built progression tables for %d classes and %d themes",
+                  len(classes), len(themes))
+        self._classes, self._themes = classes, themes
+
+    def for_class(self, class_id):
+        self._refresh()
+        return self._classes.get(class_id)
+
+    def for_theme(self, theme_id):
+        self._refresh()
+        return self._themes.get(theme_id)
+
+
+PROGRESSION = ProgressionTables(compendium.COMPENDIUM)
+
+
+def for_class(class_id):
+    return PROGRESSION.for_class(class_id)
+
+
+def for_theme(theme_id):
+    return PROGRESSION.for_theme(theme_id)
+
+
+def level_up(class_id, theme_id, from_level, to_level):
+    """
+    Everything gained going from from_level to to_level: class features,
+    special and operative skills, theme benefits and base bonus changes.
+    """
+    from_level = min(max(from_level or 1, 1), MAX_LEVEL)
+    to_level = min(max(to_level or 1, from_level), MAX_LEVEL)
+    preview = {"from_level": from_level, "to_level": to_level,
+               "features": [], "special_skills": [], "operative_skills": [],
+               "theme_benefits": [], "bonuses": {}}
+    char_class = for_class(class_id)
+    if char_class is not None:
+        for level in range(from_level + 1, to_level + 1):
+            entry = char_class.at(level)
+            for key in ("features", "special_skills", "operative_skills"):
+                preview[key].extend(record.to_dict()
+                                    for record in getattr(entry, key))
+        before = char_class.at(from_level).bonuses
+        after = char_class.at(to_level).bonuses
+        preview["bonuses"] = {name: {"from": before[name], "to": value}
+                              for name, value in after.items()}
+    theme = for_theme(theme_id)
+    if theme is not None:
+        preview["theme_benefits"] = [
+            {"level": level, "benefit": benefit}
+            for level, benefit in theme.at(to_level, cumulative=True)
+            if level > from_level]
+    return preview
@@ -0,0 +1,326 @@
+"""
+Full-text and faceted search over the compendium.
+
+Each searchable kind (spells, feats, armor...) is indexed from the compendium
+records into:
+  * an inverted index, token -> {doc: weight}, for ranked text queries
+  * facet bitmaps, (facet, value) -> int bitmask of the matching docs
+  * numeric facets, kept sorted with prefix bitmasks so any range resolves
+    with two bisects and one AND
+
+A query is an AND of bitmasks followed by scoring the surviving docs, so it
+never scans the tables. Indexes are rebuilt lazily after the compendium
+reloads, and only for the kinds whose records actually changed.
+"""
+import bisect
+import math
+import re
+import threading
+
+from starfinder import logging
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+NAME_WEIGHT = 3.0
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 200
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower()) if text else []
+
+
+def _normalize(value):
+    if isinstance(value, bytes):
+        return str(int(any(value)))
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value).strip().lower()
+
+
+class Kind(object):
+    """
+    Describes how one model is indexed. `facets` and `multi_facets` map a
+    facet name to a callable(record, compendium, lookups) returning its
+    value, or a list of values for multi_facets. `lookups` maps a name to a
+    callable(compendium) building a table the getters share, once per index
+    build. `depends` lists the other models the facets read from, so a
+    change there rebuilds the index too.
+    """
+
+    def __init__(self, name, model, text_fields, facets=None,
+                 multi_facets=None, numeric=(), depends=(), lookups=None):
+        self.name = name
+        self.model = model
+        self.depends = depends
+        self.text_fields = text_fields
+        self.facets = facets or {}
+        self.multi_facets = multi_facets or {}
+        self.numeric = numeric
+        self.lookups = lookups or {}
+
+
+def _column(name):
+    return lambda record, cache, lookups: getattr(record, name)
+
+
+def _lookup(model, fk):
+    def resolve(record, cache, lookups):
+        target = cache.get(model, getattr(record, fk))
+        return target.name if target is not None else None
+    return resolve
+
+
+def _spell_descriptors(record, cache, lookups):
+    descriptors = cache.table(models.Descriptor)
+    return [descriptors.get(descriptor_id).name
+            for descriptor_id in lookups["descriptor_ids"].get(record.id, ())
+            if descriptors.get(descriptor_id) is not None]
+
+
+def _descriptor_ids(cache):
+    """ spell id -> descriptor ids """
+    by_spell = {}
+    for link in cache.table(models.SpellDescriptor):
+        by_spell.setdefault(link.spell_id, []).append(link.descriptor_id)
+    return by_spell
+
+
+KINDS = {kind.name: kind for kind in (
+    Kind("spells", models.Spell,
+         ("name", "short_description", "long_description"),
+         facets={"school": _lookup(models.MagicSchool, "school_id"),
+                 "range": _lookup(models.Range, "range_id"),
+                 "mystic_level": _column("mystic_level"),
+                 "technomancer_level": _column("technomancer_level"),
+                 "spell_resistance": _column("spell_resistance")},
+         multi_facets={"descriptor": _spell_descriptors},
+         numeric=("mystic_level", "technomancer_level"),
+         depends=(models.MagicSchool, models.Range, models.SpellDescriptor,
+                  models.Descriptor),
+         lookups={"descriptor_ids": _descriptor_ids}),
+    Kind("feats", models.Feat,
+         ("name", "tagline", "prereq_text", "description", "benefit"),
+         facets={"combat_feat": _column("combat_feat")}),
+    Kind("armor", models.Armor, ("name", "description"),
+         facets={"type_armor": _column("type_armor"),
+                 "level": _column("level")},
+         numeric=("level", "price", "eac", "kac", "max_dx",
+                  "ac_penalty", "upgrade_slots")),
+    Kind("ranged_weapons", models.RangedWeapon,
+         ("name", "special", "description"),
+         facets={"category": _column("category"),
+                 "level": _column("level")},
+         numeric=("level", "price", "usage")),
+    Kind("melee_weapons", models.MeleeWeapon,
+         ("name", "special", "description"),
+         facets={"category": _column("category"),
+                 "level": _column("level"),
+                 "powered": _column("powered"),
+                 "operative": _column("operative")},
+         numeric=("level", "price")),
+    Kind("grenades", models.Grenade, ("name", "special"),
+         facets={"level": _column("level")},
+         numeric=("level", "price")),
+    Kind("tech_items", models.TechItem, ("name", "item_type", "usage"),
+         facets={"item_type": _column("item_type"),
+                 "level": _column("level")},
+         numeric=("level", "price", "bulk", "capacity")),
+)}
+
+
+class NumericFacet(object):
+    """ Sorted values with prefix bitmasks, for range lookups. """
+    __slots__ = ("values", "prefix")
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        self.values = [value for value, _ in pairs]
+        self.prefix = [0]
+        for _, doc in pairs:
+            self.prefix.append(self.prefix[-1] | (1 << doc))
+
+    def range(self, low=None, high=None):
+        start = 0 if low is None else bisect.bisect_left(self.values, low)
+        end = (len(self.values) if high is None
+               else bisect.bisect_right(self.values, high))
+        if end <= start:
+            return 0
+        return self.prefix[end] & ~self.prefix[start]
+
+
+class Index(object):
+    """ The search structures for one kind. Read-only once built. """
+
+    def __init__(self, kind, cache):
+        self.kind = kind
+        self.sources = _sources(kind, cache)
+        self.records = self.sources[0]
+        self.all_docs = (1 << len(self.records)) - 1
+        self.postings = {}
+        self.bitmaps = {}
+        self.numeric = {}
+        lookups = {name: build(cache) for name, build in kind.lookups.items()}
+        for doc, record in enumerate(self.records):
+            self._index_text(doc, record)
+            self._index_facets(doc, record, cache, lookups)
+        for name in kind.numeric:
+            self.numeric[name] = NumericFacet(
+                (getattr(record, name), doc)
+                for doc, record in enumerate(self.records)
+                if getattr(record, name) is not None)
+        total = max(len(self.records), 1)
+        self.idf = {token: math.log(1 + total / len(docs))
+                    for token, docs in self.postings.items()}
+        self.token_bitmaps = {}
+        for token, docs in self.postings.items():
+            mask = 0
+            for doc in docs:
+                mask |= 1 << doc
+            self.token_bitmaps[token] = mask
+
+    def _index_text(self, doc, record):
+        for field in self.kind.text_fields:
+            weight = NAME_WEIGHT if field == "name" else 1.0
+            for token in tokenize(getattr(record, field)):
+                docs = self.postings.setdefault(token, {})
+                docs[doc] = docs.get(doc, 0.0) + weight
+
+    def _add_bit(self, facet, value, doc):
+        if value is None:
+            return
+        key = (facet, _normalize(value))
+        self.bitmaps[key] = self.bitmaps.get(key, 0) | (1 << doc)
+
+    def _index_facets(self, doc, record, cache, lookups):
+        for facet, getter in self.kind.facets.items():
+            self._add_bit(facet, getter(record, cache, lookups), doc)
+        for facet, getter in self.kind.multi_facets.items():
+            for value in getter(record, cache, lookups):
+                self._add_bit(facet, value, doc)
+
+    def facet_names(self):
+        return (set(self.kind.facets) | set(self.kind.multi_facets) |
+                set(self.kind.numeric))
+
+    def search(self, text=None, facets=None, ranges=None, limit=20):
+        """
+        Returns (total, [(score, record), ...]) for the docs matching every
+        text token, facet value and numeric range, best scores first.
+        """
+        mask = self.all_docs
+        for facet, value in (facets or {}).items():
+            mask &= self.bitmaps.get((facet, _normalize(value)), 0)
+        for facet, (low, high) in (ranges or {}).items():
+            numeric = self.numeric.get(facet)
+            mask &= numeric.range(low, high) if numeric else 0
+        tokens = tokenize(text)
+        for token in tokens:
+            mask &= self.token_bitmaps.get(token, 0)
+        docs = _bits(mask)
+        if tokens:
+            scored = [(sum(self.postings[token][doc] * self.idf[token]
+                           for token in tokens), doc) for doc in docs]
+            scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        else:
+            scored = [(0.0, doc) for doc in docs]
+        return len(docs), [(score, self.records[doc])
+                           for score, doc in scored[:limit]]
+
+
+def _sources(kind, cache):
+    return tuple(cache.all(model) for model in (kind.model,) + kind.depends)
+
+
+def _bits(mask):
+    docs = []
+    while mask:
+        low = mask & -mask
+        docs.append(low.bit_length() - 1)
+        mask ^= low
+    return docs
+
+
+class SearchIndex(object):
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._stale = True
+        cache.on_reload(self._mark_stale)
+
+    def _mark_stale(self, _cache):
+        self._stale = True
+
+    def _refresh(self):
+        # NOTE: a compendium reload marks us stale through on_reload
+        self._cache.refresh()
+        if not self._stale:
+            return
+        with self._lock:
+            if not self._stale:
+                return
+            indexes = dict(self._indexes)
+            for name, kind in KINDS.items():
+                current = indexes.get(name)
+                if (current is not None and
+                        current.sources == _sources(kind, self._cache)):
+                    continue
+                LOG.debug("Rebuilding search index for %s", name)
+                indexes[name] = Index(kind, self._cache)
+            self._indexes = indexes
+            self._stale = False
+
+    def index(self, kind):
+        self._refresh()
+        return self._indexes[kind]
+
+    def search(self, kind, text=None, facets=None, ranges=None, limit=20):
+        return self.index(kind).search(text, facets, ranges, limit)
+
+
+SEARCH = SearchIndex(compendium.COMPENDIUM)
+
+
+def search(kind, text=None, facets=None, ranges=None, limit=20):
+    return SEARCH.search(kind, text, facets, ranges, limit)
+
+
+def parse_args(args, kind):
+    """
+    Splits request args into (text, facets, ranges, limit). Numeric facets
+    take <name>_min / <name>_max bounds, e.g. ?max_dx_min=3&price_max=5000.
+    Bounds that aren't integers are ignored and limit is clamped to
+    1..MAX_LIMIT.
+    """
+    index = SEARCH.index(kind)
+    known = index.facet_names()
+    facets, ranges = {}, {}
+    for key, value in args.items():
+        for suffix, position in (("_min", 0), ("_max", 1)):
+            facet = key[:-len(suffix)]
+            if key.endswith(suffix) and facet in index.numeric:
+                bound = args.get(key, type=int)
+                if bound is not None:
+                    bounds = list(ranges.get(facet, (None, None)))
+                    bounds[position] = bound
+                    ranges[facet] = tuple(bounds)
+                break
+        else:
+            if key in known:
+                facets[key] = value
+    limit = args.get("limit", DEFAULT_LIMIT, type=int)
+    return (args.get("q"), facets, ranges,
+            min(max(limit if limit is not None else DEFAULT_LIMIT, 1),
+                MAX_LIMIT))
+
+
+def jsonable(record, score=None):
+    result = {}
+    for key, value in record.to_dict().items():
+        result[key] = bool(any(value)) if isinstance(value, bytes) else value
+    if score is not None:
+        result["score"] = round(score, 4)
+    return result
@@ -0,0 +1,158 @@
+"""
+Character sheet read model.
+
+Every write to a character rebuilds its character_sheets row in the same
+transaction: the export document, with its rules references resolved and
+its derived stats computed, plus the name and race the cards show. The
+summary page then reads one row by primary key and the card list pages
+through character_sheets alone, neither loads relationships nor runs the
+stat engine.
+
+A sheet built under another compendium version may hold outdated names and
+modifiers. The commands that change the rules data (upgrade,
+load-compendium, bump-compendium-version) rebuild the stale sheets once
+they're done and rebuild-sheets does it on demand. get() never writes: a
+sheet that is missing or still stale is computed for that read only.
+"""
+import json
+
+import sqlalchemy as sa
+
+from starfinder import export, logging
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+DEFAULT_CHUNK_SIZE = export.DEFAULT_CHUNK_SIZE
+
+CHARACTERS = export.CHARACTERS
+SHEETS = models.CharacterSheet.__table__
+# NOTE: One statement whether or not the sheet exists yet. A DELETE and
+#       INSERT pair deadlocks when two rebuilds of a new sheet race on the
+#       gap lock, and a plain INSERT fails on the duplicate key
+UPSERT = sa.text(
+    "INSERT INTO `{table}` ({columns}) VALUES ({values}) "
+    "ON DUPLICATE KEY UPDATE {updates}".format(
+        table=SHEETS.name,
+        columns=", ".join("`{}`".format(column.name) for column in SHEETS.c),
+        values=", ".join(":{}".format(column.name) for column in SHEETS.c),
+        updates=", ".join("`{0}`=VALUES(`{0}`)".format(column.name)
+                          for column in SHEETS.c if not column.primary_key))
+).bindparams(*[sa.bindparam(column.name, type_=column.type)
+               for column in SHEETS.c])
+
+
+def _serialize(rows, compendium_version):
+    """ The documents and sheet rows of these characters rows """
+    chunk = export.Chunk([row[CHARACTERS.c.id] for row in rows])
+    documents, values = {}, []
+    for row in rows:
+        document = export.serialize(row, chunk)
+        documents[row[CHARACTERS.c.id]] = document
+        values.append({
+            "character_id": row[CHARACTERS.c.id],
+            "user_id": row[CHARACTERS.c.user_id],
+            "version": row[CHARACTERS.c.version],
+            "compendium_version": compendium_version,
+            "name": row[CHARACTERS.c.name],
+            "race": document["race"]["name"] if document["race"] else None,
+            "document": export.dumps(document),
+        })
+    return documents, values
+
+
+def _write(rows, compendium_version):
+    """ Upserts the sheets of these characters rows, returns the documents """
+    documents, values = _serialize(rows, compendium_version)
+    if values:
+        models.Session.execute(UPSERT, values)
+    return documents
+
+
+def rebuild(char_ids):
+    """
+    Rebuilds the sheets of these characters in the current transaction.
+    Pending changes are flushed first so the sheets see them; the caller
+    commits. Returns the character id -> document of the rebuilt sheets.
+    """
+    char_ids = list(char_ids)
+    if not char_ids:
+        return {}
+    models.Session.flush()
+    rows = models.Session.execute(sa.select([CHARACTERS]).where(
+        CHARACTERS.c.id.in_(char_ids))).fetchall()
+    return _write(rows, compendium.COMPENDIUM.version)
+
+
+def delete(char_id):
+    """ Drops the sheet of a character being deleted, the caller commits. """
+    models.Session.execute(SHEETS.delete().where(
+        SHEETS.c.character_id == char_id))
+
+
+def get(char_id):
+    """
+    The sheet document of a character, None when there's no such character.
+    Only reads: a missing or stale sheet is computed from the character and
+    left for the write paths or rebuild-sheets to store.
+    """
+    compendium_version = compendium.COMPENDIUM.version
+    row = models.Session.query(
+        models.CharacterSheet.document,
+        models.CharacterSheet.compendium_version).filter(
+            models.CharacterSheet.character_id == char_id).first()
+    if row is not None and row.compendium_version == compendium_version:
+        return json.loads(row.document)
+    rows = models.Session.execute(sa.select([CHARACTERS]).where(
+        CHARACTERS.c.id == char_id)).fetchall()
+    if not rows:
+        return None
+    LOG.debug("Sheet of character %s is %s, computing it", char_id,
+              "stale" if row is not None else "missing")
+    documents, _ = _serialize(rows, compendium_version)
+    return documents[char_id]
+
+
+def _stale(query, compendium_version):
+    """ Characters without a sheet, or whose sheet lags behind them """
+    return query.select_from(CHARACTERS.outerjoin(
+        SHEETS, SHEETS.c.character_id == CHARACTERS.c.id)).where(sa.or_(
+            SHEETS.c.character_id.is_(None),
+            SHEETS.c.version != CHARACTERS.c.version,
+            SHEETS.c.compendium_version != compendium_version))
+
+
+def rebuild_all(user_id=None, stale=False, chunk_size=DEFAULT_CHUNK_SIZE,
+                progress=None):
+    """
+    Rebuilds the sheets of every character, or of one user's, chunk_size
+    characters per transaction. With stale, only the sheets that are missing
+    or out of date. progress(count) is called after every chunk. Returns the
+    number of sheets rebuilt.
+    """
+    compendium_version = compendium.COMPENDIUM.version
+    query = sa.select([CHARACTERS.c.id]).order_by(
+        CHARACTERS.c.id).limit(chunk_size)
+    if user_id is not None:
+        query = query.where(CHARACTERS.c.user_id == user_id)
+    if stale:
+        query = _stale(query, compendium_version)
+    count, after = 0, None
+    while True:
+        page = query if after is None else query.where(
+            CHARACTERS.c.id > after)
+        char_ids = [row[0] for row in models.Session.execute(page)]
+        if not char_ids:
+            break
+        try:
+            rebuild(char_ids)
+            models.Session.commit()
+        except Exception:
+            models.Session.rollback()
+            raise
+        count += len(char_ids)
+        after = char_ids[-1]
+        if progress is not None:
+            progress(count)
+    LOG.info("Rebuilt %d character sheets", count)
+    return count
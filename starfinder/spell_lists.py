@@ -0,0 +1,129 @@
+"""
+Per-class spell lists.
+
+Spells carry their level for each casting class in a nullable column
+(mystic_level, technomancer_level). When the compendium loads, each caster's
+spells are materialized into a tuple indexed by spell level, with the school
+and descriptor names already resolved, so the spell list pages and the
+builder's spell step read one precomputed structure. The lists are rebuilt
+with the compendium.
+"""
+import collections
+import threading
+
+from starfinder import logging
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+MAX_SPELL_LEVEL = 6
+# Casting class name -> the Spell column holding its spell level
+CASTERS = {
+    "mystic": "mystic_level",
+    "technomancer": "technomancer_level",
+}
+
+SpellEntry = collections.namedtuple(
+    "SpellEntry", ("id", "name", "level", "school", "descriptors",
+                   "short_description"))
+
+
+def max_spell_level(level):
+    """ Highest spell level a caster of this class level can cast. """
+    return min(MAX_SPELL_LEVEL, (max(level or 1, 1) + 2) // 3)
+
+
+class SpellList(object):
+    __slots__ = ("caster", "levels", "choices")
+
+    def __init__(self, caster, levels):
+        self.caster = caster
+        self.levels = levels
+        # Builder choices up to each spell level, built once
+        choices, total = [], []
+        for entries in levels:
+            total = total + [(str(entry.id), entry.name) for entry in entries]
+            choices.append(tuple(total))
+        self.choices = tuple(choices)
+
+    def at(self, spell_level):
+        if spell_level is None or not 0 <= spell_level <= MAX_SPELL_LEVEL:
+            return ()
+        return self.levels[spell_level]
+
+    def through(self, spell_level):
+        return self.choices[min(max(spell_level, 0), MAX_SPELL_LEVEL)]
+
+
+class SpellLists(object):
+    def __init__(self, cache):
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._lists = {}
+        self._stale = True
+        cache.on_reload(self._mark_stale)
+
+    def _mark_stale(self, _cache):
+        self._stale = True
+
+    def _refresh(self):
+        self._cache.refresh()
+        if not self._stale:
+            return
+        with self._lock:
+            if self._stale:
+                self._build()
+                self._stale = False
+
+    def _build(self):
+        cache = self._cache
+        schools = cache.table(models.MagicSchool)
+        descriptors = cache.table(models.Descriptor)
+        by_spell = {}
+        for link in cache.all(models.SpellDescriptor):
+            descriptor = descriptors.get(link.descriptor_id)
+            if descriptor is not None:
+                by_spell.setdefault(link.spell_id, []).append(descriptor.name)
+        levels = {caster: [[] for _ in range(MAX_SPELL_LEVEL + 1)]
+                  for caster in CASTERS}
+        for spell in sorted(cache.all(models.Spell),
+                            key=lambda record: record.name):
+            school = schools.get(spell.school_id)
+            for caster, column in CASTERS.items():
+                level = getattr(spell, column)
+                if level is None or not 0 <= level <= MAX_SPELL_LEVEL:
+                    continue
+                levels[caster][level].append(SpellEntry(
+                    spell.id, spell.name, level,
+                    school.name if school is not None else None,
+                    tuple(sorted(by_spell.get(spell.id, ()))),
+                    spell.short_description))
+        self._lists = {
+            caster: SpellList(caster, tuple(tuple(entries)
+                                            for entries in caster_levels))
+            for caster, caster_levels in levels.items()}
+        LOG.debug("Built spell lists: %s", {
+            caster: sum(len(entries) for entries in spell_list.levels)
+            for caster, spell_list in self._lists.items()})
+
+    def get(self, caster):
+        self._refresh()
+        return self._lists.get(caster)
+
+    def for_class(self, class_id):
+        """ The spell list of a casting class, None for other classes. """
+        record = compendium.get(models.Class, class_id) if class_id else None
+        if record is None:
+            return None
+        return self.get(record.name.lower())
+
+
+SPELL_LISTS = SpellLists(compendium.COMPENDIUM)
+
+
+def get(caster):
+    return SPELL_LISTS.get(caster)
+
+
+def for_class(class_id):
+    return SPELL_LISTS.for_class(class_id)
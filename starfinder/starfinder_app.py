@@ -1,9 +1,9 @@
 import flask
 
-from starfinder import config, logging, flask_app
+from starfinder import config, logging, flask_app, fragments, profiling
 from starfinder.helpers import helper
-from starfinder.db import models
-from starfinder.app import (users, characters, classes, feats,
+from starfinder.db import instrumentation, models
+from starfinder.app import (users, characters, classes, feats, internal,
                             themes, spells, equipment, races, skills)
 
 CONF = config.CONF
@@ -16,9 +16,16 @@ def create_app():
     flask_app.config['SECRET_KEY'] = CONF.get('csrf_secret_key')
     # Establish the following .py files and their routes
     blueprint_mods = [users, characters, classes, feats,
-                      themes, spells, equipment, races, skills]
+                      themes, spells, equipment, races, skills, internal]
     for mod in blueprint_mods:
         flask_app.register_blueprint(mod.BLUEPRINT, url_prefix=mod.URL_PREFIX)
+    instrumentation.install(flask_app)
+    profiling.install(flask_app)
+    fragments.install(flask_app)
+    try:
+        CONF.install_reload_signal()
+    except ValueError:
+        LOG.debug("Not on the main thread, config reload on SIGHUP disabled")
     return flask_app
 
 
@@ -1,3 +1,120 @@
 $('#new-character').click(function(){
 	$('#new-character-form').toggle();
-});
\ No newline at end of file
+});
+
+// Infinite scroll over the character cards. Each page is fetched from the
+// cursor endpoint and rendered by cloning the first server-rendered card.
+(function(){
+	var cards = $('#character-cards');
+	var loading = false;
+
+	function appendCard(character){
+		var card = cards.children('a').first().clone();
+		var href = card.attr('href').replace(/[0-9a-f-]{36}/, character.id);
+		card.attr('href', href);
+		card.find('.character-name').text(character.name || '');
+		card.find('.character-race').text(character.race || '');
+		card.find('input[name="id"]').val(character.id);
+		cards.append(card);
+	}
+
+	function loadMore(){
+		var cursor = cards.data('next-cursor');
+		if (loading || !cursor || !cards.children('a').length) {
+			return;
+		}
+		loading = true;
+		fetch(cards.data('cards-url') + '?after=' + cursor, {credentials: 'same-origin'})
+			.then(function(response){ return response.json(); })
+			.then(function(page){
+				page.characters.forEach(appendCard);
+				cards.data('next-cursor', page.next || '');
+				if (!page.next) {
+					$('#more-characters').remove();
+				}
+				loading = false;
+			});
+	}
+
+	if (cards.length) {
+		$('#more-characters').hide();
+		$(window).on('scroll', function(){
+			if ($(window).scrollTop() + $(window).height() >= $(document).height() - 200) {
+				loadMore();
+			}
+		});
+	}
+})();
+
+// Builder pages save through the JSON builder API. "Next" stashes the step's
+// fields in sessionStorage instead of posting them, and the next save sends
+// every stashed step in one batch, so a run of steps costs one round trip.
+(function(){
+	var form = $('#characterUpdateForm');
+	if (!form.length || !form.data('builder-url')) {
+		return;
+	}
+	var key = 'builder-steps:' + form.data('character-id');
+	var skip = ['csrf_token', 'id', 'version', 'submit', 'character_id'];
+
+	function stashed(){
+		return JSON.parse(sessionStorage.getItem(key) || '[]');
+	}
+
+	function currentStep(){
+		var step = {};
+		form.find('[name]').each(function(){
+			if (skip.indexOf(this.name) === -1 && $(this).val() !== null) {
+				step[this.name] = $(this).val();
+			}
+		});
+		return step;
+	}
+
+	function stash(){
+		var steps = stashed();
+		steps.push(currentStep());
+		sessionStorage.setItem(key, JSON.stringify(steps));
+	}
+
+	function save(event){
+		event.preventDefault();
+		var version = parseInt(form.find('input[name="version"]').val(), 10);
+		var body = {
+			csrf_token: form.find('input[name="csrf_token"]').val(),
+			version: isNaN(version) ? null : version,
+			steps: stashed().concat([currentStep()])
+		};
+		fetch(form.data('builder-url'), {
+			method: 'PATCH',
+			credentials: 'same-origin',
+			headers: {'Content-Type': 'application/json'},
+			body: JSON.stringify(body)
+		}).then(function(response){
+			return response.json().then(function(state){
+				return {status: response.status, state: state};
+			});
+		}).then(function(result){
+			if (result.status === 409) {
+				// Someone else saved first: start over from their version
+				sessionStorage.removeItem(key);
+				window.location.reload();
+				return;
+			}
+			if (result.status !== 200) {
+				form.trigger('builder:errors', [result.state.errors]);
+				return;
+			}
+			sessionStorage.removeItem(key);
+			form.find('input[name="version"]').val(result.state.character.version);
+			form.trigger('builder:saved', [result.state]);
+			if (form.data('next-url')) {
+				window.location = form.data('next-url');
+			}
+		});
+	}
+
+	$('#builder-next').on('click', stash);
+	form.on('submit', save);
+	$('#submit').on('click', save);
+})();
@@ -0,0 +1,244 @@
+"""
+Derived statistics for characters.
+
+Everything a character sheet shows beyond the raw ability scores is computed
+here from a Snapshot: a flat, immutable bag of the numbers the formulas need
+(level, ability scores, race and class hit points, worn armor, summed
+modifiers). Building the snapshot is the only part that touches the ORM, so a
+sheet costs one walk of the character's relationships instead of one per stat.
+
+compute_many() works column-wise over any number of snapshots and returns one
+array per stat, which is what the party/table views and exports consume.
+"""
+import array
+
+ABILITIES = ("strength", "dexterity", "constitution",
+             "intelligence", "wisdom", "charisma")
+DEFAULT_ABILITY_SCORE = 10
+DEFAULT_LEVEL = 1
+
+FULL_BAB = 4
+THREE_QUARTER_BAB = 3
+
+# Class name -> (base attack bonus progression, good fortitude,
+#                good reflex, good will)
+CLASS_PROGRESSIONS = {
+    "envoy": (THREE_QUARTER_BAB, False, True, True),
+    "mechanic": (THREE_QUARTER_BAB, True, True, False),
+    "mystic": (THREE_QUARTER_BAB, False, False, True),
+    "operative": (THREE_QUARTER_BAB, False, True, True),
+    "solarian": (FULL_BAB, True, False, True),
+    "soldier": (FULL_BAB, True, False, True),
+    "technomancer": (THREE_QUARTER_BAB, False, False, True),
+}
+DEFAULT_PROGRESSION = (THREE_QUARTER_BAB, False, False, False)
+
+STATS = ("str_mod", "dex_mod", "con_mod", "int_mod", "wis_mod", "char_mod",
+         "hit_points", "stamina", "armor_bonus_eac", "armor_bonus_kac",
+         "eac", "kac", "ac_vs_combat", "initiative", "base_atk_bonus",
+         "base_fortitude", "base_reflex", "base_will", "fortitude_save",
+         "reflex_save", "will_save", "melee_atk", "ranged_atk", "thrown_atk")
+
+# Modifier.effected_stat is free text, these map the common spellings onto
+# the stat names above.
+MODIFIER_ALIASES = {
+    "energy_armor_class": "eac",
+    "kinetic_armor_class": "kac",
+    "fortitude": "fortitude_save",
+    "reflex": "reflex_save",
+    "will": "will_save",
+    "melee": "melee_atk",
+    "ranged": "ranged_atk",
+    "thrown": "thrown_atk",
+    "hp": "hit_points",
+    "stamina_points": "stamina",
+    "sp": "stamina",
+}
+
+
+def normalize_stat(name):
+    """ Maps a free text stat name onto one of STATS, or returns None. """
+    if not name:
+        return None
+    key = '_'.join(name.strip().lower().split())
+    key = MODIFIER_ALIASES.get(key, key)
+    return key if key in STATS else None
+
+
+def collect_modifiers(pairs):
+    """ Sums (effected_stat, modification) pairs into a stat -> total dict. """
+    totals = {}
+    for stat, modification in pairs:
+        key = normalize_stat(stat)
+        if key is None or not modification:
+            continue
+        totals[key] = totals.get(key, 0) + modification
+    return totals
+
+
+UNENCUMBERED = "unencumbered"
+ENCUMBERED = "encumbered"
+OVERBURDENED = "overburdened"
+
+
+def encumbrance(strength, bulk):
+    """
+    More bulk than half the Strength score encumbers a character, more than
+    the full score overburdens them.
+    """
+    strength = DEFAULT_ABILITY_SCORE if strength is None else strength
+    if bulk > strength:
+        return OVERBURDENED
+    if bulk > strength / 2:
+        return ENCUMBERED
+    return UNENCUMBERED
+
+
+def ability_modifier(score):
+    if score is None:
+        score = DEFAULT_ABILITY_SCORE
+    return (score // 2) - 5
+
+
+class Snapshot(object):
+    """
+    Every input of the stat formulas for one character. Instances are
+    read-only once built; rebuild the snapshot when the character changes.
+    """
+    __slots__ = ("character_id", "level", "scores", "race_hit_points",
+                 "class_hit_points", "class_stamina_points", "progression",
+                 "armor_eac", "armor_kac", "max_dex", "misc")
+
+    def __init__(self, character_id=None, level=None, scores=None,
+                 race_hit_points=None, class_hit_points=None,
+                 class_stamina_points=None, class_name=None, armor=(),
+                 misc=None):
+        setter = super().__setattr__
+        setter("character_id", character_id)
+        setter("level", level or DEFAULT_LEVEL)
+        scores = scores or {}
+        setter("scores", tuple(scores.get(ability) for ability in ABILITIES))
+        setter("race_hit_points", race_hit_points or 0)
+        setter("class_hit_points", class_hit_points or 0)
+        setter("class_stamina_points", class_stamina_points or 0)
+        setter("progression", class_progression(class_name))
+        armor_eac, armor_kac, max_dex = 0, 0, None
+        for attributes in armor:
+            armor_eac += attributes.get("eac") or 0
+            armor_kac += attributes.get("kac") or 0
+            if attributes.get("max_dx") is not None:
+                max_dex = (attributes["max_dx"] if max_dex is None
+                           else min(max_dex, attributes["max_dx"]))
+        setter("armor_eac", armor_eac)
+        setter("armor_kac", armor_kac)
+        setter("max_dex", max_dex)
+        setter("misc", dict(misc or {}))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Snapshot is read-only")
+
+    def __repr__(self):
+        return "<Snapshot {}>".format(self.character_id)
+
+
+def _column(values):
+    return array.array('l', values)
+
+
+def _good_save(level):
+    return level // 2 + 2
+
+
+def _poor_save(level):
+    return level // 3
+
+
+def class_progression(class_name):
+    return CLASS_PROGRESSIONS.get((class_name or "").strip().lower(),
+                                  DEFAULT_PROGRESSION)
+
+
+def base_attack_bonus(progression, level):
+    return level * progression[0] // 4
+
+
+def base_bonuses(class_name, level):
+    """ Base attack bonus and base saves of a class at a level. """
+    progression = class_progression(class_name)
+    saves = [_good_save(level) if good else _poor_save(level)
+             for good in progression[1:]]
+    return dict(zip(("base_atk_bonus", "base_fortitude", "base_reflex",
+                     "base_will"),
+                    [base_attack_bonus(progression, level)] + saves))
+
+
+def compute_many(snapshots):
+    """
+    Computes every stat in STATS for a sequence of snapshots at once.
+    Returns a dict of stat name -> array of ints, aligned with the input.
+    """
+    snapshots = list(snapshots)
+    level = [s.level for s in snapshots]
+    misc = {stat: [s.misc.get(stat, 0) for s in snapshots] for stat in STATS}
+    sheet = {}
+
+    mod_names = ("str_mod", "dex_mod", "con_mod",
+                 "int_mod", "wis_mod", "char_mod")
+    for index, name in enumerate(mod_names):
+        sheet[name] = [ability_modifier(s.scores[index]) for s in snapshots]
+
+    dex_capped = [d if s.max_dex is None else min(d, s.max_dex)
+                  for d, s in zip(sheet["dex_mod"], snapshots)]
+
+    sheet["hit_points"] = [
+        s.race_hit_points + s.class_hit_points * lvl + m
+        for s, lvl, m in zip(snapshots, level, misc["hit_points"])]
+    sheet["stamina"] = [
+        max(0, (s.class_stamina_points + con) * lvl) + m
+        for s, con, lvl, m in zip(snapshots, sheet["con_mod"], level,
+                                  misc["stamina"])]
+
+    sheet["armor_bonus_eac"] = [s.armor_eac for s in snapshots]
+    sheet["armor_bonus_kac"] = [s.armor_kac for s in snapshots]
+    sheet["eac"] = [10 + a + d + m for a, d, m in zip(
+        sheet["armor_bonus_eac"], dex_capped, misc["eac"])]
+    sheet["kac"] = [10 + a + d + m for a, d, m in zip(
+        sheet["armor_bonus_kac"], dex_capped, misc["kac"])]
+    sheet["ac_vs_combat"] = [8 + kac + m for kac, m in zip(
+        sheet["kac"], misc["ac_vs_combat"])]
+    sheet["initiative"] = [d + m for d, m in zip(
+        sheet["dex_mod"], misc["initiative"])]
+
+    sheet["base_atk_bonus"] = [base_attack_bonus(s.progression, lvl)
+                               for s, lvl in zip(snapshots, level)]
+    for index, name in enumerate(("base_fortitude", "base_reflex",
+                                  "base_will"), start=1):
+        sheet[name] = [_good_save(lvl) if s.progression[index]
+                       else _poor_save(lvl)
+                       for s, lvl in zip(snapshots, level)]
+
+    for save, base, mod in (("fortitude_save", "base_fortitude", "con_mod"),
+                            ("reflex_save", "base_reflex", "dex_mod"),
+                            ("will_save", "base_will", "wis_mod")):
+        sheet[save] = [b + a + m for b, a, m in zip(
+            sheet[base], sheet[mod], misc[save])]
+
+    for attack, mod in (("melee_atk", "str_mod"),
+                        ("ranged_atk", "dex_mod"),
+                        ("thrown_atk", "str_mod")):
+        sheet[attack] = [b + a + m for b, a, m in zip(
+            sheet["base_atk_bonus"], sheet[mod], misc[attack])]
+
+    return {stat: _column(sheet[stat]) for stat in STATS}
+
+
+def compute(snapshot):
+    """ Computes the full sheet for a single snapshot as a dict. """
+    return {stat: column[0]
+            for stat, column in compute_many([snapshot]).items()}
+
+
+def rows(snapshots, sheet):
+    """ Yields (character_id, {stat: value}) pairs from a compute_many() result. """
+    for index, snap in enumerate(snapshots):
+        yield snap.character_id, {stat: sheet[stat][index] for stat in STATS}
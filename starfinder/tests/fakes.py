@@ -0,0 +1,97 @@
+"""
+The rules engines (prerequisites, modifiers, optimizer) are pure logic over
+compendium records, but their modules import the models, which connect to
+the database at import. rules_engine() imports an engine over stand-ins for
+the models the engines key their lookups on and for the compendium, and
+puts the real modules back afterwards. The engines are then built from a
+Cache of plain records.
+"""
+import contextlib
+import importlib
+import sys
+import types
+
+SKILL_COLUMNS = ("id", "character_id", "acrobatics", "athletics",
+                 "life_science", "mysticsm", "piloting")
+MODEL_NAMES = ("Feat", "Class", "FeatOption", "ClassSpecialSkill", "Modifier",
+               "RacialTrait", "RacialTraitModifier", "ThemeModifier",
+               "ClassModifier", "Race", "Theme")
+# Imported over the stand-ins, so never kept past rules_engine()
+ENGINES = ("starfinder.prerequisites", "starfinder.modifiers",
+           "starfinder.optimizer")
+
+
+class Record(object):
+    """ A compendium row """
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class Cache(object):
+    """ The reads of compendium.Compendium, over model -> records """
+
+    def __init__(self, tables=None):
+        self.tables = {model: {record.id: record for record in records}
+                       for model, records in (tables or {}).items()}
+
+    def on_reload(self, callback):
+        return callback
+
+    def refresh(self):
+        pass
+
+    def table(self, model):
+        return self.tables.get(model, {})
+
+    def all(self, model):
+        return list(self.table(model).values())
+
+    def get(self, model, pk):
+        return self.table(model).get(pk)
+
+
+def _stubs():
+    models = types.ModuleType("starfinder.db.models")
+    for name in MODEL_NAMES:
+        setattr(models, name, type(name, (), {}))
+    models.CharacterSkill = types.SimpleNamespace(
+        __table__=types.SimpleNamespace(
+            c=[types.SimpleNamespace(key=key) for key in SKILL_COLUMNS]))
+    compendium = types.ModuleType("starfinder.db.compendium")
+    compendium.COMPENDIUM = Cache()
+    compendium.get = compendium.COMPENDIUM.get
+    compendium.table = compendium.COMPENDIUM.table
+    compendium.get_all = compendium.COMPENDIUM.all
+    return models, compendium
+
+
+def _parent(name):
+    package, _, attribute = name.rpartition(".")
+    return importlib.import_module(package), attribute
+
+
+@contextlib.contextmanager
+def rules_engine(name):
+    """ Yields the engine module name, imported over the stand-ins """
+    stubs = {module.__name__: module for module in _stubs()}
+    saved = {}
+    for swapped in tuple(stubs) + ENGINES:
+        parent, attribute = _parent(swapped)
+        saved[swapped] = (sys.modules.pop(swapped, None),
+                          parent.__dict__.pop(attribute, None))
+    try:
+        for stub_name, stub in stubs.items():
+            parent, attribute = _parent(stub_name)
+            sys.modules[stub_name] = stub
+            setattr(parent, attribute, stub)
+        yield importlib.import_module(name)
+    finally:
+        for swapped, (module, value) in saved.items():
+            parent, attribute = _parent(swapped)
+            sys.modules.pop(swapped, None)
+            parent.__dict__.pop(attribute, None)
+            if module is not None:
+                sys.modules[swapped] = module
+            if value is not None:
+                setattr(parent, attribute, value)
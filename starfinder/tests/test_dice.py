@@ -0,0 +1,100 @@
+import itertools
+import random
+
+import pytest
+
+from starfinder import dice, exception
+
+
+def brute_force(count, sides):
+    """ outcome -> ways, by rolling every combination """
+    counts = {}
+    for roll in itertools.product(range(1, sides + 1), repeat=count):
+        counts[sum(roll)] = counts.get(sum(roll), 0) + 1
+    return counts
+
+
+@pytest.mark.parametrize("count,sides", [(1, 6), (2, 6), (3, 4), (4, 8)])
+def test_dice_matches_every_roll(count, sides):
+    distribution = dice.dice(count, sides)
+    expected = brute_force(count, sides)
+    assert distribution.minimum == count
+    assert distribution.maximum == count * sides
+    assert distribution.total == sides ** count
+    assert {distribution.minimum + i: ways for i, ways in
+            enumerate(distribution.counts)} == expected
+
+
+def test_probabilities():
+    distribution = dice.dice(2, 6)
+    assert distribution.probability(7) == 6 / 36
+    assert distribution.probability(1) == 0
+    assert distribution.probability(13) == 0
+    assert distribution.at_least(11) == 3 / 36
+    assert sum(distribution.to_dict().values()) == pytest.approx(1)
+
+
+@pytest.mark.parametrize("text,mean,minimum,maximum", [
+    ("1d6", 3.5, 1, 6),
+    ("2d6+3", 10, 5, 15),
+    ("d20", 10.5, 1, 20),
+    ("1d8-1d4", 2, -3, 7),
+    ("3d4 - 2", 5.5, 1, 10),
+    ("1d4+1d6", 6, 2, 10),
+])
+def test_expression_range_and_mean(text, mean, minimum, maximum):
+    expression = dice.parse(text)
+    assert expression.mean == mean
+    assert expression.minimum == minimum
+    assert expression.maximum == maximum
+    # The linear mean agrees with the distribution's
+    assert expression.distribution.mean == pytest.approx(mean)
+
+
+def test_stdev_matches_distribution():
+    expression = dice.parse("3d6+2")
+    assert expression.stdev ** 2 == pytest.approx(
+        expression.distribution.variance)
+
+
+def test_label_and_damage_types():
+    expression = dice.parse("burn 1d4 F")
+    assert expression.label == "burn"
+    assert expression.damage_types == ("F",)
+    assert expression.to_dict()["damage_types"] == ["fire"]
+    expression = dice.parse("explode (1d6 E & F, 15 ft.)")
+    assert expression.label == "explode"
+    assert expression.damage_types == ("E", "F")
+    assert dice.parse("2d8+3").label is None
+
+
+def test_label_only():
+    expression = dice.parse("wound")
+    assert not expression
+    assert expression.label == "wound"
+
+
+def test_parse_is_cached():
+    assert dice.parse("1d10 P") is dice.parse("1d10 P")
+
+
+@pytest.mark.parametrize("text", ["101d6", "60d6+41d4", "1d0", "1d1001"])
+def test_invalid_expressions(text):
+    with pytest.raises(exception.InvalidDiceExpression):
+        dice.parse(text)
+
+
+def test_simulate_stays_in_range():
+    expression = dice.parse("2d6+3")
+    samples = expression.simulate(5000, random.Random(7))
+    assert len(samples) == 5000
+    assert min(samples) >= 5
+    assert max(samples) <= 15
+    summary = dice.summarize(samples)
+    assert summary["count"] == 5000
+    assert summary["mean"] == pytest.approx(10, abs=0.2)
+    assert summary["stdev"] == pytest.approx(expression.stdev, abs=0.2)
+
+
+def test_summarize_nothing():
+    assert dice.summarize([]) == {"count": 0}
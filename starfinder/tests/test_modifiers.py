@@ -0,0 +1,99 @@
+import itertools
+
+import pytest
+
+from starfinder.tests import fakes
+from starfinder.tests.fakes import Cache, Record
+
+RACES = (None, 1, 2)
+THEMES = (None, 10, 11)
+FEATS = (100, 101, 102)
+
+
+@pytest.fixture(scope="module")
+def modifiers():
+    with fakes.rules_engine("starfinder.modifiers") as module:
+        yield module
+
+
+@pytest.fixture
+def vectors(modifiers):
+    models = modifiers.models
+    return modifiers.ModifierVectors(Cache({
+        models.Modifier: [
+            Record(id=1, effected_stat="EAC", modification=1),
+            Record(id=2, effected_stat="Ranged", modification=2),
+            Record(id=3, effected_stat="hp", modification=4),
+            Record(id=4, effected_stat="Will", modification=-1),
+            Record(id=5, effected_stat="nothing known", modification=3),
+        ],
+        models.Feat: [Record(id=100, modifier_id=1),
+                      Record(id=101, modifier_id=2),
+                      Record(id=102, modifier_id=5),
+                      Record(id=103, modifier_id=None)],
+        models.ThemeModifier: [Record(id=1, theme_id=10, modifier_id=4)],
+        models.ClassModifier: [Record(id=1, theme_id=10, modifier_id=2),
+                               Record(id=2, theme_id=11, modifier_id=1)],
+        models.RacialTrait: [Record(id=1, race_id=1),
+                             Record(id=2, race_id=1),
+                             Record(id=3, race_id=2)],
+        models.RacialTraitModifier: [
+            Record(id=1, trait_id=1, modifier_id=3),
+            Record(id=2, trait_id=2, modifier_id=3),
+            Record(id=3, trait_id=3, modifier_id=4)],
+    }))
+
+
+@pytest.fixture
+def fresh(modifiers, vectors):
+    """ Totals built from nothing """
+    def fresh(race_id, theme_id, feat_ids):
+        return modifiers.Totals(vectors).sync(race_id, theme_id, feat_ids)
+    return fresh
+
+
+def test_compile_pairs(modifiers):
+    assert modifiers.to_misc(modifiers.compile_pairs(
+        [("EAC", 1), ("eac", 2), ("hp", 0), ("bogus", 5)])) == {"eac": 3}
+
+
+def test_vectors(modifiers, vectors):
+    assert set(vectors.feats) == {100, 101, 102}
+    assert modifiers.to_misc(vectors.feats[102]) == {}
+    assert modifiers.to_misc(vectors.themes[10]) == {"will_save": -1,
+                                                     "ranged_atk": 2}
+    assert modifiers.to_misc(vectors.races[1]) == {"hit_points": 8}
+
+
+def test_totals(fresh):
+    totals = fresh(1, 10, [100, 101, 101])
+    assert totals.misc == {"hit_points": 8, "will_save": -1, "eac": 1,
+                           "ranged_atk": 6}
+
+
+def test_sync_matches_fresh_totals(modifiers, vectors, fresh):
+    totals = modifiers.Totals(vectors)
+    feat_lists = [feat_ids for size in range(3)
+                  for feat_ids in itertools.product(FEATS, repeat=size)]
+    # Every swap from every state, in one long walk
+    for race_id, theme_id, feat_ids in itertools.product(RACES, THEMES,
+                                                         feat_lists):
+        totals.sync(race_id, theme_id, feat_ids)
+        assert totals.vector == fresh(race_id, theme_id, feat_ids).vector
+        assert totals.race_id == race_id
+        assert totals.theme_id == theme_id
+
+
+def test_sync_back_to_nothing(fresh):
+    totals = fresh(2, 11, [100, 100, 101])
+    totals.sync(None, None, ())
+    assert totals.misc == {}
+    assert totals.feat_ids == {}
+
+
+def test_remove_feat_not_added(fresh):
+    totals = fresh(None, None, [100])
+    totals.remove_feat(101)
+    totals.remove_feat(103)
+    assert totals.misc == {"eac": 1}
+    assert totals.feat_ids == {100: 1}
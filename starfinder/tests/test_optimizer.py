@@ -0,0 +1,169 @@
+import itertools
+from concurrent import futures
+
+import pytest
+
+from starfinder import stats
+from starfinder.tests import fakes
+
+NO_ABILITIES = (0,) * 6
+# optimizer.MAX_START_SCORE
+MAX_START_SCORE = 18
+WEIGHTS = {"eac": 2, "ranged_atk": 1, "will_save": 1}
+
+
+def ability(**minimums):
+    return tuple(minimums.get(name, 0) for name in stats.ABILITIES)
+
+
+@pytest.fixture(scope="module")
+def optimizer():
+    with fakes.rules_engine("starfinder.optimizer") as module:
+        yield module
+
+
+@pytest.fixture
+def problem(optimizer):
+    """ A small problem, most of its feats out of reach one way or another """
+    Choice, FeatChoice = optimizer.Choice, optimizer.FeatChoice
+    races = [
+        Choice(1, "Quick", 4, ability(dexterity=2, constitution=-2), {}),
+        Choice(2, "Sturdy", 6, ability(constitution=2, wisdom=2,
+                                       charisma=-2), {"eac": 1}),
+    ]
+    themes = [
+        Choice(10, "Ace", 0, ability(dexterity=1), {}),
+        Choice(11, "Priest", 0, ability(wisdom=1), {"will_save": 1}),
+    ]
+    feats = [
+        FeatChoice(1, "Dodge", {"eac": 1}, ability(dexterity=13), 1, 0, {},
+                   ()),
+        FeatChoice(2, "Mobility", {"eac": 2}, ability(dexterity=15), 1, 0,
+                   {}, (1,)),
+        FeatChoice(3, "Deadly Aim", {"ranged_atk": 2}, NO_ABILITIES, 1, 1,
+                   {}, ()),
+        FeatChoice(4, "Iron Will", {"will_save": 3}, ability(wisdom=14), 1,
+                   0, {}, ()),
+        FeatChoice(5, "Veteran", {"eac": 9}, NO_ABILITIES, 5, 0, {}, ()),
+        FeatChoice(6, "Drill", {"ranged_atk": 3}, NO_ABILITIES, 1, 0,
+                   {7: 3}, ()),
+        FeatChoice(7, "Mysteries", {"eac": 9}, NO_ABILITIES, 1, 0, {8: 1},
+                   ()),
+        FeatChoice(8, "Clumsy", {"eac": -1}, NO_ABILITIES, 1, 0, {}, ()),
+    ]
+
+    def problem(points=4, level=3):
+        return optimizer.Problem(
+            WEIGHTS, level, optimizer.ClassChoice(7, "Soldier", 7, 7),
+            races, themes, feats, points)
+    return problem
+
+
+@pytest.fixture
+def run(optimizer):
+    """ The final top builds, each checked to be legal """
+    def run(problem, **kwargs):
+        events = list(optimizer.optimize(problem, budget=60, **kwargs))
+        kind, builds, totals = events[-1]
+        assert kind == "done"
+        assert totals["complete"]
+        for build in builds:
+            check_legal(problem, build)
+        return builds
+    return run
+
+
+def spends(bases, points):
+    """ Every point buy: spends per ability summing to at most points """
+    if not bases:
+        yield ()
+        return
+    top = min(points, MAX_START_SCORE - bases[0])
+    for spend in range(max(top, 0) + 1):
+        for rest in spends(bases[1:], points - spend):
+            yield (spend,) + rest
+
+
+def feat_sets(problem, scores):
+    """ Every legal set of feats that fits the slots """
+    for size in range(problem.feat_slots + 1):
+        for feat_ids in itertools.combinations(sorted(problem.feats), size):
+            chosen = set(feat_ids)
+            if all(problem.feat_allowed(problem.feats[feat_id], scores) and
+                   chosen.issuperset(problem.feats[feat_id].requires)
+                   for feat_id in feat_ids):
+                yield feat_ids
+
+
+def brute_force(problem):
+    best = float("-inf")
+    for race, theme in itertools.product(problem.races, problem.themes):
+        bases = tuple(10 + r + t for r, t in zip(race.adjustments,
+                                                 theme.adjustments))
+        for spend in spends(bases, problem.points):
+            scores = tuple(base + extra for base, extra in zip(bases, spend))
+            for feat_ids in feat_sets(problem, scores):
+                best = max(best, problem.value(problem.sheet(
+                    race, theme, scores, feat_ids)))
+    return best
+
+
+def check_legal(problem, build):
+    races = {race.id: race for race in problem.races}
+    themes = {theme.id: theme for theme in problem.themes}
+    race, theme = races[build.race], themes[build.theme]
+    bases = [10 + r + t for r, t in zip(race.adjustments, theme.adjustments)]
+    spent = sum(score - base for score, base in zip(build.scores, bases))
+    assert all(base <= score <= MAX_START_SCORE
+               for score, base in zip(build.scores, bases))
+    assert spent + build.unspent == problem.points
+    assert build.feats in set(feat_sets(problem, build.scores))
+    assert build.score == problem.value(problem.sheet(
+        race, theme, build.scores, build.feats))
+
+
+def test_start_score_cap(optimizer):
+    assert optimizer.MAX_START_SCORE == MAX_START_SCORE
+
+
+@pytest.mark.parametrize("points,level", [(4, 3), (2, 1), (3, 4)])
+def test_matches_brute_force(problem, run, points, level):
+    target = problem(points, level)
+    builds = run(target, top=3, executor=False)
+    assert builds[0].score == brute_force(target)
+    assert [build.score for build in builds] == sorted(
+        (build.score for build in builds), reverse=True)
+
+
+def test_odd_ability_prerequisite(optimizer, run):
+    # 13 Charisma doesn't change a modifier, only the feat makes it worth it
+    plain = optimizer.Choice(1, "Plain", 4, NO_ABILITIES, {})
+    charming = optimizer.FeatChoice(1, "Charming", {"eac": 5},
+                                    ability(charisma=13), 1, 0, {}, ())
+    target = optimizer.Problem(
+        WEIGHTS, 1, optimizer.ClassChoice(7, "Soldier", 7, 7), [plain],
+        [plain], [charming], 3)
+    [build] = run(target, top=1, executor=False)
+    assert build.scores == (10, 10, 10, 10, 10, 13)
+    assert build.feats == (1,)
+    assert build.score == brute_force(target)
+
+
+def test_executor(problem, run):
+    target = problem()
+    with futures.ThreadPoolExecutor(2) as executor:
+        builds = run(target, top=1, executor=executor)
+    assert builds[0].score == brute_force(target)
+
+
+def test_out_of_reach_feats(problem, run):
+    [build] = run(problem(), top=1, executor=False)
+    # Veteran needs level 5, Mysteries another class, Clumsy only costs
+    assert not {5, 7, 8} & set(build.feats)
+
+
+def test_expired_budget(optimizer, problem):
+    events = list(optimizer.optimize(problem(), top=1, budget=-1,
+                                     executor=False))
+    assert events == [("done", [], events[-1][2])]
+    assert not events[-1][2]["complete"]
@@ -0,0 +1,190 @@
+import pytest
+
+from starfinder.tests import fakes
+from starfinder.tests.fakes import Cache, Record
+
+SKILL_KEYS = {"acrobatics", "life_science", "mysticsm", "piloting"}
+FEATS = {"weapon focus": 1, "versatile focus": 2}
+CLASSES = {"soldier": 7}
+
+
+@pytest.fixture(scope="module")
+def prerequisites():
+    with fakes.rules_engine("starfinder.prerequisites") as module:
+        yield module
+
+
+@pytest.fixture
+def compile_text(prerequisites):
+    def compile_text(text):
+        return prerequisites.compile_requirements(text, FEATS, CLASSES,
+                                                  SKILL_KEYS)
+    return compile_text
+
+
+@pytest.fixture
+def graph(prerequisites):
+    models = prerequisites.models
+
+    def graph(*feats):
+        return prerequisites.FeatGraph(Cache({
+            models.Feat: feats,
+            models.Class: [Record(id=7, name="Soldier")],
+        }))
+    return graph
+
+
+@pytest.fixture
+def eligibility(prerequisites):
+    def eligibility(feat_graph, owned=(), **values):
+        return prerequisites.Eligibility(
+            feat_graph, values.get("abilities", {}), values.get("level", 1),
+            values.get("class_id"), values.get("base_attack_bonus", 0),
+            values.get("skills", {}), owned)
+    return eligibility
+
+
+def feat(feat_id, name, prereq_text=""):
+    return Record(id=feat_id, name=name, prereq_text=prereq_text,
+                  modifier_id=None)
+
+
+def test_threshold_masks(prerequisites):
+    # Bit 0 needs 3, bit 1 has no requirement
+    masks = prerequisites._threshold_masks({0: 3, 1: 0}, 0b11, 5)
+    assert masks == [0b10, 0b10, 0b10, 0b11, 0b11, 0b11]
+
+
+def test_threshold_masks_shared_minimum(prerequisites):
+    masks = prerequisites._threshold_masks({0: 2, 1: 2, 2: 4}, 0b1111, 4)
+    assert masks == [0b1000, 0b1000, 0b1011, 0b1011, 0b1111]
+
+
+def test_threshold_masks_restricted(prerequisites):
+    # Class masks start from nobody
+    masks = prerequisites._threshold_masks({1: 2}, 0, 3)
+    assert masks == [0, 0, 0b10, 0b10]
+
+
+def test_compile_thresholds(compile_text):
+    requirements = compile_text("Dex 15, base attack bonus +1, Weapon Focus")
+    assert requirements.abilities == {"dexterity": 15}
+    assert requirements.base_attack_bonus == 1
+    assert requirements.feats == {1}
+    assert not requirements.unparsed
+
+
+def test_compile_levels_and_ranks(compile_text):
+    requirements = compile_text("Character level 5th; Soldier level 3 and "
+                                "Piloting 4 ranks")
+    assert requirements.level == 5
+    assert requirements.classes == {7: 3}
+    assert requirements.skills == {"piloting": 4}
+    assert not requirements.unparsed
+
+
+def test_compile_trained(compile_text):
+    assert compile_text("Trained in Mysticism").skills == {"mysticsm": 1}
+    assert compile_text("trained in the Life Science skill").skills == {
+        "life_science": 1}
+    assert compile_text("Trained in Basket Weaving").unparsed == [
+        "Trained in Basket Weaving"]
+
+
+def test_compile_alternatives(compile_text):
+    requirements = compile_text("Int 13 or Wis 13, Weapon Focus (any)")
+    assert requirements.feats == {1}
+    [group] = requirements.any_of
+    assert [alternative.abilities for alternative in group] == [
+        {"intelligence": 13}, {"wisdom": 13}]
+    assert not requirements.unparsed
+
+
+def test_compile_unknown_alternative(compile_text):
+    requirements = compile_text("Weapon Focus or Nonexistent Feat")
+    assert not requirements.any_of
+    assert requirements.unparsed == ["Weapon Focus or Nonexistent Feat"]
+
+
+def test_compile_none(prerequisites, compile_text):
+    empty = prerequisites.Requirements().to_dict()
+    for text in (None, "", "—", "None"):
+        assert compile_text(text).to_dict() == empty
+
+
+def test_static_requirements(graph, eligibility):
+    feat_graph = graph(feat(1, "Toughness"),
+                       feat(2, "Deadly Aim", "Dex 15, base attack bonus +1"),
+                       feat(3, "Veteran", "Character level 5"),
+                       feat(4, "Drill", "Soldier level 3"),
+                       feat(5, "Mystic Strike", "Trained in Mysticism"))
+    assert eligibility(feat_graph).feat_ids() == [1]
+    assert eligibility(
+        feat_graph, abilities={"dexterity": 16}, base_attack_bonus=1,
+        level=5, class_id=7, skills={"mysticsm": 1}).feat_ids() == [
+            1, 2, 3, 4, 5]
+    # Another class at the level doesn't do
+    assert eligibility(feat_graph, level=5, class_id=8).feat_ids() == [1, 3]
+
+
+def test_unparsed_feats_are_never_offered(graph, eligibility):
+    feat_graph = graph(feat(1, "Toughness"),
+                       feat(2, "Strange", "Sing the old songs"))
+    assert feat_graph.unverified == 0b10
+    assert eligibility(feat_graph).feat_ids() == [1]
+
+
+def test_add_and_remove(graph, eligibility):
+    feat_graph = graph(feat(1, "Weapon Focus"),
+                       feat(2, "Versatile Focus", "Weapon Focus"),
+                       feat(3, "Weapon Specialization",
+                            "Versatile Focus, Weapon Focus"))
+    char = eligibility(feat_graph)
+    assert char.feat_ids() == [1]
+    char.add(1)
+    assert char.feat_ids() == [2]
+    char.add(2)
+    assert char.feat_ids() == [3]
+    assert char.qualifies(3)
+    char.remove(2)
+    assert char.feat_ids() == [2]
+    char.remove(1)
+    assert char.feat_ids() == [1]
+    # Unknown feats are ignored
+    char.add(99)
+    char.remove(99)
+    assert char.feat_ids() == [1]
+
+
+def test_add_and_remove_alternatives(graph, eligibility):
+    feat_graph = graph(feat(1, "Mobility"),
+                       feat(2, "Spring Attack"),
+                       feat(3, "Skirmisher", "Mobility or Spring Attack"),
+                       feat(4, "Gifted", "Int 13 or Mobility"))
+    char = eligibility(feat_graph)
+    assert char.feat_ids() == [1, 2]
+    char.add(1)
+    assert char.feat_ids() == [2, 3, 4]
+    char.add(2)
+    assert char.feat_ids() == [3, 4]
+    # Spring Attack alone still unlocks Skirmisher
+    char.remove(1)
+    assert char.feat_ids() == [1, 3]
+    char.remove(2)
+    assert char.feat_ids() == [1, 2]
+    # A non feat alternative that's met needs no feat
+    assert eligibility(feat_graph, abilities={
+        "intelligence": 13}).feat_ids() == [1, 2, 4]
+
+
+def test_owned_at_construction(graph, eligibility):
+    feat_graph = graph(feat(1, "Weapon Focus"),
+                       feat(2, "Versatile Focus", "Weapon Focus"))
+    assert eligibility(feat_graph, owned=[1]).feat_ids() == [2]
+
+
+def test_cycles_are_broken(graph, eligibility):
+    feat_graph = graph(feat(1, "Weapon Focus", "Versatile Focus"),
+                       feat(2, "Versatile Focus", "Weapon Focus"))
+    assert eligibility(feat_graph).feat_ids() in ([1], [2])
+    assert feat_graph.closure(1) | feat_graph.closure(2) in ({1}, {2})
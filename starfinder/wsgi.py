@@ -0,0 +1,116 @@
+"""
+Production WSGI entry point.
+
+Runs the app under gunicorn with the application preloaded in the master:
+templates are compiled and the compendium, search indexes, progression
+tables and spell lists are warmed before forking, so every worker starts hot
+and shares those pages with the master copy-on-write. Each worker drops the
+inherited database connections after the fork and gets a pool sized for its
+own threads.
+
+    web.bind            address to listen on (0.0.0.0:5000)
+    web.workers         worker processes (2 * cores + 1)
+    web.threads         threads per worker (1)
+    web.timeout         worker timeout in seconds (30)
+    web.db.pool.size    connections per worker (web.threads)
+"""
+import gc
+import multiprocessing
+
+from gunicorn.app import base as gunicorn_base
+
+from starfinder import config, flask_app
+
+CONF = config.CONF
+
+
+def _workers():
+    return CONF.get_int("web.workers", multiprocessing.cpu_count() * 2 + 1)
+
+
+def _threads():
+    return CONF.get_int("web.threads", 1)
+
+
+# NOTE: The engine is created when starfinder.db.models is imported, so the
+#       per-worker pool size has to be in place before starfinder_app is.
+flask_app.config['SQLALCHEMY_POOL_SIZE'] = CONF.get_int(
+    "web.db.pool.size", _threads())
+
+# pylint: disable=wrong-import-position
+from starfinder import logging, progression, search, spell_lists, starfinder_app
+from starfinder.db import compendium, models
+
+LOG = logging.get_logger(__name__)
+
+
+def warm(app):
+    """ Compiles every template and loads the compendium-derived structures. """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        compendium.COMPENDIUM.refresh()
+        for kind in search.KINDS:
+            search.SEARCH.index(kind)
+        progression.PROGRESSION.for_class(None)
+        spell_lists.SPELL_LISTS.get(None)
+        models.Session.remove()
+    if hasattr(gc, "freeze"):
+        # Keeps the warmed objects out of later collections so the GC
+        # doesn't touch, and un-share, their pages in the workers
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # pylint: disable=unused-argument
+    # Connections opened by the master while warming must not be shared
+    models.db_engine.get_engine().dispose()
+    # Workers forked after a HUP of the master pick up the current config
+    CONF.reload()
+
+
+def post_worker_init(worker):
+    # pylint: disable=unused-argument
+    # gunicorn resets the worker's signal handlers, so this goes in last
+    CONF.install_reload_signal()
+
+
+class StarfinderApplication(gunicorn_base.BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def options():
+    return {
+        "bind": CONF.get("web.bind", "0.0.0.0:5000"),
+        "workers": _workers(),
+        "threads": _threads(),
+        "timeout": CONF.get_duration("web.timeout", 30),
+        "preload_app": True,
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+    }
+
+
+app = starfinder_app.app
+
+
+def run_server():
+    warm(app)
+    LOG.info("Starting gunicorn with %(workers)s workers x %(threads)s "
+             "threads on %(bind)s", options())
+    StarfinderApplication(app, options()).run()
+
+
+if __name__ == "__main__":
+    run_server()